@@ -0,0 +1,202 @@
+import numpy as np
+from time import perf_counter
+from ranking import top_k
+from index_store import save_index, load_index, IndexFormatError
+
+
+class IVFIndex():
+    """
+    Inverted-file (IVF) index for approximate cosine search.
+
+    Spherical k-means splits the L2-normalized document vectors into `nlist`
+    clusters. A query is compared with the centroids first, and only the
+    documents of the `nprobe` closest clusters are scored exactly. The index
+    keeps only centroids and the cluster order of the rows; the vectors
+    themselves stay in the matrix it was built on.
+
+    Attributes:
+        centroids: Normalized cluster centroids, float32 (nlist x dim).
+        order: Matrix rows grouped by cluster.
+        list_offsets: Start of every cluster in `order` (nlist + 1 entries).
+        nprobe: Default number of clusters scanned per query; higher values
+            give better recall at higher latency.
+        matrix: The normalized document matrix the index refers to.
+    """
+
+    def __init__(self, centroids, order, list_offsets, matrix, nprobe=8):
+        """
+        Initializes the IVFIndex object.
+
+        Args:
+            centroids: Normalized cluster centroids.
+            order: Matrix rows grouped by cluster.
+            list_offsets: Start of every cluster in `order`.
+            matrix: The normalized document matrix.
+            nprobe: Default number of clusters scanned per query.
+        """
+        self.centroids = centroids
+        self.order = order
+        self.list_offsets = list_offsets
+        self.matrix = matrix
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, matrix, nlist=None, nprobe=8, n_iter=20, sample_size=None,
+              chunk_size=65536, seed=0):
+        """
+        Clusters the matrix with spherical k-means and builds the inverted lists.
+
+        Args:
+            matrix: L2-normalized float32 document matrix.
+            nlist: Number of clusters; defaults to 4 * sqrt(number of rows).
+            nprobe: Default number of clusters scanned per query.
+            n_iter: Number of k-means iterations.
+            sample_size: Number of rows k-means is trained on; defaults to
+                256 rows per cluster.
+            chunk_size: Number of rows assigned to clusters at once, bounds
+                the size of the temporary row x centroid score matrix.
+            seed: Seed of the random generator.
+
+        Returns:
+            The built IVFIndex.
+        """
+        rng = np.random.default_rng(seed)
+        num_rows = matrix.shape[0]
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(num_rows)))
+        nlist = min(nlist, num_rows)
+        if sample_size is None:
+            sample_size = 256 * nlist
+        sample = matrix[np.sort(rng.choice(num_rows, min(sample_size, num_rows), replace=False))]
+
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = cls._assign(sample, centroids, chunk_size)
+            order = np.argsort(assignment, kind='stable')
+            counts = np.bincount(assignment, minlength=nlist)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.zeros_like(centroids)
+            sums[counts > 0] = np.add.reduceat(sample[order], starts[counts > 0])
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            sums[~empty] /= norms[~empty, None]
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+            centroids = sums.astype(np.float32)
+
+        assignment = cls._assign(matrix, centroids, chunk_size)
+        order = np.argsort(assignment, kind='stable')
+        list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=nlist))))
+        return cls(centroids, order, list_offsets, matrix, nprobe)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size):
+        """Returns the closest centroid of every vector, processed in chunks."""
+        assignment = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = vectors[start:start + chunk_size] @ centroids.T
+            assignment[start:start + chunk_size] = np.argmax(block, axis=1)
+        return assignment
+
+    def save(self, path, doc_ids):
+        """
+        Saves the index structure (not the document matrix) to an index directory.
+
+        Args:
+            path: Index directory to save the index to.
+            doc_ids: Document id of every row of the matrix.
+        """
+        save_index(path, 'ivf', {'centroids': self.centroids, 'order': self.order,
+                                 'list_offsets': self.list_offsets, 'doc_ids': doc_ids},
+                   meta={'nprobe': self.nprobe, 'num_rows': int(self.order.shape[0])})
+
+    @classmethod
+    def load(cls, path, matrix, doc_ids):
+        """
+        Opens an index saved with `save`.
+
+        Args:
+            path: Index directory to load the index from.
+            matrix: The normalized document matrix the index was built on.
+            doc_ids: Document ids of the matrix rows the index must match.
+
+        Returns:
+            The loaded IVFIndex.
+
+        Raises:
+            IndexFormatError: If the index was built for a matrix of another
+                size or for other documents.
+        """
+        arrays, manifest = load_index(path, 'ivf')
+        if manifest['meta']['num_rows'] != matrix.shape[0]:
+            raise IndexFormatError(f"{path} was built for {manifest['meta']['num_rows']} rows, "
+                                   f"the matrix has {matrix.shape[0]}")
+        if 'doc_ids' not in arrays or not np.array_equal(arrays['doc_ids'], doc_ids):
+            raise IndexFormatError(f"{path} was built for other documents")
+        return cls(arrays['centroids'], arrays['order'], arrays['list_offsets'],
+                   matrix, manifest['meta']['nprobe'])
+
+    def search(self, query, k, nprobe=None):
+        """
+        Finds approximate nearest neighbours of one normalized query vector.
+
+        Args:
+            query: L2-normalized query vector.
+            k: Number of neighbours to return.
+            nprobe: Number of clusters to scan; defaults to `self.nprobe`.
+
+        Returns:
+            Tuple of matrix row indices and cosine similarities, ordered by
+            descending similarity.
+        """
+        nprobe = self.nprobe if nprobe is None else nprobe
+        lists, _ = top_k(self.centroids @ query, nprobe)
+        candidates = np.concatenate([self.order[self.list_offsets[idx]:self.list_offsets[idx + 1]]
+                                     for idx in lists])
+        rows, scores = top_k(self.matrix[candidates] @ query, k)
+        return candidates[rows], scores
+
+
+def recall_at_k(exact_ids, approx_ids):
+    """
+    Computes the mean share of exact top-k results found by an approximate search.
+
+    Args:
+        exact_ids: List of exact result id arrays, one per query.
+        approx_ids: List of approximate result id arrays, one per query.
+
+    Returns:
+        Mean recall@k over all queries.
+    """
+    recalls = [len(np.intersect1d(exact, approx)) / max(len(exact), 1)
+               for exact, approx in zip(exact_ids, approx_ids)]
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+def recall_report(index, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    """
+    Compares the IVF index with exact brute-force search on the same queries.
+
+    Args:
+        index: IVFIndex to evaluate.
+        queries: L2-normalized query vectors (one per row).
+        k: Number of neighbours per query.
+        nprobes: Values of nprobe to evaluate.
+
+    Returns:
+        List of dictionaries with nprobe, recall@k and mean latency in ms;
+        the first entry (nprobe=None) is the exact search.
+    """
+    exact_ids = []
+    start = perf_counter()
+    for query in queries:
+        exact_ids.append(top_k(index.matrix @ query, k)[0])
+    report = [{'nprobe': None, 'recall': 1.0,
+               'latency_ms': (perf_counter() - start) * 1000 / max(len(queries), 1)}]
+    for nprobe in nprobes:
+        approx_ids = []
+        start = perf_counter()
+        for query in queries:
+            approx_ids.append(index.search(query, k, nprobe)[0])
+        report.append({'nprobe': nprobe, 'recall': recall_at_k(exact_ids, approx_ids),
+                       'latency_ms': (perf_counter() - start) * 1000 / max(len(queries), 1)})
+    return report
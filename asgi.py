@@ -0,0 +1,79 @@
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app import (app as flask_app, parse_search_request, search_response, parse_batch_request, batch_response,
+                 parse_autocomplete_request, autocomplete_response, scoring)
+from executor import Overloaded
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from fastapi.middleware.wsgi import WSGIMiddleware
+
+
+# Асинхронный режим: uvicorn asgi:app --workers 2
+# JSON API обслуживается здесь, поиск выполняется в ограниченном пуле потоков `scoring` из app.py
+# (search_response и batch_response сами ставят оценку в пул, здесь они только не блокируют цикл событий);
+# остальные маршруты (страницы, лайки, комментарии, закладки) отдает Flask-приложение,
+# и HTML-страница /search тоже ищет через этот пул.
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    scoring.shutdown(wait=False)
+
+
+app = FastAPI(title='news_searcher', lifespan=lifespan)
+
+
+async def run_scoring(fn, *args):
+    """
+    Выполняет поиск вне цикла событий; оценка идет в пуле `scoring`: 503 при переполненной очереди,
+    504 по таймауту.
+    """
+    try:
+        return await asyncio.to_thread(fn, *args)
+    except Overloaded:
+        return JSONResponse({'error': 'server is overloaded, retry later'}, status_code=503,
+                            headers={'Retry-After': '1'})
+    except (asyncio.TimeoutError, FutureTimeoutError):
+        return JSONResponse({'error': 'search timed out'}, status_code=504)
+
+
+@app.get('/api/search')
+async def api_search(request: Request):
+    try:
+        params = parse_search_request(request.query_params)
+    except (TypeError, ValueError) as ex:
+        return JSONResponse({'error': f'bad request: {ex}'}, status_code=400)
+    return await run_scoring(search_response, *params)
+
+
+@app.post('/api/search/batch')
+async def api_search_batch(request: Request):
+    try:
+        params = parse_batch_request(await request.json())
+    except (TypeError, ValueError) as ex:
+        return JSONResponse({'error': f'bad request: {ex}'}, status_code=400)
+    return await run_scoring(batch_response, *params)
+
+
+# Подсказки занимают доли миллисекунды и отвечаются сразу, без пула потоков
+@app.get('/api/autocomplete')
+async def api_autocomplete(request: Request):
+    try:
+        params = parse_autocomplete_request(request.query_params)
+    except (TypeError, ValueError) as ex:
+        return JSONResponse({'error': f'bad request: {ex}'}, status_code=400)
+    return autocomplete_response(*params)
+
+
+@app.get('/api/executor/stats')
+async def executor_stats():
+    return scoring.stats()
+
+
+app.mount('/', WSGIMiddleware(flask_app))
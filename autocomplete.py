@@ -0,0 +1,282 @@
+import numpy as np
+from bisect import bisect_left
+from datetime import datetime
+from preprocessing import doc_info, text_lowercase, remove_punctuation, get_tokens
+from index_store import save_index, load_index, IndexFormatError
+from ranking import top_k
+from metrics import stage
+
+
+def pack_strings(strings):
+    """
+    Concatenates UTF-8 strings into one byte array.
+
+    Args:
+        strings: List of bytes.
+
+    Returns:
+        Tuple of the uint8 array and the int64 offsets (one more than strings).
+    """
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in strings])
+    return np.frombuffer(b''.join(strings), dtype=np.uint8).copy(), offsets
+
+
+class PackedStrings():
+    """
+    Read-only sorted sequence of strings packed with `pack_strings`.
+
+    Every `step`-th string is kept in a Python list, so a binary search
+    first runs in C over the sample and then reads at most `log2(step)`
+    strings of the (possibly memory-mapped) packed array.
+    """
+
+    def __init__(self, blob, offsets, step=64):
+        self.blob = np.asarray(blob)  # plain views of memory maps: slicing np.memmap objects is slow
+        self.offsets = np.asarray(offsets)
+        self.step = step
+        self.sample = [self[idx] for idx in range(0, len(self), step)]
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, idx):
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].tobytes()
+
+    def bisect(self, key):
+        """Returns the position of the first string >= key."""
+        block = bisect_left(self.sample, key)
+        lo = max(block - 1, 0) * self.step
+        hi = min(block * self.step, len(self))
+        return bisect_left(self, key, lo, hi)
+
+
+class PrefixIndex():
+    """
+    Weighted strings searchable by prefix.
+
+    The strings are sorted by their UTF-8 bytes and packed into one byte
+    array with offsets, so all strings starting with a prefix form a
+    contiguous range found by two binary searches. Small ranges are ranked
+    directly; for the few prefixes matching more than `threshold` strings
+    the best completions are precomputed at build time. A lookup thus
+    touches at most `threshold` weights, and the arrays can be memory-mapped.
+
+    Attributes:
+        strings: PackedStrings of the sorted strings.
+        weights: float32 weight of every string.
+        heavy: PackedStrings of the sorted prefixes with precomputed completions.
+        heavy_top: Indices of the best strings of every heavy prefix, by
+            descending weight, padded with -1.
+        threshold: Largest range that is ranked at lookup time.
+    """
+
+    def __init__(self, blob, offsets, weights, heavy_blob, heavy_offsets, heavy_top, threshold):
+        """
+        Initializes the PrefixIndex object from its arrays (see `build`).
+
+        Args:
+            blob: uint8 array of the packed sorted strings.
+            offsets: Offsets of the strings in `blob`.
+            weights: Weight of every string.
+            heavy_blob: uint8 array of the packed heavy prefixes.
+            heavy_offsets: Offsets of the heavy prefixes in `heavy_blob`.
+            heavy_top: Best string indices of every heavy prefix.
+            threshold: Largest range that is ranked at lookup time.
+        """
+        self.strings = PackedStrings(blob, offsets)
+        self.weights = np.asarray(weights)
+        self.heavy = PackedStrings(heavy_blob, heavy_offsets)
+        self.heavy_top = np.asarray(heavy_top)
+        self.threshold = threshold
+
+    def __len__(self):
+        return len(self.strings)
+
+    @classmethod
+    def build(cls, weighted, max_completions=16, threshold=256):
+        """
+        Builds the index.
+
+        Args:
+            weighted: Dictionary of string -> weight.
+            max_completions: Number of completions precomputed for heavy prefixes.
+            threshold: Largest range that is ranked at lookup time.
+
+        Returns:
+            The PrefixIndex.
+        """
+        items = sorted((string.encode('utf-8'), weight) for string, weight in weighted.items())
+        strings = [string for string, _ in items]
+        weights = np.array([weight for _, weight in items], dtype=np.float32)
+        heavy, tops = [], []
+        stack = [(b'', 0, len(strings))]
+        while stack:
+            prefix, lo, hi = stack.pop()
+            depth = len(prefix)
+            while lo < hi and len(strings[lo]) == depth:
+                lo += 1
+            while lo < hi:
+                child = prefix + strings[lo][depth:depth + 1]
+                end = bisect_left(strings, child + b'\xff', lo, hi)
+                if end - lo > threshold:
+                    indices, _ = top_k(weights[lo:end], max_completions)
+                    heavy.append(child)
+                    tops.append(indices + lo)
+                    stack.append((child, lo, end))
+                lo = end
+        order = sorted(range(len(heavy)), key=heavy.__getitem__)
+        heavy_top = np.full((len(heavy), max_completions), -1, dtype=np.int64)
+        for row, idx in enumerate(order):
+            heavy_top[row, :len(tops[idx])] = tops[idx]  # fewer than max_completions if threshold is smaller
+        return cls(*pack_strings(strings), weights, *pack_strings([heavy[idx] for idx in order]), heavy_top,
+                   threshold)
+
+    def arrays(self, name):
+        """Returns the arrays to save, with names prefixed by `name`."""
+        return {f'{name}_blob': self.strings.blob, f'{name}_offsets': self.strings.offsets,
+                f'{name}_weights': self.weights, f'{name}_heavy_blob': self.heavy.blob,
+                f'{name}_heavy_offsets': self.heavy.offsets, f'{name}_heavy_top': self.heavy_top}
+
+    @classmethod
+    def from_arrays(cls, arrays, name, threshold):
+        """Opens an index from arrays saved with `arrays`."""
+        return cls(*(arrays[f'{name}_{part}'] for part in ('blob', 'offsets', 'weights', 'heavy_blob',
+                                                            'heavy_offsets', 'heavy_top')), threshold)
+
+    def top(self, prefix, k=10):
+        """
+        Returns the heaviest strings starting with a prefix.
+
+        Args:
+            prefix: The prefix.
+            k: Number of completions; at most the number precomputed for
+                heavy prefixes.
+
+        Returns:
+            List of tuples (string, weight) by descending weight.
+        """
+        key = prefix.encode('utf-8')
+        lo = self.strings.bisect(key)
+        hi = self.strings.bisect(key + b'\xff')
+        row = self.heavy.bisect(key) if hi - lo > self.threshold else len(self.heavy)
+        if row < len(self.heavy) and self.heavy[row] == key:
+            indices = self.heavy_top[row, :k]
+            indices = indices[indices >= 0]
+        else:
+            indices, _ = top_k(self.weights[lo:hi], min(k, self.heavy_top.shape[1]))
+            indices = indices + lo
+        return [(self.strings[idx].decode('utf-8'), float(self.weights[idx])) for idx in indices.tolist()]
+
+
+def normalize_query(text):
+    """Lowercases a query, drops punctuation and collapses whitespace."""
+    return ' '.join(get_tokens(remove_punctuation(text_lowercase(text))))
+
+
+class Autocomplete():
+    """
+    Query autocompletion from the corpus vocabulary and past queries.
+
+    The last word being typed is completed with the lemmas of the
+    `CountVectorizer` vocabulary weighted by document frequency, and the
+    whole input with the past queries of an optional QueryLog, weighted by
+    their number of occurrences times `query_weight`. Both are PrefixIndex
+    objects saved in one index directory and memory-mapped, so every
+    worker shares them through the page cache. The index is rebuilt when
+    the vocabulary or the parameters change, and, to pick up new queries,
+    when it is older than `max_age` seconds; the rebuild reads the
+    aggregated query counts, never a raw log.
+
+    Attributes:
+        docs_info: Object containing information about the documents.
+        query_log: QueryLog with the counts of past queries, or None.
+        lemmas: PrefixIndex of the lemmas.
+        queries: PrefixIndex of the past queries, or None.
+    """
+
+    def __init__(self, index_dir='autocomplete_index', docs_info=doc_info, query_log=None, min_query_count=2,
+                 query_weight=10.0, max_completions=16, threshold=256, max_age=86400.0):
+        """
+        Opens the autocomplete index, building it if it is missing or stale.
+
+        Args:
+            index_dir: Index directory.
+            docs_info: Object containing information about the documents.
+            query_log: Optional QueryLog with the counts of past queries.
+            min_query_count: Queries seen fewer times are not suggested, so
+                one-off queries are never shown to other users.
+            query_weight: Weight of one occurrence of a past query, in documents.
+            max_completions: Largest number of completions returned.
+            threshold: Largest prefix range that is ranked at lookup time.
+            max_age: Age in seconds after which an index with past queries is rebuilt.
+        """
+        self.docs_info = docs_info
+        self.query_log = query_log
+        self.params = {'min_query_count': min_query_count, 'query_weight': query_weight,
+                       'max_completions': max_completions, 'threshold': threshold,
+                       'query_log': query_log is not None}
+        vocabulary = self.docs_info.vectorizer.vocabulary_
+        try:
+            arrays, manifest = load_index(index_dir, 'autocomplete', vocabulary=vocabulary)
+            if manifest['meta'] != self.params:
+                raise IndexFormatError(f"{index_dir} was built with other parameters")
+            age = (datetime.utcnow() - datetime.fromisoformat(manifest['created_at'])).total_seconds()
+            if query_log is not None and age > max_age:
+                raise IndexFormatError(f"{index_dir} is older than {max_age} seconds")
+        except (FileNotFoundError, IndexFormatError):
+            self.build(index_dir)
+            return
+        self.lemmas = PrefixIndex.from_arrays(arrays, 'lemmas', threshold)
+        self.queries = PrefixIndex.from_arrays(arrays, 'queries', threshold) if 'queries_blob' in arrays else None
+
+    def build(self, index_dir='autocomplete_index'):
+        """
+        Builds and saves the index.
+
+        Args:
+            index_dir: Index directory.
+        """
+        vocabulary = self.docs_info.vectorizer.vocabulary_
+        df = np.bincount(self.docs_info.vectors.indices, minlength=len(vocabulary))
+        self.lemmas = PrefixIndex.build({lemma: df[column] for lemma, column in vocabulary.items()},
+                                        self.params['max_completions'], self.params['threshold'])
+        arrays = self.lemmas.arrays('lemmas')
+        self.queries = None
+        if self.query_log is not None:
+            counts = self.query_log.counts(self.params['min_query_count'])
+            self.queries = PrefixIndex.build({query: count * self.params['query_weight']
+                                              for query, count in counts.items()},
+                                             self.params['max_completions'], self.params['threshold'])
+            arrays.update(self.queries.arrays('queries'))
+        save_index(index_dir, 'autocomplete', arrays, meta=self.params, vocabulary=vocabulary)
+
+    def complete(self, text, k=10):
+        """
+        Suggests completions of a partial query.
+
+        Past queries starting with the input come first if they are heavier;
+        the last word is completed with lemmas, keeping the words before it.
+        After a trailing space only past queries are suggested.
+
+        Args:
+            text: The partial query.
+            k: Number of completions; at most `max_completions`.
+
+        Returns:
+            List of tuples (completion, weight) by descending weight.
+        """
+        with stage('complete', 'autocomplete'):
+            normalized = normalize_query(text)
+            if not normalized:
+                return []
+            completions = {}
+            if self.queries is not None:
+                prefix = normalized + ' ' if text[-1:].isspace() else normalized
+                completions.update(self.queries.top(prefix, k))
+            if not text[-1:].isspace():
+                head, _, last = normalized.rpartition(' ')
+                for lemma, weight in self.lemmas.top(last, k):
+                    completion = f'{head} {lemma}' if head else lemma
+                    completions[completion] = max(completions.get(completion, 0.0), weight)
+            return sorted(completions.items(), key=lambda item: -item[1])[:k]
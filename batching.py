@@ -0,0 +1,154 @@
+import queue
+import threading
+from concurrent.futures import Future
+from time import perf_counter
+from preprocessing import doc_info
+
+
+class MicroBatcher():
+    """
+    Request coalescer in front of a searcher with `search_ids_many`.
+
+    Queries arriving from concurrent callers are collected for up to
+    `window_ms` milliseconds or until `max_batch` queries are waiting, then
+    scored together with one matrix-matrix product, and every caller gets
+    its own top-k. While a batch is being scored, new queries queue up and
+    form the next batch, so under load batches grow by themselves; with a
+    single caller the added latency is at most the window.
+
+    Attributes:
+        searcher: TfidfSearcher or FastTextSearcher.
+        window_ms: How long the first query of a batch waits for others.
+        max_batch: Maximum number of queries scored together.
+        docs_info: Object containing information about the documents.
+        batches: Number of scored batches.
+        queries: Number of scored queries.
+    """
+
+    def __init__(self, searcher, window_ms=2.0, max_batch=32, docs_info=doc_info):
+        """
+        Initializes the MicroBatcher object.
+
+        Args:
+            searcher: Searcher with a `search_ids_many(texts, n)` method.
+            window_ms: How long the first query of a batch waits for others.
+            max_batch: Maximum number of queries scored together.
+            docs_info: Object containing information about the documents.
+        """
+        self.searcher = searcher
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.docs_info = docs_info
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        """Starts the batching thread on first use."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, text, n=10):
+        """
+        Queues a query for the next batch.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+
+        Returns:
+            concurrent.futures.Future resolving to the list of tuples
+            (score, document id).
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, n, future))
+        return future
+
+    def search_ids(self, text, n=10, filters=None):
+        """
+        Searches through the next batch and waits for the result.
+
+        Filtered queries score only their own subset of documents, so they
+        are not batched and go directly to the searcher.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+            filters: Dictionary of date and rubric filters (see `Docs.select`).
+
+        Returns:
+            List of tuples containing the score and the document id.
+        """
+        if filters:
+            return self.searcher.search_ids_many([text], n, filters=filters)[0]
+        return self.submit(text, n).result()
+
+    def search_ids_many(self, texts, n=10, filters=None):
+        """Scores a batch that is already formed directly with the searcher."""
+        return self.searcher.search_ids_many(texts, n, filters=filters)
+
+    def search(self, text, n=10):
+        """
+        Searches through the next batch and returns document texts.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples containing the score and the text of the document.
+        """
+        results = self.search_ids(text, n)
+        return list(zip([score for score, _ in results], self.docs_info.texts([index for _, index in results])))
+
+    def _collect(self):
+        """Waits for a query and gathers the batch it opens."""
+        batch = [self._queue.get()]
+        deadline = perf_counter() + self.window_ms / 1000
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - perf_counter()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [item for item in self._collect() if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            n = max(item[1] for item in batch)
+            try:
+                results = self.searcher.search_ids_many([item[0] for item in batch], n)
+            except Exception as ex:
+                for _, _, future in batch:
+                    future.set_exception(ex)
+                continue
+            for (_, k, future), result in zip(batch, results):
+                future.set_result(result[:k])
+            with self._lock:
+                self.batches += 1
+                self.queries += len(batch)
+
+    def stats(self):
+        """
+        Returns the batching counters.
+
+        Returns:
+            Dictionary with the window, batch limit, number of batches and
+            queries and the mean batch size.
+        """
+        with self._lock:
+            return {
+                'window_ms': self.window_ms,
+                'max_batch': self.max_batch,
+                'batches': self.batches,
+                'queries': self.queries,
+                'mean_batch_size': self.queries / self.batches if self.batches else 0.0,
+            }
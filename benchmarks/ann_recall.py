@@ -0,0 +1,65 @@
+"""Recall@k and latency of the IVF index against exact FastText search.
+
+By default the report runs on synthetic clustered 300-d vectors, so it
+needs neither the corpus nor the FastText model:
+
+    python -m benchmarks.ann_recall
+
+With --fasttext it loads FastTextSearcher and uses the lines of a query
+file (one query per line) against the real index:
+
+    python -m benchmarks.ann_recall --fasttext --queries queries.txt
+"""
+import argparse
+import numpy as np
+from time import perf_counter
+from ann import IVFIndex, recall_report
+
+
+def synthetic_matrix(num_rows, dim=300, num_topics=200, noise=0.6, seed=0):
+    """Generates normalized vectors scattered around random topic directions."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    matrix = topics[rng.integers(num_topics, size=num_rows)]
+    matrix += noise * rng.standard_normal((num_rows, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def print_report(report, k):
+    print(f"{'nprobe':>8} {f'recall@{k}':>10} {'latency, ms':>12}")
+    for row in report:
+        nprobe = 'exact' if row['nprobe'] is None else row['nprobe']
+        print(f"{nprobe:>8} {row['recall']:>10.3f} {row['latency_ms']:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--queries-count', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--fasttext', action='store_true')
+    parser.add_argument('--queries', default='')
+    args = parser.parse_args()
+
+    if args.fasttext:
+        from searcher_fasttext import FastTextSearcher
+        searcher = FastTextSearcher(fasttext_index_matrix='fasttext_index')
+        with open(args.queries, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries, valid = searcher.query_matrix(texts)
+        matrix, queries = searcher.matrix, queries[valid]
+    else:
+        matrix = synthetic_matrix(args.rows)
+        queries = synthetic_matrix(args.queries_count, seed=1)
+
+    start = perf_counter()
+    index = IVFIndex.build(matrix, nlist=args.nlist)
+    print(f"built IVF with {index.centroids.shape[0]} lists over {matrix.shape[0]} rows "
+          f"in {perf_counter() - start:.1f} sec")
+    print_report(recall_report(index, queries, args.k), args.k)
+
+
+if __name__ == "__main__":
+    main()
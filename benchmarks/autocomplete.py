@@ -0,0 +1,87 @@
+"""Latency and size of prefix autocompletion.
+
+Builds a PrefixIndex over a synthetic vocabulary of made-up words with
+Zipf-distributed document frequencies (or over the vocabulary of the
+corpus with --corpus), saves it, opens it memory-mapped and reports the
+build time, the size on disk, the Python-heap memory kept per process and
+the p50/p99 lookup latency by prefix length. Results are checked against
+a linear scan. Run from the repository root:
+
+    python -m benchmarks.autocomplete --terms 1000000
+    python -m benchmarks.autocomplete --corpus
+"""
+import argparse
+import sys
+import tempfile
+import numpy as np
+from time import perf_counter
+from autocomplete import PrefixIndex
+from benchmarks.search import SYLLABLES, dir_size
+from index_store import save_index, load_index
+
+
+def synthetic_vocabulary(num_terms, seed=0):
+    """Generates distinct made-up words with Zipf-distributed weights."""
+    rng = np.random.default_rng(seed)
+    terms = set()
+    while len(terms) < num_terms:
+        terms.update(''.join(rng.choice(SYLLABLES, rng.integers(2, 7))) for _ in range(num_terms - len(terms)))
+    weights = np.minimum(rng.zipf(1.5, num_terms), 10 ** 6).astype(np.float64)
+    return dict(zip(sorted(terms), weights))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--terms', type=int, default=1_000_000)
+    parser.add_argument('--corpus', action='store_true', help='use the vocabulary of the corpus in corpus_artifacts')
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--threshold', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.corpus:
+        from preprocessing import doc_info
+        vocabulary = doc_info.vectorizer.vocabulary_
+        df = np.bincount(doc_info.vectors.indices, minlength=len(vocabulary))
+        weighted = {term: float(df[column]) for term, column in vocabulary.items()}
+    else:
+        weighted = synthetic_vocabulary(args.terms, args.seed)
+
+    start = perf_counter()
+    index = PrefixIndex.build(weighted, threshold=args.threshold)
+    build_seconds = perf_counter() - start
+    with tempfile.TemporaryDirectory() as workdir:
+        save_index(workdir, 'autocomplete', index.arrays('terms'))
+        start = perf_counter()
+        arrays, _ = load_index(workdir, 'autocomplete')
+        index = PrefixIndex.from_arrays(arrays, 'terms', args.threshold)
+        load_seconds = perf_counter() - start
+        size = dir_size(workdir)
+        heap = sys.getsizeof(index.strings.sample) + sum(sys.getsizeof(s) for s in index.strings.sample)
+        print(f"{len(index)} terms, {len(index.heavy)} heavy prefixes, build {build_seconds:.2f} s, "
+              f"open {load_seconds * 1000:.1f} ms, {size / 2**20:.1f} MB on disk, {heap / 2**20:.2f} MB heap")
+
+        rng = np.random.default_rng(args.seed)
+        terms = list(weighted)
+        print(f"{'prefix':>7} {'p50, us':>8} {'p99, us':>8} {'correct':>8}")
+        for length in range(1, 6):
+            prefixes = [term[:length] for term in rng.choice(terms, args.lookups)]
+            for prefix in prefixes[:50]:
+                index.top(prefix, args.k)
+            latencies = []
+            for prefix in prefixes:
+                start = perf_counter()
+                index.top(prefix, args.k)
+                latencies.append((perf_counter() - start) * 1e6)
+            correct = 0
+            for prefix in prefixes[:20]:
+                expected = sorted((weight for term, weight in weighted.items() if term.startswith(prefix)),
+                                  reverse=True)[:args.k]
+                correct += [weight for _, weight in index.top(prefix, args.k)] == expected
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f"{length:>7} {p50:>8.1f} {p99:>8.1f} {correct:>5}/20", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Throughput and tail latency of micro-batched search against per-query scoring.
+
+Concurrent clients send queries to a synthetic dense index (the shape of
+the FastText matrix) either directly or through MicroBatcher with several
+batching windows. Run from the repository root:
+
+    python -m benchmarks.batching
+    python -m benchmarks.batching --docs 500000 --clients 32 --windows 0 1 2 5
+"""
+import argparse
+import threading
+import numpy as np
+from time import perf_counter
+from batching import MicroBatcher
+from ranking import top_k
+
+
+class SyntheticSearcher():
+    """Exact cosine search over random unit vectors; queries are row numbers of `queries`."""
+
+    def __init__(self, num_docs, dim, num_queries, seed=0):
+        rng = np.random.default_rng(seed)
+        self.matrix = rng.standard_normal((num_docs, dim), dtype=np.float32)
+        self.matrix /= np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        self.queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+        self.queries /= np.linalg.norm(self.queries, axis=1, keepdims=True)
+
+    def search_ids_many(self, texts, n=10):
+        cos_sim_matrix = self.queries[list(texts)] @ self.matrix.T
+        results = []
+        for cos_sim_array in cos_sim_matrix:
+            indices, scores = top_k(cos_sim_array, n)
+            results.append(list(zip(scores.tolist(), indices.tolist())))
+        return results
+
+    def search_ids(self, text, n=10):
+        return self.search_ids_many([text], n)[0]
+
+
+def run_clients(search_ids, num_clients, queries_per_client, num_queries, n):
+    """Runs closed-loop clients and returns the elapsed time and all latencies in milliseconds."""
+    latencies = [[] for _ in range(num_clients)]
+
+    def client(idx):
+        rng = np.random.default_rng(idx)
+        for query in rng.integers(0, num_queries, queries_per_client):
+            start = perf_counter()
+            search_ids(int(query), n)
+            latencies[idx].append((perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, args=(idx,)) for idx in range(num_clients)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return perf_counter() - start, np.concatenate([np.asarray(values) for values in latencies])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=300)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--queries-per-client', type=int, default=50)
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 1, 2, 5])
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('-n', type=int, default=10)
+    args = parser.parse_args()
+
+    searcher = SyntheticSearcher(args.docs, args.dim, num_queries=1000)
+    searcher.search_ids(0, args.n)
+    print(f"{args.docs} docs x {args.dim} dims, {args.clients} clients, max batch {args.max_batch}")
+    print(f"{'mode':>16} {'QPS':>8} {'p50, ms':>9} {'p99, ms':>9} {'batch':>6}")
+    modes = [('per query', searcher, None)]
+    for window in args.windows:
+        batcher = MicroBatcher(searcher, window_ms=window, max_batch=args.max_batch, docs_info=None)
+        modes.append((f'window {window:g} ms', batcher, batcher))
+    for name, target, batcher in modes:
+        elapsed, latencies = run_clients(target.search_ids, args.clients, args.queries_per_client, 1000, args.n)
+        batch = batcher.stats()['mean_batch_size'] if batcher is not None else 1.0
+        print(f"{name:>16} {latencies.shape[0] / elapsed:>8.0f} {np.percentile(latencies, 50):>9.2f} "
+              f"{np.percentile(latencies, 99):>9.2f} {batch:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Near-duplicate collapsing: index size and latency with and without it.
+
+Builds a synthetic corpus with injected near-duplicates (copies of
+articles with a few words replaced, as in syndicated news) or takes a
+sample of the CSV corpus, and builds the TF-IDF index over it once with
+MinHash/LSH deduplication and once without. Reports the duplicate
+clusters, the time spent on deduplication, the index size and the
+p50/p99 query latency of both indexes, and the share of duplicates the
+undeduplicated index returns in its top-k. Run from the repository root:
+
+    python -m benchmarks.dedup --docs 20000 --duplicate-share 0.1
+    python -m benchmarks.dedup --csv ria-2023.csv --docs 50000
+"""
+import argparse
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from benchmarks.search import synthetic_corpus, subsample_corpus, make_queries, dir_size, latency_stats
+from dedup import dedup_report
+from preprocessing import Docs
+from search_tfidf import TfidfSearcher
+
+
+def inject_duplicates(df, share, edits=3, seed=0):
+    """Appends copies of random articles with `edits` words replaced by words of other articles."""
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, df.shape[0], int(df.shape[0] * share))
+    texts = []
+    for source in sources:
+        words = df['text'].iloc[source].split()
+        donor = df['text'].iloc[int(rng.integers(0, df.shape[0]))].split()
+        for position in rng.integers(0, len(words), edits):
+            words[position] = donor[int(rng.integers(0, len(donor)))]
+        texts.append(' '.join(words))
+    copies = df.iloc[sources].copy()
+    copies['text'] = texts
+    copies['url'] = [f'{url}?copy={idx}' for idx, url in enumerate(copies['url'])]
+    return pd.concat([df, copies], ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', help='CSV corpus to sample instead of synthetic documents')
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--duplicate-share', type=float, default=0.1,
+                        help='near-duplicates injected into the synthetic corpus, as a share of --docs')
+    parser.add_argument('--threshold', type=float, default=0.8)
+    parser.add_argument('--num-queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.csv:
+        df = subsample_corpus(args.csv, args.docs, args.seed)
+    else:
+        df = inject_duplicates(synthetic_corpus(args.docs, seed=args.seed), args.duplicate_share, seed=args.seed)
+    queries = make_queries(df['text'].tolist(), args.num_queries, args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'corpus.csv')
+        df.to_csv(csv_path, index=False)
+        print(f"{df.shape[0]} documents, {len(queries)} queries")
+        print(f"{'dedup':>6} {'dedup, s':>9} {'indexed':>8} {'nnz':>10} {'index, MB':>10} "
+              f"{'p50, ms':>8} {'p99, ms':>8}")
+        found = {}
+        for name, threshold in (('off', None), ('on', args.threshold)):
+            docs = Docs(path=csv_path, artifacts_dir=os.path.join(workdir, f'artifacts_{name}'),
+                        dedup_threshold=threshold)
+            docs.vectors
+            start = perf_counter()
+            canonical = docs.canonical
+            dedup_seconds = perf_counter() - start
+            index_dir = os.path.join(workdir, f'tfidf_{name}')
+            searcher = TfidfSearcher(matrix_file_name=index_dir, docs_info=docs)
+            results, latency = latency_stats(searcher.search_ids, queries, args.k)
+            found[name] = np.array([doc_id for result in results for _, doc_id in result], dtype=np.int64)
+            matrix = searcher.tfidf_matrix
+            print(f"{name:>6} {dedup_seconds:>9.2f} {matrix.shape[0]:>8} {matrix.nnz:>10} "
+                  f"{dir_size(index_dir) / 2**20:>10.1f} {latency['p50_ms']:>8.2f} {latency['p99_ms']:>8.2f}",
+                  flush=True)
+        print(f"clusters: {dedup_report(canonical, np.diff(docs.vectors.indptr))}")
+        duplicates = float(np.mean(canonical[found['off']] != found['off'])) if found['off'].shape[0] else 0.0
+        print(f"share of duplicates in the top-{args.k} without dedup: {duplicates:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Query latency with date and rubric filters of different selectivity.
+
+Builds a synthetic corpus (or takes a sample of the CSV corpus) whose
+articles are spread over a year and several rubrics, and measures the
+p50/p99 latency of TF-IDF and BM25 without a filter and with filters that
+keep a shrinking share of the documents. Filters are applied before
+scoring, so narrow filters should be faster than the unfiltered search.
+Run from the repository root:
+
+    python -m benchmarks.filters --docs 50000
+    python -m benchmarks.filters --csv ria-2023.csv --docs 100000
+"""
+import argparse
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from benchmarks.search import synthetic_corpus, subsample_corpus, make_queries, latency_stats
+from preprocessing import Docs
+from search_tfidf import TfidfSearcher
+from search_bm25 import BM25Searcher
+
+
+RUBRICS = ('politics', 'economy', 'sport', 'science', 'culture', 'society', 'incidents', 'world')
+
+
+def spread_metadata(df, seed=0):
+    """Gives the articles random dates in 2023 and random rubrics."""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 365, df.shape[0])
+    df['date'] = (np.datetime64('2023-01-01') + days).astype(str)
+    df['rubric'] = np.array(RUBRICS)[rng.integers(0, len(RUBRICS), df.shape[0])]
+    return df
+
+
+def filter_cases(dates, rubrics):
+    """Builds filters from the whole corpus down to a single day, based on the dates present."""
+    dates = np.sort(pd.to_datetime(pd.Series(dates), errors='coerce').dropna().values.astype('datetime64[D]'))
+    last = dates[-1]
+    cases = [('none', None), ('rubric', {'rubrics': [rubrics[0]]})]
+    for name, days in (('quarter', 91), ('month', 30), ('week', 7), ('day', 1)):
+        cases.append((name, {'date_from': str(last - days + 1), 'date_to': str(last)}))
+    cases.append(('week+rubric', {'date_from': str(last - 6), 'date_to': str(last), 'rubrics': [rubrics[0]]}))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', help='CSV corpus to sample instead of synthetic documents')
+    parser.add_argument('--docs', type=int, default=50000)
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.csv:
+        df = subsample_corpus(args.csv, args.docs, args.seed)
+    else:
+        df = spread_metadata(synthetic_corpus(args.docs, seed=args.seed), args.seed)
+    queries = make_queries(df['text'].tolist(), args.num_queries, args.seed)
+    rubrics = df['rubric'].dropna().value_counts().index.tolist()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'corpus.csv')
+        df.to_csv(csv_path, index=False)
+        docs = Docs(path=csv_path, artifacts_dir=os.path.join(workdir, 'corpus_artifacts'))
+        searchers = {
+            'tf-idf': TfidfSearcher(matrix_file_name=os.path.join(workdir, 'tfidf_index'), docs_info=docs),
+            'bm25': BM25Searcher(index_file_name=os.path.join(workdir, 'bm25_index'), docs_info=docs),
+        }
+        print(f"{df.shape[0]} documents, {len(queries)} queries")
+        print(f"{'engine':>7} {'filter':>12} {'matching':>9} {'p50, ms':>8} {'p99, ms':>8}")
+        for name, searcher in searchers.items():
+            for case, filters in filter_cases(df['date'], rubrics):
+                selected = docs.select(filters)
+                matching = docs.num_rows if selected is None else selected.shape[0]
+                _, latency = latency_stats(lambda text, n: searcher.search_ids(text, n, filters=filters),
+                                           queries, args.k)
+                print(f"{name:>7} {case:>12} {matching / docs.num_rows:>9.1%} "
+                      f"{latency['p50_ms']:>8.2f} {latency['p99_ms']:>8.2f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
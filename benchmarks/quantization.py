@@ -0,0 +1,47 @@
+"""Memory saved and recall@k lost by int8 quantization of the FastText matrix.
+
+By default the report runs on synthetic clustered 300-d vectors:
+
+    python -m benchmarks.quantization
+
+With --fasttext it uses the real index and the lines of a query file:
+
+    python -m benchmarks.quantization --fasttext --queries queries.txt
+"""
+import argparse
+from benchmarks.ann_recall import synthetic_matrix
+from quantization import quantization_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--queries-count', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--fasttext', action='store_true')
+    parser.add_argument('--queries', default='')
+    args = parser.parse_args()
+
+    if args.fasttext:
+        from searcher_fasttext import FastTextSearcher
+        searcher = FastTextSearcher(fasttext_index_matrix='fasttext_index')
+        with open(args.queries, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries, valid = searcher.query_matrix(texts)
+        matrix, queries = searcher.matrix, queries[valid]
+    else:
+        matrix = synthetic_matrix(args.rows)
+        queries = synthetic_matrix(args.queries_count, seed=1)
+
+    report = quantization_report(matrix, queries, args.k)
+    float_mb, int8_mb = report['float32_bytes'] / 2**20, report['int8_bytes'] / 2**20
+    print(f"float32: {float_mb:.1f} MB, int8: {int8_mb:.1f} MB, saved {float_mb - int8_mb:.1f} MB "
+          f"({report['float32_bytes'] / report['int8_bytes']:.1f}x smaller)")
+    print(f"{'rerank':>8} {f'recall@{args.k}':>10} {'latency, ms':>12}")
+    for row in report['rows']:
+        rerank = 'exact' if row['rerank'] is None else f"{row['rerank']}k" if row['rerank'] else 'none'
+        print(f"{rerank:>8} {row['recall']:>10.3f} {row['latency_ms']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
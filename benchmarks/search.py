@@ -0,0 +1,268 @@
+"""Search benchmark and relevance regression suite.
+
+Builds every engine over synthetic or subsampled ria-2023 corpora of
+several sizes and runs a query log against it. For every engine and size
+the report contains the index build time and peak memory, the index size
+on disk, p50/p95/p99 latency, QPS at several concurrency levels and
+recall@k against exact search. Results are written as JSON; with
+--baseline they are compared with an earlier run and the command exits
+with status 1 if a metric regressed by more than --tolerance.
+
+Runs offline on synthetic data by default:
+
+    python -m benchmarks.search --sizes 1000 10000 --output bench.json
+
+Subsampled corpus, a query log and FastText engines (model file or a
+compact export from fasttext_compact.py):
+
+    python -m benchmarks.search --csv ria-2023.csv --queries queries.txt \\
+        --fasttext-model fasttext_compact --baseline bench.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from ann import recall_at_k
+from preprocessing import Docs
+from search_tfidf import TfidfSearcher
+from search_bm25 import BM25Searcher
+
+
+SYLLABLES = ['ка', 'ро', 'ми', 'на', 'ле', 'то', 'ви', 'ст', 'пра', 'го', 'ду', 'жи', 'без', 'ре', 'ло', 'ну']
+# Metrics where a larger value is worse, and where a smaller value is worse.
+LOWER_IS_BETTER = ('build_seconds', 'build_peak_bytes', 'index_bytes', 'p50_ms', 'p95_ms', 'p99_ms')
+HIGHER_IS_BETTER = ('recall_at_k',)
+
+
+def synthetic_corpus(num_docs, vocab_size=5000, seed=0):
+    """Generates news-like documents with Zipf-distributed made-up words."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([''.join(rng.choice(SYLLABLES, rng.integers(2, 5))) for _ in range(vocab_size)])
+    probabilities = 1 / np.arange(1, vocab_size + 1)
+    probabilities /= probabilities.sum()
+    texts = [' '.join(rng.choice(vocabulary, rng.integers(40, 200), p=probabilities)).capitalize() + '.'
+             for _ in range(num_docs)]
+    return pd.DataFrame({'url': [f'https://example.com/{idx}' for idx in range(num_docs)],
+                         'title': [text[:60] for text in texts],
+                         'date': '2023-01-01', 'rubric': 'synthetic', 'text': texts})
+
+
+def subsample_corpus(csv_path, num_docs, seed=0):
+    """Takes a random sample of articles from the CSV corpus."""
+    df = pd.read_csv(csv_path).dropna(subset=['text'])
+    return df.sample(n=min(num_docs, df.shape[0]), random_state=seed).reset_index(drop=True)
+
+
+def make_queries(texts, count, seed=0):
+    """Builds a query log of 1-3 consecutive words taken from random documents."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for idx in rng.integers(0, len(texts), count):
+        words = texts[idx].split()
+        length = int(rng.integers(1, 4))
+        start = int(rng.integers(0, max(len(words) - length, 1)))
+        queries.append(' '.join(words[start:start + length]))
+    return queries
+
+
+def dir_size(path):
+    """Returns the total size of the files in a directory."""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def measure_build(build):
+    """Runs `build` and returns its result, the elapsed time and the peak traced memory."""
+    tracemalloc.start()
+    start = perf_counter()
+    result = build()
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def latency_stats(search_ids, queries, n):
+    """Runs the queries one by one and returns the results and latency percentiles."""
+    results, latencies = [], []
+    for query in queries:
+        start = perf_counter()
+        results.append(search_ids(query, n))
+        latencies.append((perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return results, {'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+def measure_qps(search_ids, queries, n, concurrency):
+    """Runs the query log with `concurrency` threads and returns the queries per second."""
+    chunks = [queries[idx::concurrency] for idx in range(concurrency)]
+    threads = [threading.Thread(target=lambda chunk=chunk: [search_ids(query, n) for query in chunk])
+               for chunk in chunks]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(queries) / (perf_counter() - start)
+
+
+def bm25_exact(searcher, text, n):
+    """
+    Scores every indexed document with BM25 without WAND; the reference for BM25 recall.
+
+    Documents tied at the n-th score are taken by ascending id, as WAND keeps them.
+    """
+    vectors = searcher.docs_info.vectors
+    scores = np.zeros(vectors.shape[0])
+    indexed = np.zeros(vectors.shape[0], dtype=bool)
+    indexed[searcher.docs_info.canonical_ids] = True
+    for term_id, weight in searcher.query_weights(text).items():
+        column = vectors[:, term_id].tocoo()
+        tf = column.data.astype(np.float64)
+        scores[column.row] += weight * tf * (searcher.k1 + 1) / (tf + searcher.doc_norms[column.row])
+    scores[~indexed] = 0
+    indices = np.lexsort((np.arange(scores.shape[0]), -scores))[:n]
+    return [(score, int(index)) for index, score in zip(indices, scores[indices]) if score > 0]
+
+
+def ids_of(results):
+    return [np.array([index for _, index in result], dtype=np.int64) for result in results]
+
+
+def build_engines(docs, workdir, fasttext_model):
+    """Builds all engines over `docs`; yields (name, searcher, reference name, build stats)."""
+    engines = [
+        ('tf-idf', lambda: TfidfSearcher(matrix_file_name=os.path.join(workdir, 'tfidf_index'), docs_info=docs),
+         None, 'tfidf_index'),
+        ('bm25', lambda: BM25Searcher(index_file_name=os.path.join(workdir, 'bm25_index'), docs_info=docs),
+         'bm25-exact', 'bm25_index'),
+    ]
+    if fasttext_model:
+        from searcher_fasttext import FastTextSearcher
+        from search_hybrid import HybridSearcher
+        fasttext_index = os.path.join(workdir, 'fasttext_index')
+        built = {}
+
+        def fasttext(**kwargs):
+            return FastTextSearcher(model_file_name=fasttext_model, fasttext_index_matrix=fasttext_index,
+                                    doc_info=docs, **kwargs)
+
+        engines += [
+            ('fasttext', lambda: built.setdefault('fasttext', fasttext()), None, 'fasttext_index'),
+            ('fasttext-ivf', lambda: fasttext(ann_index_file=os.path.join(workdir, 'ivf_index')),
+             'fasttext', 'ivf_index'),
+            ('fasttext-int8', lambda: fasttext(quantized_index_file=os.path.join(workdir, 'int8_index'), rerank=0),
+             'fasttext', 'int8_index'),
+            ('hybrid', lambda: HybridSearcher(built['tf-idf'], built['fasttext'], docs_info=docs),
+             'fasttext', None),
+        ]
+        for name, build, reference, index_dir in engines:
+            searcher, seconds, peak = measure_build(build)
+            built[name] = searcher
+            yield name, searcher, reference, {
+                'build_seconds': seconds, 'build_peak_bytes': peak,
+                'index_bytes': dir_size(os.path.join(workdir, index_dir)) if index_dir else 0}
+        return
+    for name, build, reference, index_dir in engines:
+        searcher, seconds, peak = measure_build(build)
+        yield name, searcher, reference, {'build_seconds': seconds, 'build_peak_bytes': peak,
+                                          'index_bytes': dir_size(os.path.join(workdir, index_dir))}
+
+
+def run_size(num_docs, args, workdir):
+    """Benchmarks all engines on one corpus size and returns the result records."""
+    df = subsample_corpus(args.csv, num_docs, args.seed) if args.csv else synthetic_corpus(num_docs, seed=args.seed)
+    csv_path = os.path.join(workdir, 'corpus.csv')
+    df.to_csv(csv_path, index=False)
+    docs = Docs(path=csv_path, artifacts_dir=os.path.join(workdir, 'corpus_artifacts'))
+    _, corpus_seconds, corpus_peak = measure_build(lambda: (docs.meta, docs.vectors, docs.vectorizer))
+    if args.queries:
+        with open(args.queries, encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()][:args.num_queries]
+    else:
+        queries = make_queries(df['text'].tolist(), args.num_queries, args.seed)
+
+    records = [{'size': df.shape[0], 'engine': 'corpus', 'build_seconds': corpus_seconds,
+                'build_peak_bytes': corpus_peak, 'index_bytes': dir_size(docs.artifacts_dir)}]
+    results = {}
+    for name, searcher, reference, build_stats in build_engines(docs, workdir, args.fasttext_model):
+        engine_results, latency = latency_stats(searcher.search_ids, queries, args.k)
+        results[name] = engine_results
+        if reference == 'bm25-exact':
+            results[reference] = [bm25_exact(searcher, query, args.k) for query in queries]
+        record = {'size': df.shape[0], 'engine': name, **build_stats, **latency,
+                  'qps': {str(concurrency): measure_qps(searcher.search_ids, queries, args.k, concurrency)
+                          for concurrency in args.concurrency},
+                  'recall_at_k': (recall_at_k(ids_of(results[reference]), ids_of(engine_results))
+                                  if reference else 1.0),
+                  'recall_reference': reference or 'exact'}
+        records.append(record)
+        print(f"{record['size']:>8} {name:>14} {record['build_seconds']:>9.2f} {record['index_bytes'] / 2**20:>9.1f} "
+              f"{record['p50_ms']:>8.2f} {record['p99_ms']:>8.2f} "
+              f"{max(record['qps'].values()):>8.0f} {record['recall_at_k']:>7.3f}", flush=True)
+    return records
+
+
+def compare(records, baseline, tolerance):
+    """Lists the metrics that got worse than in the baseline by more than `tolerance` (relative)."""
+    previous = {(record['size'], record['engine']): record for record in baseline}
+    regressions = []
+    for record in records:
+        old = previous.get((record['size'], record['engine']))
+        if old is None:
+            continue
+        for metric in LOWER_IS_BETTER:
+            if metric in record and old.get(metric) and record[metric] > old[metric] * (1 + tolerance):
+                regressions.append((record['size'], record['engine'], metric, old[metric], record[metric]))
+        for metric in HIGHER_IS_BETTER:
+            if metric in record and old.get(metric) is not None and record[metric] < old[metric] - tolerance / 10:
+                regressions.append((record['size'], record['engine'], metric, old[metric], record[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--csv', default='', help='subsample this CSV instead of generating documents')
+    parser.add_argument('--queries', default='', help='query log, one query per line')
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--fasttext-model', default='', help='FastText .bin or compact export; enables FastText engines')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default='', help='compare with the results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{'docs':>8} {'engine':>14} {'build, s':>9} {'index, MB':>9} {'p50, ms':>8} {'p99, ms':>8} "
+          f"{'max QPS':>8} {'recall':>7}")
+    records = []
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix='search-bench-')
+        try:
+            records += run_size(size, args, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'k': args.k, 'num_queries': args.num_queries, 'data': args.csv or 'synthetic', 'results': records}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(records, json.load(f)['results'], args.tolerance)
+        for size, engine, metric, old, new in regressions:
+            print(f"REGRESSION {size} docs {engine}: {metric} {old:.4g} -> {new:.4g}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Latency of scatter-gather search against the number of shards.
+
+Builds a ShardedIndex over a synthetic FastText-shaped dense matrix or a
+TF-IDF-shaped sparse matrix for every shard count and reports the
+startup time, per-query p50/p99 latency, throughput of query batches and
+the overlap of the results with single-process exact search. Latency only
+improves up to the number of physical cores. Run from the repository root:
+
+    python -m benchmarks.sharding
+    python -m benchmarks.sharding --kind sparse --rows 1000000 --shards 1 2 4 8
+"""
+import argparse
+import os
+import numpy as np
+from time import perf_counter
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from ann import recall_at_k
+from benchmarks.ann_recall import synthetic_matrix
+from ranking import top_k
+from sharding import ShardedIndex
+
+
+def synthetic_tfidf(num_rows, num_terms=100_000, terms_per_doc=150, seed=0):
+    """Generates L2-normalized sparse rows with Zipf-distributed term ids."""
+    rng = np.random.default_rng(seed)
+    indices = np.minimum(rng.zipf(1.3, num_rows * terms_per_doc) - 1, num_terms - 1).astype(np.int32)
+    indptr = np.arange(0, num_rows * terms_per_doc + 1, terms_per_doc)
+    data = rng.random(num_rows * terms_per_doc).astype(np.float64)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(num_rows, num_terms))
+    matrix.sum_duplicates()
+    return normalize(matrix).tocsr()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kind', choices=('dense', 'sparse'), default='dense')
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--queries-count', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.kind == 'dense':
+        matrix = synthetic_matrix(args.rows)
+        queries = synthetic_matrix(args.queries_count, seed=1)
+        exact_scores = queries @ matrix.T
+    else:
+        matrix = synthetic_tfidf(args.rows)
+        queries = synthetic_tfidf(args.queries_count, num_terms=matrix.shape[1], terms_per_doc=3, seed=1)
+        exact_scores = (matrix @ queries.T).T.toarray()
+    doc_ids = np.arange(matrix.shape[0])
+    exact_ids = [top_k(scores, args.k)[0] for scores in exact_scores]
+
+    print(f"{args.kind} matrix {matrix.shape[0]} x {matrix.shape[1]}, {os.cpu_count()} CPUs")
+    print(f"{'shards':>7} {'start, s':>9} {'p50, ms':>8} {'p99, ms':>8} {'batch QPS':>10} {f'recall@{args.k}':>10}")
+    for num_shards in args.shards:
+        start = perf_counter()
+        with ShardedIndex(matrix, doc_ids, num_shards) as index:
+            index.search(queries[:1], args.k)  # wait until all workers are up
+            startup = perf_counter() - start
+            latencies, found = [], []
+            for row in range(queries.shape[0]):
+                start = perf_counter()
+                found.append(np.array([doc_id for _, doc_id in index.search(queries[row:row + 1], args.k)[0]]))
+                latencies.append((perf_counter() - start) * 1000)
+            start = perf_counter()
+            for row in range(0, queries.shape[0], args.batch_size):
+                index.search(queries[row:row + args.batch_size], args.k)
+            qps = queries.shape[0] / (perf_counter() - start)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{index.num_shards:>7} {startup:>9.2f} {p50:>8.2f} {p99:>8.2f} {qps:>10.0f} "
+              f"{recall_at_k(exact_ids, found):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Micro-benchmark of top-k selection against a full sort.
+
+Run from the repository root:
+
+    python -m benchmarks.topk
+"""
+import numpy as np
+from time import perf_counter
+from ranking import top_k
+
+
+def full_sort(scores, k):
+    """Previous implementation: sort every (index, score) tuple, then slice."""
+    return sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:k]
+
+
+def measure(func, scores, k, repeats):
+    """Returns the median latency of func(scores, k) in milliseconds."""
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        func(scores, k)
+        timings.append((perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main(sizes=(10_000, 100_000, 1_000_000), ks=(10, 100, 1000), repeats=5, seed=0):
+    rng = np.random.default_rng(seed)
+    print(f"{'N':>10} {'k':>6} {'sorted, ms':>12} {'top_k, ms':>12} {'speedup':>9}")
+    for size in sizes:
+        scores = rng.random(size)
+        for k in ks:
+            sorted_ms = measure(full_sort, scores, k, repeats)
+            top_k_ms = measure(top_k, scores, k, repeats)
+            print(f"{size:>10} {k:>6} {sorted_ms:>12.3f} {top_k_ms:>12.3f} {sorted_ms / top_k_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
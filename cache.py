@@ -0,0 +1,294 @@
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time, perf_counter
+from preprocessing import get_tokens, lemmatize, remove_punctuation, text_lowercase
+
+
+def normalize_query(text):
+    """Turns a query into a cache key component.
+
+    All engines ignore the order of query lemmas, so the sorted lemma
+    sequence identifies the result of a query.
+
+    Args:
+        text: The search query.
+
+    Returns:
+        Tuple of sorted lemmas.
+    """
+    return tuple(sorted(lemmatize(get_tokens(remove_punctuation(text_lowercase(text))))))
+
+
+class SQLiteCacheBackend():
+    """
+    Cache store in a local SQLite file shared by all worker processes.
+
+    The total size of the stored values is kept in a one-row table updated
+    by triggers, so checking the size cap on insert is a single-row read.
+
+    Attributes:
+        path: Path to the database file.
+        max_bytes: Maximum total size of stored values.
+    """
+
+    def __init__(self, path='search_cache.sqlite3', max_bytes=256 * 1024 * 1024):
+        """
+        Initializes the backend and creates the table if needed.
+
+        Args:
+            path: Path to the database file.
+            max_bytes: Maximum total size of stored values.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, '
+                               'size INTEGER, expires REAL, accessed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                               'bytes INTEGER NOT NULL)')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN '
+                               'UPDATE cache_size SET bytes = bytes + NEW.size; END')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN '
+                               'UPDATE cache_size SET bytes = bytes - OLD.size; END')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN '
+                               'UPDATE cache_size SET bytes = bytes - OLD.size + NEW.size; END')
+            connection.execute('INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM cache')
+
+    def _connection(self):
+        """Returns the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Returns the stored value bytes or None if missing or expired.
+
+        Args:
+            key: String key.
+        """
+        connection = self._connection()
+        now = time()
+        row = connection.execute('SELECT value FROM cache WHERE key = ? AND expires > ?', (key, now)).fetchone()
+        if row is None:
+            return None
+        connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key, value, ttl):
+        """
+        Stores value bytes and evicts the least recently used entries over the size cap.
+
+        Args:
+            key: String key.
+            value: Bytes to store.
+            ttl: Time to live in seconds.
+        """
+        connection = self._connection()
+        now = time()
+        # An upsert rather than INSERT OR REPLACE: the implicit delete of REPLACE does not fire triggers
+        connection.execute('INSERT INTO cache VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                           'value = excluded.value, size = excluded.size, expires = excluded.expires, '
+                           'accessed = excluded.accessed', (key, value, len(value), now + ttl, now))
+        total = connection.execute('SELECT bytes FROM cache_size').fetchone()[0]
+        if total > self.max_bytes:
+            connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT '
+                '(SELECT COUNT(*) / 4 + 1 FROM cache))')
+
+    def size(self):
+        """Returns the total size of the stored values."""
+        return self._connection().execute('SELECT bytes FROM cache_size').fetchone()[0]
+
+    def clear(self):
+        """Removes all entries."""
+        self._connection().execute('DELETE FROM cache')
+
+
+class ResultCache():
+    """
+    In-process LRU cache of search results with TTL and a memory cap.
+
+    Keys are built from the normalized query, the engine, n and the corpus
+    version (`Docs.version`, the same in all processes), so results are
+    invalidated automatically when documents are added or deleted or the
+    corpus is rebuilt. An optional
+    shared backend lets all worker processes reuse each other's results.
+
+    Attributes:
+        max_entries: Maximum number of entries kept in memory.
+        max_bytes: Maximum total size of the pickled entries kept in memory.
+        ttl: Time to live of an entry in seconds.
+        backend: Optional shared store, e.g. SQLiteCacheBackend.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=300, backend=None):
+        """
+        Initializes the ResultCache object.
+
+        Args:
+            max_entries: Maximum number of entries kept in memory.
+            max_bytes: Maximum total size of the pickled entries kept in memory.
+            ttl: Time to live of an entry in seconds.
+            backend: Optional shared store, e.g. SQLiteCacheBackend.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.size = 0
+        self.counters = {'hits': 0, 'backend_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        self.timings = {'hit_seconds': 0.0, 'miss_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text, engine, n, version, filters=None):
+        """
+        Builds the cache key of a search request.
+
+        Args:
+            text: The search query.
+            engine: Name of the engine.
+            n: Number of results.
+            version: Corpus version (`Docs.version`); per-process index
+                counters must not be used, since keys are shared by all
+                processes through the backend.
+            filters: Optional dictionary of date and rubric filters.
+
+        Returns:
+            String key.
+        """
+        if filters:
+            filters = tuple(sorted((name, tuple(sorted(value)) if isinstance(value, (list, tuple)) else value)
+                                   for name, value in filters.items()))
+            return repr((normalize_query(text), engine, n, version, filters))
+        return repr((normalize_query(text), engine, n, version))
+
+    def get(self, key):
+        """
+        Returns the cached value or None.
+
+        Args:
+            key: String key.
+        """
+        now = time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, size, expires = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return value
+                del self.entries[key]
+                self.size -= size
+                self.counters['expirations'] += 1
+        if self.backend is not None:
+            data = self.backend.get(key)
+            if data is not None:
+                value = pickle.loads(data)
+                self._store(key, value, len(data), now + self.ttl)
+                with self._lock:
+                    self.counters['backend_hits'] += 1
+                return value
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Stores a value in memory and in the shared backend.
+
+        Args:
+            key: String key.
+            value: Picklable value.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._store(key, value, len(data), time() + self.ttl)
+        if self.backend is not None:
+            self.backend.put(key, data, self.ttl)
+
+    def _store(self, key, value, size, expires):
+        """Adds an in-memory entry and evicts least recently used entries over the caps."""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size, expires)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, old_size, _) = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.counters['evictions'] += 1
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        """
+        Returns the cached value or computes, stores and returns it.
+
+        Args:
+            key: String key.
+            compute: Function without arguments producing the value.
+            cacheable: Optional function called with the computed value; if it
+                returns False, the value is returned but not stored (e.g.
+                results answered without some shards).
+
+        Returns:
+            Tuple of the value and whether it came from the cache.
+        """
+        start = perf_counter()
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.timings['hit_seconds'] += perf_counter() - start
+            return value, True
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self.put(key, value)
+        with self._lock:
+            self.timings['miss_seconds'] += perf_counter() - start
+        return value, False
+
+    def clear(self):
+        """Removes all entries from memory and from the backend."""
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dictionary with entry and byte counts, hit/miss counters, hit rate
+            and mean latency of hits and misses in milliseconds.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            hits = counters['hits'] + counters['backend_hits']
+            lookups = hits + counters['misses']
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                **counters,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'mean_hit_ms': 1000 * self.timings['hit_seconds'] / hits if hits else 0.0,
+                'mean_miss_ms': 1000 * self.timings['miss_seconds'] / counters['misses'] if counters['misses'] else 0.0,
+                'backend': type(self.backend).__name__ if self.backend is not None else None,
+            }
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from time import time
+from preprocessing import get_tokens, lemmatize, lemmatizer, remove_punctuation, text_lowercase
+
+
+PART_TEMPLATE = 'part-{:06d}.txt'
+SUCCESS_NAME = '_SUCCESS'
+
+
+def _init_worker(cache_path):
+    """Warms the lemmatizer cache of a worker process from the persisted cache."""
+    if cache_path:
+        lemmatizer.load(cache_path)
+
+
+def _lemmatize_chunk(chunk_index, texts, out_dir):
+    """Lemmatizes one chunk of texts and writes it to its part file.
+
+    The part is written to a temporary file and renamed, so a part file
+    either is complete or does not exist. Each worker process lemmatizes
+    with the cached lemmatizer of its own copy of `preprocessing`.
+
+    Args:
+        chunk_index: Number of the chunk in the CSV.
+        texts: List of original texts.
+        out_dir: Directory with the part files.
+
+    Returns:
+        Tuple of the chunk number, the number of texts, the number of words
+        and the word -> normal form pairs seen in the chunk.
+    """
+    num_words = 0
+    lines = []
+    forms = {}
+    for text in texts:
+        tokens = get_tokens(remove_punctuation(text_lowercase(text)))
+        lemmas = lemmatize(tokens)
+        forms.update(zip(tokens, lemmas))
+        num_words += len(tokens)
+        lines.append(' '.join(lemmas) + '\n')
+    path = os.path.join(out_dir, PART_TEMPLATE.format(chunk_index))
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    os.replace(path + '.tmp', path)
+    return chunk_index, len(texts), num_words, forms
+
+
+def iter_chunks(path, col_name='text', chunk_size=10000):
+    """Reads the texts of a CSV file chunk by chunk.
+
+    Rows without a text are skipped, as in `preprocessing.load_texts`.
+
+    Args:
+        path: Path to the CSV file.
+        col_name: Name of the column with texts.
+        chunk_size: Number of CSV rows per chunk.
+
+    Yields:
+        Tuples of the chunk number and the list of texts.
+    """
+    for chunk_index, df in enumerate(pd.read_csv(path, usecols=[col_name], chunksize=chunk_size)):
+        yield chunk_index, df[col_name].dropna().tolist()
+
+
+def lemmatize_corpus(path, out_dir, col_name='text', chunk_size=10000, workers=None,
+                     cache_path='', log=print):
+    """Lemmatizes a CSV corpus in parallel, streaming it chunk by chunk.
+
+    Chunks are fanned out over a process pool with one MorphAnalyzer per
+    worker, and every finished chunk is written to its own part file. At
+    most two chunks per worker are in flight, so memory does not depend on
+    the corpus size. Part files that already exist are skipped, so an
+    interrupted build resumes where it stopped.
+
+    Workers start from the persisted lemmatizer cache, and the word forms
+    they see are merged into the lemmatizer of this process and saved back,
+    so the next build and the query path start warm.
+
+    Args:
+        path: Path to the CSV file.
+        out_dir: Directory for the part files.
+        col_name: Name of the column with texts.
+        chunk_size: Number of CSV rows per chunk.
+        workers: Number of worker processes; defaults to the number of CPUs.
+        cache_path: Path to the persisted lemmatizer cache; empty to disable.
+        log: Function used for progress reports; None disables them.
+
+    Returns:
+        Dictionary with the number of chunks, texts and words and the elapsed time.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    start = time()
+    num_chunks = num_texts = num_words = 0
+    pending = set()
+
+    def collect(done):
+        nonlocal num_texts, num_words
+        for future in done:
+            _, texts, words, forms = future.result()
+            num_texts += texts
+            num_words += words
+            lemmatizer.update(forms)
+        if log is not None:
+            elapsed = time() - start
+            log(f"lemmatized {num_texts} texts ({num_words} words) in {elapsed:.1f} sec, "
+                f"{num_texts / max(elapsed, 1e-9):.0f} texts/sec")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_path,)) as executor:
+        for chunk_index, texts in iter_chunks(path, col_name, chunk_size):
+            num_chunks += 1
+            if os.path.exists(os.path.join(out_dir, PART_TEMPLATE.format(chunk_index))):
+                num_texts += len(texts)
+                continue
+            pending.add(executor.submit(_lemmatize_chunk, chunk_index, texts, out_dir))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    if cache_path:
+        lemmatizer.save(cache_path)
+    stats = {'chunks': num_chunks, 'texts': num_texts, 'words': num_words,
+             'seconds': time() - start}
+    with open(os.path.join(out_dir, SUCCESS_NAME), 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+    return stats
+
+
+def iter_lemmatized(out_dir):
+    """Reads lemmatized texts from the part files in corpus order.
+
+    Args:
+        out_dir: Directory with the part files of a finished build.
+
+    Yields:
+        Lemmatized texts.
+    """
+    with open(os.path.join(out_dir, SUCCESS_NAME), encoding='utf-8') as f:
+        num_chunks = json.load(f)['chunks']
+    for chunk_index in range(num_chunks):
+        with open(os.path.join(out_dir, PART_TEMPLATE.format(chunk_index)), encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel lemmatization of the news corpus.')
+    parser.add_argument('--path', default='ria-2023.csv')
+    parser.add_argument('--out-dir', default='lemmatized_parts')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-path', default='')
+    args = parser.parse_args()
+    print(lemmatize_corpus(args.path, args.out_dir, chunk_size=args.chunk_size, workers=args.workers,
+                           cache_path=args.cache_path))
+    print(lemmatizer.stats())
+
+if __name__ == "__main__":
+    main()
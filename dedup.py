@@ -0,0 +1,166 @@
+import zlib
+import numpy as np
+
+
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = np.uint32(MERSENNE_PRIME)
+
+
+def shingle_hashes(text, size=3):
+    """
+    Hashes the word shingles of a lemmatized text.
+
+    Args:
+        text: Lemmatized text.
+        size: Number of consecutive words in a shingle; shorter texts are one shingle.
+
+    Returns:
+        uint32 array of distinct shingle hashes; empty for an empty text.
+    """
+    words = text.split()
+    if not words:
+        return np.zeros(0, dtype=np.uint32)
+    shingles = {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                       dtype=np.uint32, count=len(shingles))
+
+
+def minhash_signatures(texts, num_perm=128, shingle_size=3, seed=1, chunk_size=5000):
+    """
+    Computes MinHash signatures of texts.
+
+    Every permutation is a universal hash (a * x + b) mod (2^31 - 1); the
+    signature keeps its minimum over the shingles of a text, and the share
+    of equal signature entries of two texts estimates the Jaccard
+    similarity of their shingle sets. Texts are processed in chunks, with
+    one `np.minimum.reduceat` pass per permutation over all shingles of a chunk.
+
+    Args:
+        texts: Iterable of lemmatized texts.
+        num_perm: Number of permutations (signature length).
+        shingle_size: Number of consecutive words in a shingle.
+        seed: Seed of the permutation parameters.
+        chunk_size: Number of texts hashed at once.
+
+    Returns:
+        uint32 matrix (texts x num_perm); rows of texts without words are
+        all 2^31 - 1.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    texts = list(texts)
+    signatures = np.full((len(texts), num_perm), MAX_HASH, dtype=np.uint32)
+    for start in range(0, len(texts), chunk_size):
+        hashes = [shingle_hashes(text, shingle_size) for text in texts[start:start + chunk_size]]
+        lengths = np.array([h.shape[0] for h in hashes])
+        nonempty = np.flatnonzero(lengths)
+        if not nonempty.shape[0]:
+            continue
+        values = np.concatenate([hashes[i] for i in nonempty]).astype(np.uint64) % MERSENNE_PRIME
+        offsets = np.concatenate(([0], np.cumsum(lengths[nonempty])[:-1]))
+        for perm in range(num_perm):
+            permuted = (a[perm] * values + b[perm]) % MERSENNE_PRIME
+            signatures[start + nonempty, perm] = np.minimum.reduceat(permuted, offsets)
+    return signatures
+
+
+def choose_bands(num_perm, threshold):
+    """
+    Picks the LSH banding for a similarity threshold.
+
+    With b bands of r rows, two texts become candidates with probability
+    1 - (1 - s^r)^b, which rises steeply around s = (1 / b)^(1 / r). The
+    banding whose rise point is closest below the threshold is chosen, so
+    pairs above the threshold are found with high probability.
+
+    Args:
+        num_perm: Signature length.
+        threshold: Jaccard similarity above which texts are duplicates.
+
+    Returns:
+        Number of bands; it divides `num_perm`.
+    """
+    options = [bands for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    below = [bands for bands in options if (1 / bands) ** (bands / num_perm) <= threshold] or options[-1:]
+    return min(below, key=lambda bands: threshold - (1 / bands) ** (bands / num_perm))
+
+
+def lsh_clusters(signatures, threshold=0.8, bands=None):
+    """
+    Groups near-duplicate texts with LSH banding.
+
+    Signatures are cut into bands, and texts with an identical band land in
+    the same bucket. Every member of a bucket is compared with the first
+    (smallest id) member only, so the work grows linearly with the bucket
+    sizes, and pairs whose estimated similarity reaches `threshold` are
+    joined in a union-find forest.
+
+    Args:
+        signatures: MinHash signatures (texts x num_perm).
+        threshold: Estimated Jaccard similarity above which texts are duplicates.
+        bands: Number of bands; chosen from the threshold by default.
+
+    Returns:
+        int64 array with the canonical (smallest) id of the cluster of every text.
+    """
+    num_docs, num_perm = signatures.shape
+    bands = bands or choose_bands(num_perm, threshold)
+    rows = num_perm // bands
+    parent = np.arange(num_docs, dtype=np.int64)
+
+    def find(doc):
+        root = doc
+        while parent[root] != root:
+            root = parent[root]
+        while parent[doc] != root:
+            parent[doc], doc = root, parent[doc]
+        return root
+
+    candidates = np.flatnonzero((signatures != MAX_HASH).any(axis=1))
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[candidates, band * rows:(band + 1) * rows])
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel()
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        ends = np.concatenate((starts[1:], [order.shape[0]]))
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            members = candidates[order[start:end]]
+            first = members[0]
+            similar = (signatures[members[1:]] == signatures[first]).mean(axis=1) >= threshold
+            for member in members[1:][similar]:
+                root_a, root_b = find(first), find(member)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+    return np.array([find(doc) for doc in range(num_docs)], dtype=np.int64)
+
+
+def dedup_report(canonical, doc_sizes=None):
+    """
+    Summarizes duplicate clusters.
+
+    Args:
+        canonical: Canonical id of every document.
+        doc_sizes: Optional size of every document (e.g. index bytes or
+            non-zero entries) to report the saved share.
+
+    Returns:
+        Dictionary with the number of documents, canonical documents,
+        duplicates, clusters with duplicates, the largest cluster and, with
+        `doc_sizes`, the share of the size saved.
+    """
+    canonical = np.asarray(canonical)
+    is_canonical = canonical == np.arange(canonical.shape[0])
+    cluster_sizes = np.bincount(canonical, minlength=canonical.shape[0])
+    report = {
+        'documents': int(canonical.shape[0]),
+        'canonical': int(is_canonical.sum()),
+        'duplicates': int((~is_canonical).sum()),
+        'clusters': int((cluster_sizes > 1).sum()),
+        'largest_cluster': int(cluster_sizes.max()) if canonical.shape[0] else 0,
+    }
+    if doc_sizes is not None:
+        doc_sizes = np.asarray(doc_sizes, dtype=np.float64)
+        report['saved_share'] = float(doc_sizes[~is_canonical].sum() / max(doc_sizes.sum(), 1))
+    return report
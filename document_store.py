@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+from contextlib import contextmanager
+
+
+METADATA_COLUMNS = ('title', 'date', 'url', 'rubric')
+
+
+class DocumentStore():
+    """
+    SQLite store of the articles keyed by their document id.
+
+    Document ids are the ones used by all indexes: the position of the
+    article among the CSV rows that have a text, followed by the documents
+    added later. Searchers return ids only, and the texts and metadata of
+    the results being shown are read from here, so serving processes do not
+    keep the corpus in memory.
+
+    Attributes:
+        path: Path to the database file.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the store, creating an empty table if needed.
+
+        Args:
+            path: Path to the database file.
+        """
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, title TEXT, date TEXT, '
+            'url TEXT, rubric TEXT, text TEXT NOT NULL)')
+
+    def _connection(self):
+        """Returns the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    @classmethod
+    def build(cls, csv_path, path, col_name='text', chunk_size=10000, added=()):
+        """
+        Fills a new store from the CSV file, reading it chunk by chunk.
+
+        The store is written to a temporary file and renamed, so readers
+        never see a partial store.
+
+        Args:
+            csv_path: Path to the CSV file.
+            path: Path to the database file.
+            col_name: Name of the column with texts.
+            chunk_size: Number of CSV rows read at once.
+            added: Texts of the documents added after the CSV ones.
+
+        Returns:
+            The DocumentStore.
+        """
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        store = cls(tmp_path)
+        header = pd.read_csv(csv_path, nrows=0).columns
+        columns = [column for column in METADATA_COLUMNS if column in header]
+        first_id = 0
+        for df in pd.read_csv(csv_path, usecols=columns + [col_name], chunksize=chunk_size):
+            df = df[df[col_name].notna()]
+            df = df.astype(object).where(df.notna(), None)
+            records = [dict(zip(columns, values), text=text)
+                       for values, text in zip(df[columns].itertuples(index=False), df[col_name])]
+            store.add(first_id, records)
+            first_id += len(records)
+        store.add(first_id, [{'text': text} for text in added])
+        store.close()
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    def add(self, first_id, records):
+        """
+        Stores documents with consecutive ids; existing ids are overwritten.
+
+        Args:
+            first_id: Id of the first document.
+            records: List of dictionaries with 'text' and optional metadata columns.
+        """
+        rows = [(first_id + offset, *(record.get(column) for column in METADATA_COLUMNS), record['text'])
+                for offset, record in enumerate(records)]
+        connection = self._connection()
+        if connection.in_transaction:
+            connection.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)', rows)
+            return
+        with connection:
+            connection.execute('BEGIN')
+            connection.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds the write lock of the database for the duration of the block.
+
+        Writes of the block are committed together, and writers of all
+        processes sharing the database are serialized, which makes the lock
+        usable for other files that must change together with the store.
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def get(self, ids):
+        """
+        Reads documents by id.
+
+        Args:
+            ids: List of document ids.
+
+        Returns:
+            List of dictionaries (id, title, date, url, rubric, text) in the
+            order of `ids`; None for unknown ids.
+        """
+        ids = [int(idx) for idx in ids]
+        if not ids:
+            return []
+        placeholders = ', '.join('?' * len(ids))
+        rows = self._connection().execute(f'SELECT * FROM documents WHERE id IN ({placeholders})', ids)
+        documents = {row['id']: dict(row) for row in rows}
+        return [documents.get(idx) for idx in ids]
+
+    def close(self):
+        """Closes the connection of the current thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
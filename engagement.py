@@ -0,0 +1,416 @@
+import itertools
+import json
+import os
+import threading
+from time import monotonic
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, User, Like, Bookmark, Comment, NewsStats, EngagementCheckpoint
+
+
+# Event kind -> (table of the events, column of the counter in news_stats)
+KINDS = {
+    'like': (Like.__table__, 'likes'),
+    'bookmark': (Bookmark.__table__, 'bookmarks'),
+    'comment': (Comment.__table__, 'comments'),
+}
+COUNTERS = tuple(column for _, column in KINDS.values())
+
+
+def lock_file(f):
+    """Locks an open file for this process without waiting; raises OSError if it is locked."""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class EngagementBuffer():
+    """
+    Write-behind buffer for likes, bookmarks and comments with per-news counters.
+
+    Events are validated, counted and then appended to a journal file and
+    to an in-memory buffer, so the request returns without a database round
+    trip. The only exception is the first event of a user, whose id is
+    looked up once. A background thread writes the buffer with one bulk
+    insert per table when it reaches `max_events` or every `interval`
+    seconds, and adds the counter deltas to `news_stats` in the same
+    transaction. Every `refresh_interval` seconds the counters are reloaded
+    from `news_stats` (plus the events still buffered), so the workers
+    converge on the counts written by each other.
+
+    Every event has a sequence number and the transaction also stores the
+    last written one. After a crash, events of the journal that are newer
+    than the stored sequence number are written again, so none is lost or
+    written twice. Every process locks its own journal slot
+    (`journal_path.0`, `journal_path.1`, ...), so several workers can share
+    the database, and a restarted worker takes over the journal of a
+    crashed one.
+
+    Attributes:
+        engine: SQLAlchemy engine of the database.
+        journal_path: Path prefix of the journal files.
+        journal: Path to the journal of this process, set by `start`.
+        max_events: Number of buffered events that triggers a flush.
+        interval: Maximum time in seconds an event stays in the buffer.
+        refresh_interval: Time in seconds between reloads of the counters.
+        fsync: Whether every journal write is synced to disk; without it the
+            journal survives a crash of the process but not of the machine.
+        docs_info: Optional object containing information about the
+            documents; news ids must be below its `num_rows`.
+        counts: Dictionary of news id -> list of likes, bookmarks and comments.
+        flushes: Number of successful flushes.
+        flushed_events: Number of events written to the database.
+        errors: Number of failed flushes; their events are retried.
+        rejected: Number of events dropped because they violate a constraint.
+    """
+
+    def __init__(self, engine, journal_path='engagement.journal', max_events=500, interval=1.0, fsync=False,
+                 docs_info=None, refresh_interval=30.0):
+        """
+        Initializes the EngagementBuffer object; the database is first read on first use.
+
+        Args:
+            engine: SQLAlchemy engine of the database.
+            journal_path: Path prefix of the journal files.
+            max_events: Number of buffered events that triggers a flush.
+            interval: Maximum time in seconds an event stays in the buffer.
+            fsync: Whether every journal write is synced to disk.
+            docs_info: Optional object containing information about the
+                documents, used to reject unknown news ids.
+            refresh_interval: Time in seconds between reloads of the counters.
+        """
+        self.engine = engine
+        self.journal_path = journal_path
+        self.max_events = max_events
+        self.interval = interval
+        self.fsync = fsync
+        self.docs_info = docs_info
+        self.refresh_interval = refresh_interval
+        self.counts = {}
+        self._refreshed = monotonic()
+        self.flushes = 0
+        self.flushed_events = 0
+        self.errors = 0
+        self.rejected = 0
+        self.buffer = []
+        self.seq = 0
+        self._users = set()
+        self.journal = None
+        self._journal = None
+        self._journal_lock = None
+        self._started = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Loads the counters, writes the events left in the journal and starts the flush thread.
+
+        Called automatically by `record` and `counts_of`.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._take_journal()
+            tables = [NewsStats.__table__, EngagementCheckpoint.__table__]
+            db.metadata.create_all(self.engine, tables=tables)
+            with self.engine.connect() as connection:
+                self.counts = self._read_counts(connection)
+                checkpoint = connection.execute(
+                    select(EngagementCheckpoint.last_seq).where(EngagementCheckpoint.journal == self.journal_name)
+                ).scalar() or 0
+            self._refreshed = monotonic()
+            self.seq = checkpoint
+            for event in self._read_journal():
+                if event.get('seq', 0) <= checkpoint:
+                    continue
+                try:
+                    self._validate(event['kind'], event['user_id'], event['news_id'], event.get('text'))
+                except (KeyError, TypeError, ValueError):
+                    self.rejected += 1
+                    continue
+                self._apply(event)
+                self.buffer.append(event)
+                self.seq = max(self.seq, event['seq'])
+            self._rewrite_journal(self.buffer)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            self._started = True
+        if self.buffer:
+            self._wakeup.set()
+
+    def _take_journal(self):
+        """Locks the first journal slot that no other process holds."""
+        for slot in itertools.count():
+            journal = f'{self.journal_path}.{slot}'
+            lock = open(f'{journal}.lock', 'a')
+            try:
+                lock_file(lock)
+            except OSError:
+                lock.close()
+                continue
+            self.journal, self._journal_lock = journal, lock
+            return
+
+    @property
+    def journal_name(self):
+        """Key of the journal in the checkpoint table."""
+        return os.path.basename(self.journal)
+
+    def _read_journal(self):
+        """Reads the journal; a line cut by a crash is skipped."""
+        if not os.path.exists(self.journal):
+            return []
+        events = []
+        with open(self.journal, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return events
+
+    def _rewrite_journal(self, events):
+        """Atomically replaces the journal with the given events and reopens it for appending."""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = f'{self.journal}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal)
+        self._journal = open(self.journal, 'a', encoding='utf-8')
+
+    def _validate(self, kind, user_id, news_id, text=None):
+        """
+        Checks an event before it is counted or journaled.
+
+        Raises:
+            ValueError: If the kind is unknown, an id is not a known user or
+                news document, or a comment has no text.
+        """
+        if kind not in KINDS:
+            raise ValueError(f'unknown event kind {kind!r}')
+        if not isinstance(user_id, int) or not isinstance(news_id, int) or user_id < 0 or news_id < 0:
+            raise ValueError('ids must be non-negative integers')
+        if self.docs_info is not None and news_id >= self.docs_info.num_rows:
+            raise ValueError(f'unknown news id {news_id}')
+        if kind == 'comment' and not text:
+            raise ValueError('comment text is required')
+        if user_id not in self._users:
+            with self.engine.connect() as connection:
+                if connection.execute(select(User.id).where(User.id == user_id)).scalar() is None:
+                    raise ValueError(f'unknown user id {user_id}')
+            self._users.add(user_id)
+
+    def _apply(self, event, sign=1):
+        """Adds an event to the in-memory counters, or removes it with `sign` = -1."""
+        counts = self.counts.setdefault(event['news_id'], [0] * len(COUNTERS))
+        counts[COUNTERS.index(KINDS[event['kind']][1])] += sign
+
+    def record(self, kind, user_id, news_id, text=None):
+        """
+        Records an event; it is visible in the counters immediately and
+        written to the database by the next flush.
+
+        Args:
+            kind: 'like', 'bookmark' or 'comment'.
+            user_id: Id of the user.
+            news_id: Id of the news document.
+            text: Text of the comment.
+
+        Raises:
+            ValueError: If the kind is unknown, an id is not a known user or
+                news document, or a comment has no text.
+        """
+        if not self._started:
+            self.start()
+        self._validate(kind, user_id, news_id, text)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('the engagement buffer is closed')
+            event = {'seq': self.seq + 1, 'kind': kind, 'user_id': user_id, 'news_id': news_id,
+                     'created_at': datetime.utcnow().isoformat()}
+            if kind == 'comment':
+                event['text'] = text
+            self._apply(event)
+            try:
+                self._journal.write(json.dumps(event, ensure_ascii=False) + '\n')
+                self._journal.flush()
+                if self.fsync:
+                    os.fsync(self._journal.fileno())
+            except BaseException:
+                self._apply(event, -1)
+                raise
+            self.seq += 1
+            self.buffer.append(event)
+            full = len(self.buffer) >= self.max_events
+        if full:
+            self._wakeup.set()
+
+    def counts_of(self, news_ids):
+        """
+        Returns the counters of news documents.
+
+        Args:
+            news_ids: List of news ids.
+
+        Returns:
+            List of dictionaries with likes, bookmarks and comments, in the order of `news_ids`.
+        """
+        if not self._started:
+            self.start()
+        counts = self.counts
+        empty = [0] * len(COUNTERS)
+        return [dict(zip(COUNTERS, counts.get(news_id, empty))) for news_id in map(int, news_ids)]
+
+    @staticmethod
+    def _read_counts(connection):
+        """Reads the counters of all news from `news_stats`."""
+        return {row.news_id: [getattr(row, column) for column in COUNTERS]
+                for row in connection.execute(select(NewsStats.__table__))}
+
+    def refresh_counts(self):
+        """
+        Reloads the counters from `news_stats`, which holds the events flushed
+        by all processes, and adds the events still buffered here.
+        """
+        with self._flush_lock:
+            with self.engine.connect() as connection:
+                counts = self._read_counts(connection)
+            with self._lock:
+                self.counts = counts
+                for event in self.buffer:
+                    self._apply(event)
+                self._refreshed = monotonic()
+
+    def _run(self):
+        """Flushes the buffer when it is full or every `interval` seconds and reloads the counters."""
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+            if monotonic() - self._refreshed >= self.refresh_interval:
+                try:
+                    self.refresh_counts()
+                except Exception:
+                    with self._lock:
+                        self.errors += 1
+
+    def _upsert(self, connection, table, rows, key, update):
+        """Inserts rows or updates the existing ones (PostgreSQL and SQLite)."""
+        dialect = postgresql if self.engine.dialect.name == 'postgresql' else sqlite
+        statement = dialect.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[key], set_={column: update(table.c[column], statement.excluded[column])
+                                        for column in rows[0] if column != key})
+        connection.execute(statement, rows)
+
+    def _write(self, events):
+        """Writes events, the counter deltas and the checkpoint in one transaction."""
+        deltas = {}
+        rows = {kind: [] for kind in KINDS}
+        for event in events:
+            row = {'user_id': event['user_id'], 'news_id': event['news_id'],
+                   'created_at': datetime.fromisoformat(event['created_at'])}
+            if event['kind'] == 'comment':
+                row['text'] = event['text']
+            rows[event['kind']].append(row)
+            delta = deltas.setdefault(event['news_id'], dict.fromkeys(COUNTERS, 0))
+            delta[KINDS[event['kind']][1]] += 1
+        with self.engine.begin() as connection:
+            for kind, kind_rows in rows.items():
+                if kind_rows:
+                    connection.execute(KINDS[kind][0].insert(), kind_rows)
+            self._upsert(connection, NewsStats.__table__,
+                         [{'news_id': news_id, **delta} for news_id, delta in deltas.items()],
+                         'news_id', lambda old, new: old + new)
+            self._upsert(connection, EngagementCheckpoint.__table__,
+                         [{'journal': self.journal_name, 'last_seq': events[-1]['seq']}], 'journal',
+                         lambda old, new: new)
+
+    def flush(self):
+        """
+        Writes the buffered events to the database in one transaction.
+
+        If the batch violates a constraint or holds a value the database
+        cannot store (e.g. an unknown user or an id out of range), the events
+        are written one by one, each with its checkpoint, and the rejected
+        ones are dropped from the counters. On other errors the events not
+        yet committed stay in the buffer and are retried by the next flush.
+
+        Returns:
+            Number of events written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self.buffer = self.buffer, []
+            if not events:
+                return 0
+            rejected = []
+            done = 0
+            try:
+                try:
+                    self._write(events)
+                    done = len(events)
+                except (IntegrityError, DataError):
+                    for event in events:
+                        try:
+                            self._write([event])
+                        except (IntegrityError, DataError):
+                            rejected.append(event)
+                        done += 1
+            except Exception:
+                # Events before `done` are committed together with their checkpoint; the rest is retried
+                pass
+            with self._lock:
+                for event in rejected:
+                    self._apply(event, -1)
+                self.rejected += len(rejected)
+                self.flushed_events += done - len(rejected)
+                if done < len(events):
+                    self.buffer = events[done:] + self.buffer
+                    self.errors += 1
+                    return done - len(rejected)
+                self._rewrite_journal(self.buffer)
+                self.flushes += 1
+            return done - len(rejected)
+
+    def close(self):
+        """Stops the flush thread and writes the remaining events."""
+        if not self._started or self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            self._journal.close()
+            self._journal_lock.close()
+
+    def stats(self):
+        """
+        Returns the buffer counters.
+
+        Returns:
+            Dictionary with buffered, flushes, flushed_events, errors, rejected and last_seq.
+        """
+        with self._lock:
+            return {
+                'buffered': len(self.buffer),
+                'flushes': self.flushes,
+                'flushed_events': self.flushed_events,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'last_seq': self.seq,
+            }
@@ -0,0 +1,211 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class Overloaded(Exception):
+    """Raised when the executor queue is full and a task is rejected."""
+
+
+class BoundedExecutor():
+    """
+    Thread pool for CPU-bound scoring with a bounded queue.
+
+    NumPy and SciPy release the GIL in matrix products, so scoring threads
+    run in parallel while the event loop stays free to accept requests.
+    At most `max_workers` tasks run and at most `max_queue` more wait;
+    further tasks are rejected immediately with Overloaded, so a burst of
+    load is answered with fast errors instead of an ever-growing backlog.
+    A task that exceeds its timeout is reported to the caller as
+    asyncio.TimeoutError; its slot is released only when the thread
+    actually finishes, so the bound always reflects the real CPU load.
+
+    Attributes:
+        max_workers: Number of scoring threads.
+        max_queue: Number of tasks allowed to wait for a free thread.
+        timeout: Default per-task timeout in seconds; None waits forever.
+        pending: Number of running and queued tasks.
+        rejected: Number of tasks rejected because the queue was full.
+        timed_out: Number of tasks whose caller stopped waiting.
+    """
+
+    def __init__(self, max_workers=4, max_queue=32, timeout=5.0):
+        """
+        Initializes the BoundedExecutor object.
+
+        Args:
+            max_workers: Number of scoring threads.
+            max_queue: Number of tasks allowed to wait for a free thread.
+            timeout: Default per-task timeout in seconds; None waits forever.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scoring')
+        self._lock = threading.Lock()
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules a task unless the queue is full.
+
+        Args:
+            fn: Function to run in a scoring thread.
+            *args: Positional arguments of `fn`.
+            **kwargs: Keyword arguments of `fn`.
+
+        Returns:
+            concurrent.futures.Future of the task.
+
+        Raises:
+            Overloaded: If `max_workers + max_queue` tasks are already pending.
+        """
+        return self.schedule(self._executor.submit, fn, *args, **kwargs)
+
+    def schedule(self, submit, *args, **kwargs):
+        """
+        Admits a task that is queued by `submit` unless the queue is full.
+
+        `submit` may hand the task to another worker, such as the thread of a
+        MicroBatcher: the task counts towards `pending` until its future is
+        done, so the same bound applies, but no scoring thread waits for it.
+
+        Args:
+            submit: Function that queues the task and returns its
+                concurrent.futures.Future.
+            *args: Positional arguments of `submit`.
+            **kwargs: Keyword arguments of `submit`.
+
+        Returns:
+            concurrent.futures.Future of the task.
+
+        Raises:
+            Overloaded: If `max_workers + max_queue` tasks are already pending.
+        """
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded(f'{self.pending} scoring tasks pending')
+            self.pending += 1
+        try:
+            future = submit(*args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Runs a task in a scoring thread and awaits its result.
+
+        Args:
+            fn: Function to run in a scoring thread.
+            *args: Positional arguments of `fn`.
+            timeout: Timeout in seconds; defaults to `self.timeout`.
+            **kwargs: Keyword arguments of `fn`.
+
+        Returns:
+            The result of `fn`.
+
+        Raises:
+            Overloaded: If the queue is full.
+            asyncio.TimeoutError: If the task did not finish in time.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # A queued task that has not started yet is dropped; a running one finishes in the background.
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise
+
+    def call(self, fn, *args, timeout=None, **kwargs):
+        """
+        Runs a task in a scoring thread and blocks until its result, for WSGI handlers.
+
+        Args:
+            fn: Function to run in a scoring thread.
+            *args: Positional arguments of `fn`.
+            timeout: Timeout in seconds; defaults to `self.timeout`.
+            **kwargs: Keyword arguments of `fn`.
+
+        Returns:
+            The result of `fn`.
+
+        Raises:
+            Overloaded: If the queue is full.
+            concurrent.futures.TimeoutError: If the task did not finish in time.
+        """
+        return self.wait(self.submit(fn, *args, **kwargs), timeout)
+
+    def call_scheduled(self, submit, *args, timeout=None, **kwargs):
+        """
+        Admits a task queued by `submit` (see `schedule`) and blocks until its result.
+
+        Args:
+            submit: Function that queues the task and returns its
+                concurrent.futures.Future, e.g. `MicroBatcher.submit`.
+            *args: Positional arguments of `submit`.
+            timeout: Timeout in seconds; defaults to `self.timeout`.
+            **kwargs: Keyword arguments of `submit`.
+
+        Returns:
+            The result of the task.
+
+        Raises:
+            Overloaded: If the queue is full.
+            concurrent.futures.TimeoutError: If the task did not finish in time.
+        """
+        return self.wait(self.schedule(submit, *args, **kwargs), timeout)
+
+    def wait(self, future, timeout=None):
+        """
+        Blocks until the result of an admitted task.
+
+        Args:
+            future: Future returned by `submit` or `schedule`.
+            timeout: Timeout in seconds; defaults to `self.timeout`.
+
+        Returns:
+            The result of the task.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the task did not finish in time.
+        """
+        try:
+            return future.result(timeout or self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise
+
+    def stats(self):
+        """
+        Returns the executor counters.
+
+        Returns:
+            Dictionary with the pool size, queue capacity, pending, rejected
+            and timed out task counts.
+        """
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'pending': self.pending,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+    def shutdown(self, wait=True):
+        """Stops the scoring threads."""
+        self._executor.shutdown(wait=wait)
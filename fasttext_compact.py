@@ -0,0 +1,224 @@
+import argparse
+import os
+import numpy as np
+from time import time
+from index_store import save_index, load_index, load_vocabulary, version_dir
+
+
+_MB_MASK = 0xC0
+_MB_START = 0x80
+
+
+def ft_hash_bytes(data):
+    """Computes the FNV-1a hash fastText uses for character n-grams.
+
+    As in fastText (and gensim), every byte is sign-extended before the
+    XOR, so bytes >= 0x80 of UTF-8 sequences hash as negative numbers.
+
+    Args:
+        data: UTF-8 encoded n-gram.
+
+    Returns:
+        Unsigned 32-bit hash.
+    """
+    h = 2166136261
+    for byte in data:
+        h ^= (byte - 256 if byte >= 128 else byte) & 0xFFFFFFFF
+        h = (h * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def compute_ngrams_bytes(word, min_n, max_n):
+    """Computes the character n-grams of a word as fastText's computeSubwords does.
+
+    N-grams are taken from '<word>' and counted in UTF-8 characters; the
+    single-character n-grams '<' and '>' are skipped.
+
+    Args:
+        word: The word.
+        min_n: Minimum n-gram length in characters.
+        max_n: Maximum n-gram length in characters.
+
+    Returns:
+        List of UTF-8 encoded n-grams.
+    """
+    data = f'<{word}>'.encode('utf-8')
+    num_bytes = len(data)
+    ngrams = []
+    for i in range(num_bytes):
+        if data[i] & _MB_MASK == _MB_START:
+            continue
+        j, n = i, 1
+        while j < num_bytes and n <= max_n:
+            j += 1
+            while j < num_bytes and data[j] & _MB_MASK == _MB_START:
+                j += 1
+            if n >= min_n and not (n == 1 and (i == 0 or j == num_bytes)):
+                ngrams.append(data[i:j])
+            n += 1
+    return ngrams
+
+
+def ngram_hashes(word, min_n, max_n, bucket):
+    """Returns the n-gram bucket rows of a word.
+
+    Args:
+        word: The word.
+        min_n: Minimum n-gram length.
+        max_n: Maximum n-gram length.
+        bucket: Number of n-gram buckets.
+
+    Returns:
+        List of row numbers in the n-gram matrix.
+    """
+    return [ft_hash_bytes(ngram) % bucket for ngram in compute_ngrams_bytes(word, min_n, max_n)]
+
+
+class CompactFastText():
+    """
+    Query-time FastText embeddings read from a memory-mapped export.
+
+    The export holds the vectors of the corpus vocabulary and of the most
+    frequent model words, plus the n-gram bucket matrix for out-of-vocabulary
+    words. It is a drop-in replacement for the gensim model in
+    FastTextSearcher (`model.wv[word]`, `word in model.wv`,
+    `model.vector_size`), without loading the full model into memory.
+
+    Attributes:
+        vectors: float32 vectors of the exported words (memory-mapped).
+        ngrams: float32 n-gram bucket vectors (memory-mapped).
+        vocabulary: Dictionary of word -> row of `vectors`.
+        min_n: Minimum n-gram length.
+        max_n: Maximum n-gram length.
+        bucket: Number of n-gram buckets.
+        vector_size: Dimensionality of the vectors.
+    """
+
+    def __init__(self, path):
+        """
+        Opens an export written by `export_compact`.
+
+        Args:
+            path: Export directory.
+        """
+        directory = version_dir(path)
+        arrays, manifest = load_index(directory, 'fasttext_compact')
+        self.vectors = arrays['vectors']
+        self.ngrams = arrays['ngrams']
+        self.vocabulary = load_vocabulary(directory)
+        meta = manifest['meta']
+        self.min_n = meta['min_n']
+        self.max_n = meta['max_n']
+        self.bucket = meta['bucket']
+        self.vector_size = meta['vector_size']
+
+    @property
+    def wv(self):
+        """The object itself, for compatibility with `model.wv` of gensim."""
+        return self
+
+    def __contains__(self, word):
+        if self.bucket == 0:
+            return word in self.vocabulary
+        return True
+
+    def __getitem__(self, word):
+        """
+        Returns the vector of a word, as gensim's FastTextKeyedVectors does.
+
+        Args:
+            word: The word.
+
+        Returns:
+            float32 vector; the mean of its n-gram vectors for an
+            out-of-vocabulary word, zeros if it has no n-grams.
+        """
+        row = self.vocabulary.get(word)
+        if row is not None:
+            return self.vectors[row]
+        if self.bucket == 0:
+            raise KeyError(f'cannot calculate vector for OOV word {word!r} without ngrams')
+        hashes = ngram_hashes(word, self.min_n, self.max_n, self.bucket)
+        if not hashes:
+            return np.zeros(self.vector_size, dtype=np.float32)
+        return self.ngrams[hashes].sum(axis=0, dtype=np.float32) / len(hashes)
+
+
+def load_model(path):
+    """Loads a FastText model: a compact export directory or a fastText .bin file.
+
+    Args:
+        path: Export directory or path to the .bin file.
+
+    Returns:
+        CompactFastText or the gensim FastText model.
+    """
+    if os.path.isdir(path):
+        return CompactFastText(path)
+    from gensim.models import FastText
+    return FastText.load_fasttext_format(path)
+
+
+def export_compact(model, path, words=(), top_words=200_000, chunk_size=10000):
+    """Exports the vectors needed at query time from a gensim FastText model.
+
+    Args:
+        model: gensim FastText model.
+        path: Export directory.
+        words: Words that must be exported, e.g. the corpus vocabulary.
+        top_words: Number of most frequent model words exported as well.
+        chunk_size: Number of word vectors computed at once.
+
+    Returns:
+        Dictionary with the number of words and the export size in bytes.
+    """
+    wv = model.wv
+    exported = list(dict.fromkeys(list(words) + list(wv.index_to_key[:top_words])))
+    vectors = np.empty((len(exported), wv.vector_size), dtype=np.float32)
+    for start in range(0, len(exported), chunk_size):
+        vectors[start:start + chunk_size] = [wv[word] for word in exported[start:start + chunk_size]]
+    ngrams = np.asarray(wv.vectors_ngrams, dtype=np.float32)
+    save_index(path, 'fasttext_compact', {'vectors': vectors, 'ngrams': ngrams},
+               meta={'min_n': wv.min_n, 'max_n': wv.max_n, 'bucket': wv.bucket,
+                     'vector_size': wv.vector_size},
+               vocabulary={word: row for row, word in enumerate(exported)})
+    return {'words': len(exported), 'bytes': vectors.nbytes + ngrams.nbytes}
+
+
+def max_difference(compact, model, words):
+    """Compares the vectors of the export with the gensim model.
+
+    Args:
+        compact: CompactFastText.
+        model: gensim FastText model.
+        words: Words to compare, in and out of the vocabulary.
+
+    Returns:
+        The largest absolute difference between the vectors.
+    """
+    return max((float(np.abs(compact.wv[word] - model.wv[word]).max()) for word in words), default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a slim FastText runtime for serving.')
+    parser.add_argument('--model', default='cc.ru.300.bin')
+    parser.add_argument('--out', default='fasttext_compact')
+    parser.add_argument('--top-words', type=int, default=200_000)
+    parser.add_argument('--verify', type=int, default=1000, help='number of words to compare with gensim')
+    args = parser.parse_args()
+
+    from preprocessing import doc_info
+    start = time()
+    model = load_model(args.model)
+    words = list(doc_info.vectorizer.vocabulary_)
+    stats = export_compact(model, args.out, words, args.top_words)
+    print(f"exported {stats['words']} words ({stats['bytes'] / 2**20:.0f} MB) in {time() - start:.1f} sec")
+
+    compact = CompactFastText(args.out)
+    rng = np.random.default_rng(0)
+    sample = [words[idx] for idx in rng.integers(0, len(words), min(args.verify, len(words)))] if words else []
+    sample += [word + 'ыч' for word in sample[:len(sample) // 2]]  # out-of-vocabulary forms
+    print(f"max difference with gensim on {len(sample)} words: {max_difference(compact, model, sample):.3g}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+
+# Day number of documents without a date; such documents never match a date range.
+NO_DATE = np.iinfo(np.int32).min
+
+
+def parse_day(value):
+    """
+    Converts a date to the number of days since 1970-01-01.
+
+    Args:
+        value: 'YYYY-MM-DD' string, datetime.date or numpy.datetime64.
+
+    Returns:
+        Integer day number.
+
+    Raises:
+        ValueError: If the value is not a date.
+    """
+    try:
+        day = np.datetime64(value, 'D')
+    except (TypeError, ValueError):
+        raise ValueError(f'expected a date as YYYY-MM-DD, got {value!r}')
+    if np.isnat(day):
+        raise ValueError(f'expected a date as YYYY-MM-DD, got {value!r}')
+    return int(day.astype(np.int64))
+
+
+class MetadataIndex():
+    """
+    Publish dates and rubrics of the documents with precomputed doc-id lists for filtering.
+
+    Document ids are sorted by date once at build time, so a date range is
+    a contiguous slice of `date_order` found by two binary searches. Every
+    rubric keeps the sorted ids of its documents (CSR layout), so a rubric
+    filter is a slice as well. `select` turns a filter into one sorted
+    array of document ids that the searchers score instead of the whole
+    index; the last filters are cached.
+
+    Documents added after the build have no date or rubric and never match
+    a filter.
+
+    Attributes:
+        num_docs: Number of documents with metadata.
+        date_order: Document ids sorted by publish date.
+        sorted_dates: Day numbers of `date_order`.
+        rubrics: Array of rubric names.
+        rubric_ptr: Range of `rubric_docs` owned by every rubric.
+        rubric_docs: Sorted document ids of every rubric, concatenated.
+    """
+
+    def __init__(self, date_order, sorted_dates, rubrics, rubric_ptr, rubric_docs, num_docs, cache_size=128):
+        """
+        Initializes the MetadataIndex object from its arrays (see `from_columns`).
+
+        Args:
+            date_order: Document ids sorted by publish date.
+            sorted_dates: Day numbers of `date_order`.
+            rubrics: Array of rubric names.
+            rubric_ptr: Range of `rubric_docs` owned by every rubric.
+            rubric_docs: Sorted document ids of every rubric, concatenated.
+            num_docs: Number of documents with metadata.
+            cache_size: Number of selections kept by `select`.
+        """
+        self.date_order = date_order
+        self.sorted_dates = sorted_dates
+        self.rubrics = rubrics
+        self.rubric_ptr = rubric_ptr
+        self.rubric_docs = rubric_docs
+        self.num_docs = int(num_docs)
+        self._rubric_ids = {str(rubric): idx for idx, rubric in enumerate(rubrics)}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.num_docs
+
+    @classmethod
+    def from_columns(cls, dates, rubrics):
+        """
+        Builds the index from per-document values.
+
+        Args:
+            dates: Publish date of every document (strings; missing or
+                malformed dates are allowed).
+            rubrics: Rubric of every document; None for a missing rubric.
+
+        Returns:
+            The MetadataIndex.
+        """
+        days = pd.to_datetime(pd.Series(dates, dtype=object), errors='coerce').values.astype('datetime64[D]')
+        missing = np.isnat(days)
+        days = days.astype(np.int64)
+        days[missing] = NO_DATE
+        days = days.astype(np.int32)
+        date_order = np.argsort(days, kind='stable').astype(np.int64)
+        date_order = date_order[days[date_order] != NO_DATE]
+
+        rubrics = pd.Series(rubrics, dtype=object)
+        codes, names = pd.factorize(rubrics, sort=True)
+        rubric_docs = np.argsort(codes, kind='stable').astype(np.int64)
+        rubric_docs = rubric_docs[codes[rubric_docs] >= 0]
+        counts = np.bincount(codes[codes >= 0], minlength=names.shape[0])
+        rubric_ptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(date_order, days[date_order], np.asarray(names, dtype=str), rubric_ptr, rubric_docs,
+                   len(days))
+
+    @classmethod
+    def build(cls, csv_path, col_name='text', chunk_size=10000):
+        """
+        Reads the date and rubric columns of the CSV corpus chunk by chunk.
+
+        Rows without a text are skipped, as in the document ids of the
+        indexes. Missing columns give documents without a date or rubric.
+
+        Args:
+            csv_path: Path to the CSV file.
+            col_name: Name of the column with texts.
+            chunk_size: Number of CSV rows read at once.
+
+        Returns:
+            The MetadataIndex.
+        """
+        header = pd.read_csv(csv_path, nrows=0).columns
+        columns = [column for column in ('date', 'rubric') if column in header]
+        dates, rubrics = [], []
+        for df in pd.read_csv(csv_path, usecols=columns + [col_name], chunksize=chunk_size):
+            df = df[df[col_name].notna()]
+            dates.extend(df['date'].tolist() if 'date' in columns else [None] * df.shape[0])
+            rubrics.extend(df['rubric'].where(df['rubric'].notna(), None).tolist() if 'rubric' in columns
+                           else [None] * df.shape[0])
+        return cls.from_columns(dates, rubrics)
+
+    def save(self, path):
+        """
+        Saves the arrays to an .npz file, replacing it atomically.
+
+        Args:
+            path: Path to the file.
+        """
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, date_order=self.date_order, sorted_dates=self.sorted_dates, rubrics=self.rubrics,
+                     rubric_ptr=self.rubric_ptr, rubric_docs=self.rubric_docs, num_docs=self.num_docs)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with `save`.
+
+        Args:
+            path: Path to the file.
+
+        Returns:
+            The MetadataIndex.
+        """
+        with np.load(path) as arrays:
+            return cls(arrays['date_order'], arrays['sorted_dates'], arrays['rubrics'], arrays['rubric_ptr'],
+                       arrays['rubric_docs'], int(arrays['num_docs']))
+
+    def date_range(self, date_from=None, date_to=None):
+        """
+        Returns the ids of the documents published in a date range, in date order.
+
+        Args:
+            date_from: First day of the range (inclusive); open if None.
+            date_to: Last day of the range (inclusive); open if None.
+
+        Returns:
+            int64 array of document ids, not sorted by id.
+        """
+        start = 0 if date_from is None else int(np.searchsorted(self.sorted_dates, parse_day(date_from), 'left'))
+        end = (self.sorted_dates.shape[0] if date_to is None
+               else int(np.searchsorted(self.sorted_dates, parse_day(date_to), 'right')))
+        return self.date_order[start:max(start, end)]
+
+    def rubric_ids(self, rubrics):
+        """
+        Returns the sorted ids of the documents of the given rubrics.
+
+        Args:
+            rubrics: Iterable of rubric names; unknown names match nothing.
+
+        Returns:
+            Sorted int64 array of document ids.
+        """
+        parts = [self.rubric_docs[self.rubric_ptr[code]:self.rubric_ptr[code + 1]]
+                 for code in sorted({self._rubric_ids[rubric] for rubric in rubrics if rubric in self._rubric_ids})]
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def _sorted(self, ids):
+        """Sorts document ids, through a bitmap when they cover a large share of the corpus."""
+        if ids.shape[0] * 16 < self.num_docs:
+            return np.sort(ids)
+        mask = np.zeros(self.num_docs, dtype=bool)
+        mask[ids] = True
+        return np.flatnonzero(mask)
+
+    def select(self, date_from=None, date_to=None, rubrics=None):
+        """
+        Returns the documents matching a filter.
+
+        Args:
+            date_from: First publish day (inclusive), e.g. '2023-10-01'.
+            date_to: Last publish day (inclusive).
+            rubrics: Iterable of rubric names; a document matches any of them.
+
+        Returns:
+            Sorted int64 array of document ids, or None if no filter is set.
+
+        Raises:
+            ValueError: If a date is malformed.
+        """
+        if date_from is None and date_to is None and rubrics is None:
+            return None
+        key = (None if date_from is None else parse_day(date_from), None if date_to is None else parse_day(date_to),
+               None if rubrics is None else tuple(sorted(set(rubrics))))
+        with self._lock:
+            ids = self._cache.get(key)
+            if ids is not None:
+                self._cache.move_to_end(key)
+                return ids
+        ids = None
+        if key[0] is not None or key[1] is not None:
+            ids = self._sorted(self.date_range(date_from, date_to))
+        if key[2] is not None:
+            by_rubric = self.rubric_ids(key[2])
+            ids = by_rubric if ids is None else np.intersect1d(ids, by_rubric, assume_unique=True)
+        ids.flags.writeable = False
+        with self._lock:
+            self._cache[key] = ids
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return ids
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from datetime import datetime
+
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+VOCABULARY_NAME = 'vocabulary.json'
+POINTER_NAME = 'CURRENT'
+VERSION_PREFIX = 'version-'
+
+
+class IndexFormatError(Exception):
+    """Raised when an index directory does not match what the caller expects."""
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Computes the SHA-256 checksum of a file.
+
+    Args:
+        path: Path to the file.
+        chunk_size: Number of bytes read at once.
+
+    Returns:
+        Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def vocabulary_terms(vocabulary):
+    """Converts a term -> column mapping into the list of terms ordered by column.
+
+    Args:
+        vocabulary: Dictionary of term -> column index (e.g. `CountVectorizer.vocabulary_`).
+
+    Returns:
+        List of terms.
+    """
+    terms = [None] * len(vocabulary)
+    for term, column in vocabulary.items():
+        terms[column] = term
+    return terms
+
+
+def vocabulary_fingerprint(vocabulary):
+    """Computes a checksum of a term -> column mapping.
+
+    Args:
+        vocabulary: Dictionary of term -> column index.
+
+    Returns:
+        Hex digest identifying the vocabulary and its column order.
+    """
+    return hashlib.sha256('\n'.join(vocabulary_terms(vocabulary)).encode('utf-8')).hexdigest()
+
+
+def version_dir(path):
+    """Returns the directory of the current version of an index.
+
+    Args:
+        path: Index directory.
+
+    Returns:
+        The version directory named by the pointer file, or `path` itself
+        for indexes saved before versioned directories were used and for
+        a version directory that was already resolved.
+
+    Raises:
+        FileNotFoundError: If the directory has no index.
+    """
+    try:
+        with open(os.path.join(path, POINTER_NAME), encoding='utf-8') as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            return path
+        raise
+
+
+def remove_old_versions(path, keep):
+    """Deletes version directories other than the given ones, ignoring errors.
+
+    Args:
+        path: Index directory.
+        keep: Names of the version directories to keep.
+    """
+    for name in os.listdir(path):
+        if name.startswith(VERSION_PREFIX) and name not in keep and os.path.isdir(os.path.join(path, name)):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def save_index(path, kind, arrays, meta=None, vocabulary=None):
+    """Saves index arrays as raw .npy files described by a JSON manifest.
+
+    Every save writes a new version directory and then atomically replaces
+    the pointer file naming the current version, so readers see either the
+    previous or the new version in full, never a mix of files, and a save
+    interrupted at any point leaves the previous version in use. The
+    previous version is kept for processes that are still opening it;
+    older ones are deleted (processes that have them memory-mapped keep
+    reading them).
+
+    Args:
+        path: Index directory; created if needed.
+        kind: Type of the index (e.g. 'tfidf'), checked on load.
+        arrays: Dictionary of name -> NumPy array.
+        meta: JSON-serializable dictionary of extra parameters.
+        vocabulary: Optional term -> column mapping the index was built with.
+    """
+    os.makedirs(path, exist_ok=True)
+    try:
+        previous = os.path.basename(version_dir(path))
+    except FileNotFoundError:
+        previous = None
+    version = tempfile.mkdtemp(prefix=VERSION_PREFIX + datetime.utcnow().strftime('%Y%m%d%H%M%S-'), dir=path)
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'kind': kind,
+        'created_at': datetime.utcnow().isoformat(),
+        'meta': meta or {},
+        'arrays': {},
+    }
+    for name, array in arrays.items():
+        file_name = f'{name}.npy'
+        array = np.ascontiguousarray(array)
+        with open(os.path.join(version, file_name), 'wb') as f:
+            np.save(f, array)
+        manifest['arrays'][name] = {
+            'file': file_name,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'sha256': file_checksum(os.path.join(version, file_name)),
+        }
+    if vocabulary is not None:
+        with open(os.path.join(version, VOCABULARY_NAME), 'w', encoding='utf-8') as f:
+            json.dump(vocabulary_terms(vocabulary), f, ensure_ascii=False)
+        manifest['vocabulary'] = {
+            'file': VOCABULARY_NAME,
+            'size': len(vocabulary),
+            'fingerprint': vocabulary_fingerprint(vocabulary),
+        }
+    with open(os.path.join(version, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    pointer_path = os.path.join(path, POINTER_NAME)
+    with open(pointer_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(version))
+    os.replace(pointer_path + '.tmp', pointer_path)
+    remove_old_versions(path, {os.path.basename(version), previous})
+
+
+def read_manifest(path):
+    """Reads the manifest of the current version of an index.
+
+    Args:
+        path: Index directory.
+
+    Returns:
+        The manifest dictionary.
+
+    Raises:
+        FileNotFoundError: If the directory has no manifest.
+        IndexFormatError: If the manifest has an unsupported format version.
+    """
+    with open(os.path.join(version_dir(path), MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise IndexFormatError(f"{path}: format version {manifest.get('format_version')}, "
+                               f"expected {FORMAT_VERSION}")
+    return manifest
+
+
+def load_index(path, kind, vocabulary=None, mmap_mode='r', verify=False):
+    """Opens an index saved with `save_index`.
+
+    Arrays are memory-mapped read-only by default, so loading takes
+    milliseconds and all processes opening the same index share one copy
+    in the page cache. The dtype and shape of every array are checked
+    against the manifest.
+
+    Args:
+        path: Index directory.
+        kind: Expected type of the index.
+        vocabulary: Term -> column mapping the caller will query the index
+            with; it must match the vocabulary the index was built with.
+        mmap_mode: Mode passed to `np.load`; None reads arrays into memory.
+        verify: Whether to check the SHA-256 checksum of every array file.
+
+    Returns:
+        Tuple of the dictionary of arrays and the manifest.
+
+    Raises:
+        FileNotFoundError: If the directory has no manifest.
+        IndexFormatError: If the index has a different kind, format version
+            or vocabulary, or an array does not match the manifest.
+    """
+    # The pointer is resolved once: a save switching it meanwhile must not mix files of two versions
+    directory = version_dir(path)
+    manifest = read_manifest(directory)
+    if manifest['kind'] != kind:
+        raise IndexFormatError(f"{path}: index of kind {manifest['kind']}, expected {kind}")
+    if vocabulary is not None:
+        expected = manifest.get('vocabulary', {}).get('fingerprint')
+        if expected != vocabulary_fingerprint(vocabulary):
+            raise IndexFormatError(f"{path}: index was built with a different vocabulary")
+    arrays = {}
+    for name, info in manifest['arrays'].items():
+        file_path = os.path.join(directory, info['file'])
+        if verify and file_checksum(file_path) != info['sha256']:
+            raise IndexFormatError(f"{file_path}: checksum mismatch")
+        try:
+            array = np.load(file_path, mmap_mode=mmap_mode)
+        except ValueError as e:
+            raise IndexFormatError(f"{file_path}: {e}")
+        if array.dtype.str != info['dtype'] or list(array.shape) != info['shape']:
+            raise IndexFormatError(f"{file_path}: {array.dtype.str} array of shape {list(array.shape)}, "
+                                   f"manifest expects {info['dtype']} of shape {info['shape']}")
+        arrays[name] = array
+    return arrays, manifest
+
+
+def load_vocabulary(path):
+    """Reads the vocabulary stored with the current version of an index.
+
+    Args:
+        path: Index directory, or a version directory returned by
+            `version_dir` to read the vocabulary of that exact version.
+
+    Returns:
+        Dictionary of term -> column index.
+    """
+    with open(os.path.join(version_dir(path), VOCABULARY_NAME), encoding='utf-8') as f:
+        return {term: column for column, term in enumerate(json.load(f))}
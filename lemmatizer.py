@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pymorphy3 import MorphAnalyzer
+
+
+class Lemmatizer():
+    """
+    Lemmatizer with a bounded LRU cache of word -> normal form.
+
+    News texts reuse a limited set of word forms, so most `morph.parse`
+    calls can be answered from the cache. The cache can be saved to and
+    warmed from a JSON file and reports hit/miss counters for sizing.
+
+    Attributes:
+        morph: The pymorphy3 MorphAnalyzer.
+        max_size: Maximum number of cached word forms.
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups that called the analyzer.
+        evictions: Number of entries dropped to respect `max_size`.
+    """
+
+    def __init__(self, morph=None, max_size=300_000):
+        """
+        Initializes the Lemmatizer object with an empty cache.
+
+        Args:
+            morph: MorphAnalyzer to use; a new one is created by default.
+            max_size: Maximum number of cached word forms.
+        """
+        self.morph = morph or MorphAnalyzer()
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _insert(self, word, lemma):
+        """Adds an entry, evicting the least recently used ones if needed."""
+        self.cache[word] = lemma
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def normal_form(self, word):
+        """
+        Returns the normal form of a word.
+
+        Args:
+            word: Word to lemmatize.
+
+        Returns:
+            The normal form of the word.
+        """
+        with self._lock:
+            lemma = self.cache.get(word)
+            if lemma is not None:
+                self.cache.move_to_end(word)
+                self.hits += 1
+                return lemma
+        lemma = self.morph.parse(word)[0].normal_form
+        with self._lock:
+            self.misses += 1
+            self._insert(word, lemma)
+        return lemma
+
+    def lemmatize(self, words):
+        """
+        Lemmatizes a list of words.
+
+        Args:
+            words: List of words to lemmatize.
+
+        Returns:
+            List of normal forms.
+        """
+        return [self.normal_form(word) for word in words]
+
+    def update(self, mapping):
+        """
+        Adds known word -> normal form pairs without touching the counters.
+
+        Args:
+            mapping: Dictionary of word -> normal form.
+        """
+        with self._lock:
+            for word, lemma in mapping.items():
+                self.cache.pop(word, None)
+                self._insert(word, lemma)
+
+    def warm(self, words):
+        """
+        Fills the cache with the normal forms of the given words.
+
+        Args:
+            words: Iterable of words, e.g. the corpus vocabulary.
+        """
+        for word in words:
+            self.normal_form(word)
+
+    def save(self, path):
+        """
+        Saves the cache to a JSON file, least recently used entries first.
+
+        Args:
+            path: Path to the file.
+        """
+        with self._lock:
+            items = list(self.cache.items())
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path):
+        """
+        Warms the cache from a file written by `save`.
+
+        Args:
+            path: Path to the file.
+
+        Returns:
+            True if the file existed and was loaded.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                items = json.load(f)
+        except FileNotFoundError:
+            return False
+        self.update(dict(items))
+        return True
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dictionary with size, capacity, hits, misses, evictions and hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.cache),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,304 @@
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+from time import perf_counter, sleep, time
+
+
+# Upper bounds of the latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """
+    Cumulative histogram of observed values, as Prometheus exposes it.
+
+    Attributes:
+        buckets: Sorted upper bounds of the buckets.
+        counts: Number of observations per bucket (not cumulative); the last
+            entry counts the values above the largest bound.
+        sum: Sum of the observed values.
+        count: Number of observations.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initializes an empty histogram.
+
+        Args:
+            buckets: Sorted upper bounds of the buckets.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Adds one observation."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Returns the cumulative bucket counts, the sum and the count."""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, running = [], 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, total, count
+
+
+def format_labels(labels):
+    """Formats labels as {name="value",...} for the text exposition format."""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class MetricsRegistry():
+    """
+    Process-wide histograms and collectors rendered in the Prometheus text format.
+
+    Histograms are created on first use per metric name and label set.
+    Collectors are functions called at scrape time that return the current
+    values of gauges and counters kept elsewhere (cache counters, index
+    sizes), so they cost nothing between scrapes.
+
+    Attributes:
+        histograms: Dictionary of (name, labels) -> Histogram.
+        descriptions: Dictionary of metric name -> help text.
+        collectors: List of functions returning (name, value, labels) tuples.
+    """
+
+    def __init__(self):
+        """Initializes an empty registry."""
+        self.histograms = {}
+        self.descriptions = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, description='', **labels):
+        """
+        Returns the histogram of a metric and label set, creating it if needed.
+
+        Args:
+            name: Metric name.
+            description: Help text of the metric.
+            **labels: Label values.
+
+        Returns:
+            The Histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+                if description:
+                    self.descriptions.setdefault(name, description)
+        return histogram
+
+    def observe(self, name, value, **labels):
+        """Adds an observation to the histogram of a metric and label set."""
+        self.histogram(name, **labels).observe(value)
+
+    def register(self, collector, description=None):
+        """
+        Adds a function called at scrape time.
+
+        Args:
+            collector: Function returning an iterable of (name, value, labels)
+                tuples; names ending with `_total` are exposed as counters,
+                the others as gauges.
+            description: Optional dictionary of metric name -> help text.
+        """
+        with self._lock:
+            self.collectors.append(collector)
+            self.descriptions.update(description or {})
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Returns:
+            The text to serve at /metrics.
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            collectors = list(self.collectors)
+        previous = None
+        for (name, labels), histogram in histograms:
+            if name != previous:
+                lines += [f'# HELP {name} {self.descriptions.get(name, name)}', f'# TYPE {name} histogram']
+                previous = name
+            cumulative, total, count = histogram.snapshot()
+            for bound, running in zip(histogram.buckets + (float('inf'),), cumulative):
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {running}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total!r}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        samples = {}
+        for collector in collectors:
+            for name, value, labels in collector():
+                samples.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        for name, values in samples.items():
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            lines += [f'# HELP {name} {self.descriptions.get(name, name)}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{format_labels(labels)} {float(value)!r}' for labels, value in values]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+registry.descriptions['search_stage_seconds'] = 'Time spent in one stage of query processing.'
+_local = threading.local()
+
+
+@contextmanager
+def stage(name, engine=''):
+    """
+    Times a stage of query processing.
+
+    The duration goes to the `search_stage_seconds` histogram and, while a
+    `trace` is open in the current thread, to the per-request breakdown.
+
+    Args:
+        name: Stage name, e.g. 'lemmatize' or 'score'.
+        engine: Search engine; empty for the shared preprocessing stages.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        registry.observe('search_stage_seconds', elapsed, stage=name, engine=engine)
+        stages = getattr(_local, 'stages', None)
+        if stages is not None:
+            key = f'{engine}.{name}' if engine else name
+            stages[key] = stages.get(key, 0.0) + elapsed
+
+
+@contextmanager
+def trace():
+    """
+    Collects the stage durations of one request in the current thread.
+
+    Yields:
+        Dictionary of stage -> seconds, filled as stages finish. Stages run
+        in other threads (e.g. by the MicroBatcher) go to the histograms only.
+    """
+    previous = getattr(_local, 'stages', None)
+    _local.stages = stages = {}
+    try:
+        yield stages
+    finally:
+        _local.stages = previous
+
+
+class SlowRequestProfiler():
+    """
+    Sampling profiler that keeps the stacks of slow requests only.
+
+    While a request is being profiled, a background thread samples its
+    stack every `interval_ms`. When the request finishes faster than
+    `threshold_ms` the samples are dropped; otherwise the most frequent
+    stacks and the stage breakdown are kept in `recent`. Sampling costs
+    nothing when no threshold is set.
+
+    Attributes:
+        threshold_ms: Minimum request duration that is recorded; 0 disables profiling.
+        interval_ms: Sampling interval.
+        top: Number of most frequent stacks kept per request.
+        recent: Deque of the last slow request records.
+    """
+
+    def __init__(self, threshold_ms=0, interval_ms=5, keep=20, top=10):
+        """
+        Initializes the SlowRequestProfiler object.
+
+        Args:
+            threshold_ms: Minimum request duration that is recorded; 0 disables profiling.
+            interval_ms: Sampling interval.
+            keep: Number of slow requests kept.
+            top: Number of most frequent stacks kept per request.
+        """
+        self.threshold_ms = threshold_ms
+        self.interval_ms = interval_ms
+        self.top = top
+        self.recent = deque(maxlen=keep)
+        self._active = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def collapse(frame):
+        """Formats a stack as 'file:function:line;...' from the outermost frame."""
+        entries = []
+        while frame is not None:
+            code = frame.f_code
+            entries.append(f'{code.co_filename.rsplit("/", 1)[-1]}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(entries))
+
+    def _sample(self):
+        """Samples the stacks of the profiled threads until the process exits."""
+        while True:
+            with self._condition:
+                while not self._active:
+                    self._condition.wait()
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            for thread_id, samples in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[self.collapse(frame)] += 1
+            sleep(self.interval_ms / 1000)
+
+    @contextmanager
+    def profile(self, **info):
+        """
+        Profiles the request handled by the current thread.
+
+        Args:
+            **info: Request description stored with the record, e.g. query and engine.
+
+        Yields:
+            Dictionary of stage -> seconds of the request (see `trace`).
+        """
+        if not self.threshold_ms:
+            with trace() as stages:
+                yield stages
+            return
+        thread_id = threading.get_ident()
+        samples = Counter()
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, daemon=True)
+                self._thread.start()
+            self._active[thread_id] = samples
+            self._condition.notify()
+        start = perf_counter()
+        try:
+            with trace() as stages:
+                yield stages
+        finally:
+            duration_ms = (perf_counter() - start) * 1000
+            with self._condition:
+                self._active.pop(thread_id, None)
+            if duration_ms >= self.threshold_ms:
+                self.recent.append({
+                    **info,
+                    'time': time(),
+                    'duration_ms': duration_ms,
+                    'stages_ms': {name: seconds * 1000 for name, seconds in stages.items()},
+                    'samples': sum(samples.values()),
+                    'stacks': [{'stack': stack, 'samples': count} for stack, count in samples.most_common(self.top)],
+                })
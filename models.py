@@ -49,6 +49,26 @@ class Comment(db.Model):
 
     def __repr__(self):
         return f"<Comment User: {self.user_id}, News: {self.news_id}, Text: {self.text}>"
+
+class NewsStats(db.Model):
+    __tablename__ = 'news_stats'
+
+    news_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    bookmarks = db.Column(db.Integer, nullable=False, default=0)
+    comments = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<NewsStats News: {self.news_id}, Likes: {self.likes}, Bookmarks: {self.bookmarks}, Comments: {self.comments}>"
+
+class EngagementCheckpoint(db.Model):
+    __tablename__ = 'engagement_checkpoint'
+
+    journal = db.Column(db.String(255), primary_key=True)
+    last_seq = db.Column(db.BigInteger, nullable=False)
+
+    def __repr__(self):
+        return f"<EngagementCheckpoint Journal: {self.journal}, Seq: {self.last_seq}>"
     
 
 
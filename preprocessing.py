@@ -1,17 +1,32 @@
 from pymorphy3 import MorphAnalyzer
 import pandas as pd
 import numpy as np
+import json
+import os
 import pickle
 import re
+import shutil
 import string
+import threading
+from functools import cached_property
+from itertools import islice
+from scipy import sparse
 from pymorphy3 import MorphAnalyzer
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.preprocessing import normalize
+from ranking import top_k
+from index_store import file_checksum
+from lemmatizer import Lemmatizer
+from document_store import DocumentStore
+from dedup import minhash_signatures, lsh_clusters
+from filters import MetadataIndex
+from metrics import stage
 
 
 morph = MorphAnalyzer()
+lemmatizer = Lemmatizer(morph)
 
 
 def text_lowercase(text):
@@ -50,7 +65,7 @@ def get_tokens(text):
     
 
 def lemmatize(list_of_words):
-    """Lemmatizes a list of words.
+    """Lemmatizes a list of words through the shared cached lemmatizer.
 
     Args:
         list_of_words: List of words to lemmatize.
@@ -58,7 +73,25 @@ def lemmatize(list_of_words):
     Returns:
         List of lemmatized words.
     """
-    return [morph.parse(word)[0].normal_form for word in list_of_words]
+    return lemmatizer.lemmatize(list_of_words)
+
+def query_lemmas(text):
+    """Turns a search query into lemmas, timing every preprocessing stage.
+
+    Args:
+        text: The search query.
+
+    Returns:
+        List of lemmas.
+    """
+    with stage('lowercase'):
+        text = text_lowercase(text)
+    with stage('punctuation'):
+        text = remove_punctuation(text)
+    with stage('tokenize'):
+        tokens = get_tokens(text)
+    with stage('lemmatize'):
+        return lemmatize(tokens)
     
 def load_texts(path='ria-2023.csv', col_name='text'):
     """Loads texts from a CSV file.
@@ -70,29 +103,23 @@ def load_texts(path='ria-2023.csv', col_name='text'):
     Returns:
         Tuple of a list of cleaned texts and the number of rows in the file.
     """
-    df = pd.read_csv(path)
-    if df[col_name].isna().sum() != 0:
-         df = df.dropna()
-         num_rows = df.shape[0]
-    else:
-         df = pd.read_csv(path)
-         num_rows = df.shape[0]
+    df = pd.read_csv(path, usecols=[col_name]).dropna()
+    num_rows = df.shape[0]
     docs = df[col_name].tolist()
     clean_texts = [remove_punctuation(text_lowercase(text)) for text in docs]
     return docs, clean_texts, num_rows
 
 def create_matrix(texts):
-    """Creates a matrix from texts using CountVectorizer.
+    """Creates a sparse term-count matrix from texts using CountVectorizer.
 
     Args:
         texts: List of texts.
 
     Returns:
-        Tuple of a matrix and a CountVectorizer object.
+        Tuple of a CSR matrix and a CountVectorizer object.
     """
     vectorizer = CountVectorizer()
-    X = vectorizer.fit_transform(texts)
-    vectors = X.toarray()
+    vectors = vectorizer.fit_transform(texts).tocsr()
     return vectors, vectorizer
 
 def compute_cos_similarity(X, Y):
@@ -107,38 +134,643 @@ def compute_cos_similarity(X, Y):
     """
     return np.inner(X, Y) / (np.linalg.norm(X) * np.linalg.norm(Y))
 
-def range_texts(cos_sim_array):
+def range_texts(cos_sim_array, n=None):
     """Sorts texts by descending cosine similarity.
 
     Args:
         cos_sim_array: Array of cosine similarities.
+        n: Number of best texts to keep; all texts are kept by default.
 
     Returns:
         List of tuples (text index, cosine similarity).
     """
-    return sorted(enumerate(cos_sim_array), key=lambda x: x[1], reverse=True)
+    if n is None:
+        n = len(cos_sim_array)
+    indices, scores = top_k(cos_sim_array, n)
+    return list(zip(indices.tolist(), scores.tolist()))
+
+# Words that keep a lemma after `remove_punctuation`: those not made of punctuation only
+SNIPPET_WORD = re.compile(r'\S*[^\s' + re.escape(string.punctuation) + r']\S*')
+
+def make_snippet(text, query, width=200, lemmatized=None):
+    """Cuts a fragment of a document around the first query word it contains.
+
+    Words are matched by their lemmas, so different forms of a query word
+    are found too. With the precomputed lemmatized text the first matching
+    lemma is found by a list scan, and only the words before it are walked
+    to find its position in the original text.
+
+    Args:
+        text: Original text of the document.
+        query: The search query.
+        width: Maximum length of the fragment in characters.
+        lemmatized: Lemmatized text of the document (see `Docs.lemmatized`),
+            one lemma per word; the words are lemmatized one by one if it is
+            None or its matching lemma lies past the last word of the text.
+
+    Returns:
+        The fragment with an ellipsis where the text was cut.
+    """
+    query_lemmas = set(lemmatize(get_tokens(remove_punctuation(text_lowercase(query)))))
+    position = None
+    if lemmatized is not None:
+        target = next((idx for idx, lemma in enumerate(lemmatized.split()) if lemma in query_lemmas), None)
+        if target is None:
+            position = 0
+        else:
+            match = next(islice(SNIPPET_WORD.finditer(text), target, None), None)
+            position = None if match is None else match.start()
+    if position is None:
+        position = 0
+        for match in re.finditer(r'\w+', text):
+            if lemmatize([match.group().lower()])[0] in query_lemmas:
+                position = match.start()
+                break
+    start = max(0, min(position - width // 4, len(text) - width))
+    snippet = text[start:start + width].strip()
+    if start > 0:
+        snippet = '...' + snippet
+    if start + width < len(text):
+        snippet += '...'
+    return snippet
      
+def source_checksum(path, cache_file):
+    """Computes the SHA-256 checksum of a source file, reusing a cached value.
+
+    The checksum is cached together with the file size and modification
+    time, so an unchanged file is not read again.
+
+    Args:
+        path: Path to the source file.
+        cache_file: Path to the JSON file with the cached checksum.
+
+    Returns:
+        Hex digest of the file contents.
+    """
+    stat = os.stat(path)
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+    except (FileNotFoundError, KeyError, ValueError):
+        pass
+    checksum = file_checksum(path)
+    with open(cache_file, 'w', encoding='utf-8') as f:
+        json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': checksum}, f)
+    return checksum
+
+
 class Docs():
     """Class for working with documents.
 
+    Corpus artifacts are loaded lazily: every attribute is read from
+    `artifacts_dir` on first access. The artifacts are keyed by the checksum
+    of the source CSV and are rebuilt (lemmatization and vectorizer fit)
+    only when the CSV changes. If the CSV is missing, the existing
+    artifacts are used as they are.
+
+    Documents added after the build get ids after the CSV documents and are
+    kept in `added.jsonl`; deleted ids are kept in `deleted.json`. Both are
+    reset when the artifacts are rebuilt from a new CSV. Writers of all
+    processes are serialized by the write lock of the document store, and
+    `refresh` picks up the changes made by other processes.
+
+    Near-duplicate CSV documents (republished or slightly edited stories)
+    are grouped with MinHash/LSH over the lemmatized texts; indexes contain
+    only the canonical (earliest) document of every cluster. The row of a
+    cluster stands for all its members: filters select it when any live
+    member matches, it stays indexed while any member is live, and a
+    result is shown as a live member that matches the filters (see
+    `representatives`).
+
+    Publish dates and rubrics are kept in a MetadataIndex with precomputed
+    doc-id lists, which `select` turns into the set of documents a filtered
+    search scores.
+
     Attributes:
+        docs: List of original texts; used for index builds, search results
+            read texts through `store`.
+        store: DocumentStore with texts and metadata of all documents.
         clean_texts: List of cleaned texts.
-        num_rows: Number of rows in the CSV file.
+        num_rows: Number of documents.
         lemmatized_texts: List of lemmatized texts.
-        vectors: Feature matrix.
+        vectors: Sparse (CSR) term-count matrix.
         vectorizer: CountVectorizer object.
+        dedup_threshold: Estimated Jaccard similarity of word shingles above
+            which documents are duplicates; None disables deduplication.
+        canonical: Canonical document id of every CSV document.
+        canonical_ids: Ids of the documents that are indexed.
+        clusters: Dictionary of canonical id -> ids of its duplicates.
+        hidden_ids: Set of indexed documents whose whole cluster is deleted.
+        metadata: MetadataIndex of the publish dates and rubrics.
+        meta: Dictionary with the source checksum and the number of CSV documents.
+        added: List of documents added after the build (text and lemmatized text).
+        deleted: Set of deleted document ids.
+        version: String identifying the corpus state.
     """
-    def __init__(self, file_name='lemmatized_vectorizer.pickle'):
-        """Initializes a Docs object.
+    def __init__(self, path='ria-2023.csv', artifacts_dir='corpus_artifacts',
+                 file_name='lemmatized_vectorizer.pickle', dedup_threshold=0.8):
+        """Initializes a Docs object without loading anything.
 
         Args:
-            file_name: Name of the file to save vectorizer.
+            path: Path to the source CSV file.
+            artifacts_dir: Directory with the persisted corpus artifacts.
+            file_name: Name of the vectorizer file inside `artifacts_dir`.
+            dedup_threshold: Similarity above which documents are duplicates;
+                None indexes all documents.
         """
-        self.docs, self.clean_texts, self.num_rows = load_texts()
-        self.lemmatized_texts = [' '.join(lemmatize(get_tokens(text))) for text in self.clean_texts]
+        self.path = path
+        self.artifacts_dir = artifacts_dir
+        self.file_name = file_name
+        self.dedup_threshold = dedup_threshold
+        self._lock = threading.RLock()
+        self._added_offset = 0
+        self._deleted_stat = None
+
+    def _artifact(self, name):
+        """Returns the path of an artifact file."""
+        return os.path.join(self.artifacts_dir, name)
+
+    @cached_property
+    def meta(self):
+        """Validates the artifacts against the source CSV, rebuilding them if needed."""
+        with self._lock:
+            if 'meta' in self.__dict__:
+                return self.__dict__['meta']
+            os.makedirs(self.artifacts_dir, exist_ok=True)
+            try:
+                with open(self._artifact('meta.json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+            except FileNotFoundError:
+                meta = None
+            if os.path.exists(self.path):
+                checksum = source_checksum(self.path, self._artifact('source.json'))
+                if meta is None or meta['source_sha256'] != checksum:
+                    meta = self.build(checksum)
+            elif meta is None:
+                raise FileNotFoundError(f"{self.path} not found and no artifacts in {self.artifacts_dir}")
+            lemmatizer.load(self._artifact('lemma_cache.json'))
+            return meta
+
+    def build(self, checksum):
+        """Recomputes and saves all corpus artifacts.
+
+        Args:
+            checksum: Checksum of the source CSV the artifacts are built from.
+
+        Returns:
+            The new metadata dictionary.
+        """
+        from corpus_build import lemmatize_corpus, iter_lemmatized
+        parts_dir = self._artifact(f'lemmatized_parts-{checksum[:16]}')
+        lemmatize_corpus(self.path, parts_dir, cache_path=self._artifact('lemma_cache.json'))
+        self.lemmatized_texts = list(iter_lemmatized(parts_dir))
+        num_rows = len(self.lemmatized_texts)
         self.vectors, self.vectorizer = create_matrix(self.lemmatized_texts)
-        with open(file_name, 'wb') as f:
+        with open(self._artifact('lemmatized_texts.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(text + '\n' for text in self.lemmatized_texts)
+        shutil.rmtree(parts_dir)
+        sparse.save_npz(self._artifact('vectors.npz'), self.vectors)
+        with open(self._artifact(self.file_name), 'wb') as f:
             pickle.dump(self.vectorizer, f)
+        for name in ('added.jsonl', 'deleted.json', 'documents.sqlite3', 'dedup.npz', 'metadata.npz',
+                     'lemmatized_offsets.npy'):
+            if os.path.exists(self._artifact(name)):
+                os.remove(self._artifact(name))
+        self.added, self.deleted = [], set()
+        self._added_offset, self._deleted_stat = 0, None
+        for name in ('store', 'canonical', 'clusters', 'metadata', 'lemmatized_offsets'):
+            self.__dict__.pop(name, None)
+        meta = {'source_sha256': checksum, 'num_rows': num_rows}
+        with open(self._artifact('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return meta
+
+    @property
+    def num_rows(self):
+        """Number of documents: the CSV documents and the added ones."""
+        return self.meta['num_rows'] + len(self.added)
+
+    @property
+    def version(self):
+        """String identifying the corpus state: source checksum, added and deleted documents.
+
+        Deleted documents are identified by their count and the modification
+        time of `deleted.json`, so another set of the same size changes it too.
+        """
+        deleted, identity = self.deleted, self._deleted_stat
+        return f"{self.meta['source_sha256'][:16]}-{self.num_rows}-{len(deleted)}-{identity[1] if identity else 0}"
+
+    def _read_added(self, offset=0):
+        """Reads the complete lines of `added.jsonl` after a byte offset.
+
+        Args:
+            offset: Position to read from.
+
+        Returns:
+            Tuple of the records read and the offset after the last complete line.
+        """
+        try:
+            with open(self._artifact('added.jsonl'), 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        data = data[:data.rfind(b'\n') + 1]
+        return [json.loads(line) for line in data.decode('utf-8').splitlines()], offset + len(data)
+
+    def _read_deleted(self):
+        """Reads `deleted.json`.
+
+        Returns:
+            Tuple of the set of deleted ids and the identity of the file
+            (inode, modification time and size), or None if it is missing.
+        """
+        path = self._artifact('deleted.json')
+        try:
+            stat = os.stat(path)
+            with open(path, encoding='utf-8') as f:
+                return set(json.load(f)), (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return set(), None
+
+    @cached_property
+    def added(self):
+        """Records of the documents added after the build, read from `added.jsonl`."""
+        self.meta
+        with self._lock:
+            if 'added' in self.__dict__:
+                return self.__dict__['added']
+            added, self._added_offset = self._read_added()
+            return added
+
+    @cached_property
+    def deleted(self):
+        """Set of the ids of deleted documents, read from `deleted.json`."""
+        self.meta
+        with self._lock:
+            if 'deleted' in self.__dict__:
+                return self.__dict__['deleted']
+            deleted, self._deleted_stat = self._read_deleted()
+            return deleted
+
+    def _extend_added(self, records):
+        """Appends added documents to the attributes that are already loaded."""
+        self.added.extend(records)
+        texts = [record['text'] for record in records]
+        for name, values in (('docs', texts),
+                             ('clean_texts', [remove_punctuation(text_lowercase(text)) for text in texts]),
+                             ('lemmatized_texts', [record['lemmatized'] for record in records])):
+            if name in self.__dict__:
+                self.__dict__[name].extend(values)
+        self.__dict__.pop('vectors', None)
+
+    def refresh(self):
+        """Picks up documents added or deleted by other processes.
+
+        `added.jsonl` is only appended to and `deleted.json` is replaced
+        atomically, so when nothing changed the check costs two `stat` calls.
+
+        Returns:
+            The current `version`.
+        """
+        self.added, self.deleted
+        with self._lock:
+            try:
+                size = os.path.getsize(self._artifact('added.jsonl'))
+            except FileNotFoundError:
+                size = 0
+            if size > self._added_offset:
+                records, self._added_offset = self._read_added(self._added_offset)
+                self._extend_added(records)
+            try:
+                stat = os.stat(self._artifact('deleted.json'))
+                identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                identity = None
+            if identity != self._deleted_stat:
+                self.deleted, self._deleted_stat = self._read_deleted()
+            return self.version
+
+    def add_documents(self, texts):
+        """Adds new documents after the existing ones.
+
+        Args:
+            texts: List of original texts.
+
+        Returns:
+            List of ids of the new documents.
+        """
+        clean_texts = [remove_punctuation(text_lowercase(text)) for text in texts]
+        lemmatized_texts = [' '.join(lemmatize(get_tokens(text))) for text in clean_texts]
+        records = [{'text': text, 'lemmatized': lemmatized} for text, lemmatized in zip(texts, lemmatized_texts)]
+        with self._lock, self.store.locked():
+            self.refresh()
+            first_id = self.num_rows
+            data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+            with open(self._artifact('added.jsonl'), 'ab') as f:
+                f.write(data)
+            self._added_offset += len(data)
+            self.store.add(first_id, [{'text': text} for text in texts])
+            self._extend_added(records)
+        return list(range(first_id, first_id + len(texts)))
+
+    def delete_documents(self, ids):
+        """Marks documents as deleted.
+
+        Args:
+            ids: Ids of the documents to delete.
+        """
+        with self._lock, self.store.locked():
+            self.refresh()
+            deleted = self.deleted | {int(idx) for idx in ids}
+            path = self._artifact('deleted.json')
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(sorted(deleted), f)
+            os.replace(path + '.tmp', path)
+            self.deleted, self._deleted_stat = self._read_deleted()
+
+    @cached_property
+    def canonical(self):
+        """Canonical document id of every CSV document, computed once and saved to `dedup.npz`."""
+        self.meta
+        with self._lock:
+            if 'canonical' in self.__dict__:
+                return self.__dict__['canonical']
+            num_rows = self.meta['num_rows']
+            if self.dedup_threshold is None:
+                return np.arange(num_rows, dtype=np.int64)
+            path = self._artifact('dedup.npz')
+            if os.path.exists(path):
+                saved = np.load(path)
+                if saved['canonical'].shape[0] == num_rows and float(saved['threshold']) == self.dedup_threshold:
+                    return saved['canonical']
+            signatures = minhash_signatures(self.lemmatized_texts[:num_rows])
+            canonical = lsh_clusters(signatures, self.dedup_threshold)
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, canonical=canonical, threshold=self.dedup_threshold)
+            os.replace(path + '.tmp', path)
+            return canonical
+
+    @property
+    def canonical_ids(self):
+        """Ids of the indexed documents: canonical CSV documents and all added ones."""
+        canonical = self.canonical
+        return np.concatenate((np.flatnonzero(canonical == np.arange(canonical.shape[0])),
+                               np.arange(canonical.shape[0], self.num_rows))).astype(np.int64)
+
+    @property
+    def dedup_version(self):
+        """String stored in the index manifests; indexes built with other duplicates are rebuilt."""
+        if self.dedup_threshold is None:
+            return 'off'
+        return f"{self.dedup_threshold}-{int((self.canonical == np.arange(self.canonical.shape[0])).sum())}"
+
+    @cached_property
+    def clusters(self):
+        """Dictionary of canonical id -> ids of its duplicates, for clusters with duplicates only."""
+        canonical = self.canonical
+        clusters = {}
+        for doc_id in np.flatnonzero(canonical != np.arange(canonical.shape[0])).tolist():
+            clusters.setdefault(int(canonical[doc_id]), []).append(doc_id)
+        return clusters
+
+    @property
+    def hidden_ids(self):
+        """Deleted documents to hide in the indexes; a deleted canonical document is kept while a duplicate is live."""
+        deleted, clusters = self.deleted, self.clusters
+        return {idx for idx in deleted if all(member in deleted for member in clusters.get(idx, ()))}
+
+    def cluster_of(self, idx):
+        """Returns the ids of all documents of the cluster of a document, canonical first."""
+        canonical = self.canonical
+        idx = int(canonical[idx]) if idx < canonical.shape[0] else int(idx)
+        return [idx] + self.clusters.get(idx, [])
+
+    def representatives(self, ids, filters=None):
+        """Picks the document shown for every indexed document found by a search.
+
+        The canonical document is shown if it is live and matches the
+        filters, otherwise the first of its duplicates that is.
+
+        Args:
+            ids: List of indexed document ids.
+            filters: The filters of the search (see `select`).
+
+        Returns:
+            List of document ids.
+        """
+        clusters = self.clusters
+        if not clusters:
+            return [int(idx) for idx in ids]
+        deleted = self.deleted
+        selected = self.metadata.select(filters.get('date_from'), filters.get('date_to'),
+                                        filters.get('rubrics')) if filters else None
+        shown = []
+        for idx in ids:
+            idx = int(idx)
+            for member in [idx] + clusters.get(idx, []):
+                if member in deleted:
+                    continue
+                if selected is not None:
+                    position = int(np.searchsorted(selected, member))
+                    if position == selected.shape[0] or selected[position] != member:
+                        continue
+                idx = member
+                break
+            shown.append(idx)
+        return shown
+
+    def duplicate_ids(self, ids):
+        """Returns the live near-duplicates of each of the given documents.
+
+        Args:
+            ids: List of document ids (e.g. from `representatives`).
+
+        Returns:
+            List with one list of duplicate ids per document.
+        """
+        deleted = self.deleted
+        return [[member for member in self.cluster_of(int(idx)) if member != int(idx) and member not in deleted]
+                for idx in ids]
+
+    @cached_property
+    def metadata(self):
+        """Loads the publish dates and rubrics, building `metadata.npz` from the CSV if it is missing."""
+        self.meta
+        with self._lock:
+            if 'metadata' in self.__dict__:
+                return self.__dict__['metadata']
+            path = self._artifact('metadata.npz')
+            if os.path.exists(path):
+                metadata = MetadataIndex.load(path)
+                if len(metadata) == self.meta['num_rows']:
+                    return metadata
+            metadata = MetadataIndex.build(self.path)
+            metadata.save(path)
+            return metadata
+
+    def select(self, filters):
+        """Finds the documents matching a search filter.
+
+        Args:
+            filters: Dictionary with optional 'date_from' and 'date_to'
+                ('YYYY-MM-DD', inclusive) and 'rubrics' (list of names); None
+                or an empty dictionary means no filter.
+
+        Returns:
+            Sorted array of the indexed document ids to score, or None if
+            there is no filter. A cluster of near-duplicates is selected
+            through its canonical id when any of its live members matches.
+
+        Raises:
+            ValueError: If a date is malformed.
+        """
+        if not filters:
+            return None
+        ids = self.metadata.select(filters.get('date_from'), filters.get('date_to'), filters.get('rubrics'))
+        if not self.clusters:
+            return ids
+        deleted = self.deleted
+        if deleted:
+            ids = ids[~np.isin(ids, np.fromiter(deleted, dtype=np.int64, count=len(deleted)))]
+        return np.unique(self.canonical[ids])
+
+    @cached_property
+    def store(self):
+        """Opens the document store, building it from the CSV if it is missing or stale."""
+        self.meta
+        with self._lock:
+            if 'store' in self.__dict__:
+                return self.__dict__['store']
+            path = self._artifact('documents.sqlite3')
+            self.refresh()
+            if os.path.exists(path):
+                store = DocumentStore(path)
+                if len(store) == self.num_rows:
+                    return store
+            return DocumentStore.build(self.path, path, added=[record['text'] for record in self.added])
+
+    def documents(self, ids):
+        """Reads the texts and metadata of documents.
+
+        Args:
+            ids: List of document ids.
+
+        Returns:
+            List of dictionaries with id, title, date, url, rubric and text.
+        """
+        return self.store.get(ids)
+
+    def texts(self, ids):
+        """Reads the texts of documents.
+
+        Args:
+            ids: List of document ids.
+
+        Returns:
+            List of texts.
+        """
+        return [document['text'] for document in self.store.get(ids)]
+
+    @cached_property
+    def docs(self):
+        """Original texts of all documents; loaded from the CSV on first use, together with `clean_texts`."""
+        self.meta
+        with self._lock:
+            if 'docs' not in self.__dict__:
+                docs, clean_texts, _ = load_texts(self.path)
+                added = [record['text'] for record in self.added]
+                self.clean_texts = clean_texts + [remove_punctuation(text_lowercase(text)) for text in added]
+                self.docs = docs + added
+            return self.__dict__['docs']
+
+    @cached_property
+    def clean_texts(self):
+        """Lowercased texts of all documents without punctuation."""
+        self.docs
+        return self.__dict__['clean_texts']
+
+    @cached_property
+    def lemmatized_texts(self):
+        """Lemmatized texts of all documents, one string of space-separated lemmas each."""
+        self.meta
+        if 'lemmatized_texts' in self.__dict__:
+            return self.__dict__['lemmatized_texts']
+        with open(self._artifact('lemmatized_texts.txt'), encoding='utf-8') as f:
+            texts = [line.rstrip('\n') for line in f]
+        return texts + [record['lemmatized'] for record in self.added]
+
+    @cached_property
+    def lemmatized_offsets(self):
+        """Byte offsets of the lines of `lemmatized_texts.txt`, saved to `lemmatized_offsets.npy` once."""
+        self.meta
+        with self._lock:
+            if 'lemmatized_offsets' in self.__dict__:
+                return self.__dict__['lemmatized_offsets']
+            path = self._artifact('lemmatized_offsets.npy')
+            if os.path.exists(path):
+                offsets = np.load(path, mmap_mode='r')
+                if offsets.shape[0] == self.meta['num_rows'] + 1:
+                    return offsets
+            offsets = [0]
+            with open(self._artifact('lemmatized_texts.txt'), 'rb') as f:
+                for line in f:
+                    offsets.append(offsets[-1] + len(line))
+            offsets = np.array(offsets, dtype=np.int64)
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, offsets)
+            os.replace(path + '.tmp', path)
+            return offsets
+
+    def lemmatized(self, ids):
+        """Reads the lemmatized texts of documents.
+
+        Unless `lemmatized_texts` is already loaded, only the lines of the
+        requested documents are read, so serving processes do not keep the
+        lemmatized corpus in memory.
+
+        Args:
+            ids: List of document ids.
+
+        Returns:
+            List of lemmatized texts.
+        """
+        if 'lemmatized_texts' in self.__dict__:
+            return [self.lemmatized_texts[idx] for idx in ids]
+        num_rows = self.meta['num_rows']
+        offsets = self.lemmatized_offsets
+        texts = []
+        with open(self._artifact('lemmatized_texts.txt'), 'rb') as f:
+            for idx in ids:
+                if idx >= num_rows:
+                    texts.append(self.added[idx - num_rows]['lemmatized'])
+                    continue
+                f.seek(int(offsets[idx]))
+                texts.append(f.read(int(offsets[idx + 1] - offsets[idx])).decode('utf-8').rstrip('\r\n'))
+        return texts
+
+    @cached_property
+    def vectors(self):
+        """CSR matrix of lemma counts of all documents, with the added documents appended."""
+        self.meta
+        if 'vectors' in self.__dict__:
+            return self.__dict__['vectors']
+        vectors = sparse.load_npz(self._artifact('vectors.npz')).tocsr()
+        if self.added:
+            added = self.vectorizer.transform([record['lemmatized'] for record in self.added])
+            vectors = sparse.vstack([vectors, added]).tocsr()
+        return vectors
+
+    @cached_property
+    def vectorizer(self):
+        """The fitted CountVectorizer of the lemmatized corpus."""
+        self.meta
+        if 'vectorizer' in self.__dict__:
+            return self.__dict__['vectorizer']
+        with open(self._artifact(self.file_name), 'rb') as f:
+            return pickle.load(f)
+
 
-         
 doc_info = Docs()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import numpy as np
+from time import perf_counter
+from ranking import top_k
+from ann import recall_at_k
+from index_store import save_index, load_index, IndexFormatError
+
+
+class Int8Matrix():
+    """
+    Row-wise int8 scalar quantization of a normalized float32 matrix.
+
+    Every row is stored as int8 codes and one float32 scale, x ~ codes * scale
+    with scale = max|x| / 127, which takes 4x less memory than float32.
+    Scores are computed on the codes chunk by chunk, so the float32 form of
+    the whole matrix never exists in memory. The object supports the slicing,
+    row indexing and stacking SegmentedIndex needs, so it can be a segment.
+
+    Attributes:
+        codes: int8 matrix (rows x dim).
+        scales: float32 scale of every row.
+        chunk_size: Number of rows dequantized at once while scoring.
+    """
+
+    def __init__(self, codes, scales, chunk_size=16384):
+        """
+        Initializes the Int8Matrix object.
+
+        Args:
+            codes: int8 matrix (rows x dim).
+            scales: float32 scale of every row.
+            chunk_size: Number of rows dequantized at once while scoring.
+        """
+        self.codes = codes
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def quantize(cls, matrix, chunk_size=16384):
+        """
+        Quantizes a float matrix chunk by chunk.
+
+        Args:
+            matrix: Float matrix (rows x dim), possibly memory-mapped.
+            chunk_size: Number of rows processed at once, here and while scoring.
+
+        Returns:
+            The Int8Matrix.
+        """
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        scales = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], chunk_size):
+            chunk = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+            chunk_scales = np.abs(chunk).max(axis=1) / 127
+            chunk_scales[chunk_scales == 0] = 1
+            codes[start:start + chunk_size] = np.rint(chunk / chunk_scales[:, None])
+            scales[start:start + chunk_size] = chunk_scales
+        return cls(codes, scales, chunk_size)
+
+    @classmethod
+    def vstack(cls, matrices):
+        """Stacks Int8Matrix objects vertically."""
+        return cls(np.concatenate([matrix.codes for matrix in matrices]),
+                   np.concatenate([matrix.scales for matrix in matrices]), matrices[0].chunk_size)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, rows):
+        return Int8Matrix(self.codes[rows], self.scales[rows], self.chunk_size)
+
+    def dequantize(self):
+        """Returns the approximate float32 matrix."""
+        return self.codes.astype(np.float32) * self.scales[:, None]
+
+    def dot(self, queries):
+        """
+        Scores the rows against float query vectors.
+
+        Args:
+            queries: float32 query vector or matrix with one query per row.
+
+        Returns:
+            Scores with the last axis corresponding to the rows of the matrix.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty(queries.shape[:-1] + (self.codes.shape[0],), dtype=np.float32)
+        for start in range(0, self.codes.shape[0], self.chunk_size):
+            end = start + self.chunk_size
+            scores[..., start:end] = queries @ self.codes[start:end].astype(np.float32).T
+        scores *= self.scales
+        return scores
+
+    def save(self, path, doc_ids, meta=None):
+        """
+        Saves the codes and scales to an index directory.
+
+        Args:
+            path: Index directory.
+            doc_ids: Document id of every row.
+            meta: JSON-serializable dictionary of extra parameters.
+        """
+        save_index(path, 'int8', {'codes': self.codes, 'scales': self.scales, 'doc_ids': doc_ids},
+                   meta=meta)
+
+    @classmethod
+    def load(cls, path, doc_ids):
+        """
+        Opens codes saved with `save`.
+
+        Args:
+            path: Index directory.
+            doc_ids: Document ids of the float matrix the codes must match.
+
+        Returns:
+            The memory-mapped Int8Matrix.
+
+        Raises:
+            IndexFormatError: If the codes were built for other documents.
+        """
+        arrays, manifest = load_index(path, 'int8')
+        if not np.array_equal(arrays['doc_ids'], doc_ids):
+            raise IndexFormatError(f"{path} was built for other documents")
+        return cls(arrays['codes'], arrays['scales'])
+
+
+def quantization_report(matrix, queries, k=10, reranks=(0, 2, 5, 10)):
+    """
+    Compares int8 scoring with exact float32 search on the same queries.
+
+    Args:
+        matrix: L2-normalized float32 document matrix.
+        queries: L2-normalized query vectors (one per row).
+        k: Number of neighbours per query.
+        reranks: Candidate multipliers: k * rerank int8 candidates are rescored
+            in float32; 0 means no rerank.
+
+    Returns:
+        Dictionary with the float32 and int8 sizes in bytes and a list of
+        dictionaries with the rerank multiplier, recall@k and mean latency in ms.
+    """
+    compact = Int8Matrix.quantize(matrix)
+    exact_ids = []
+    start = perf_counter()
+    for query in queries:
+        exact_ids.append(top_k(matrix @ query, k)[0])
+    rows = [{'rerank': None, 'recall': 1.0,
+             'latency_ms': (perf_counter() - start) * 1000 / max(len(queries), 1)}]
+    for rerank in reranks:
+        approx_ids = []
+        start = perf_counter()
+        for query in queries:
+            candidates = top_k(compact.dot(query), max(k, k * rerank))[0]
+            if rerank:
+                candidates = candidates[top_k(matrix[candidates] @ query, k)[0]]
+            approx_ids.append(candidates)
+        rows.append({'rerank': rerank, 'recall': recall_at_k(exact_ids, approx_ids),
+                     'latency_ms': (perf_counter() - start) * 1000 / max(len(queries), 1)})
+    return {'float32_bytes': matrix.nbytes, 'int8_bytes': compact.nbytes, 'rows': rows}
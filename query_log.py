@@ -0,0 +1,152 @@
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import closing
+from time import time
+from autocomplete import normalize_query
+
+
+class QueryLog():
+    """
+    Aggregated counts of the search queries, for autocompletion.
+
+    `log` only puts the query into a bounded in-memory queue, so the
+    request never waits for the disk; when the queue is full the query is
+    dropped. A background thread normalizes the queued queries every
+    `interval` seconds and adds their counts to a SQLite table shared by
+    all worker processes in one transaction. The table holds one row per
+    distinct query and is capped at `max_queries` rows: the rarest and
+    oldest queries are deleted first. The number of rows is kept in a
+    one-row table updated by triggers, as in the result cache.
+
+    Attributes:
+        path: Path to the database file.
+        max_queries: Maximum number of distinct queries kept.
+        max_length: Longer queries are not logged.
+        interval: Time in seconds between writes to the database.
+        logged: Number of queries written to the database.
+        dropped: Number of queries dropped because the queue was full.
+        flushes: Number of writes to the database.
+    """
+
+    def __init__(self, path='query_log.sqlite3', max_queries=100000, max_length=200, interval=1.0,
+                 max_pending=10000):
+        """
+        Initializes the QueryLog object, creates the tables if needed and starts the writer thread.
+
+        Args:
+            path: Path to the database file.
+            max_queries: Maximum number of distinct queries kept.
+            max_length: Longer queries are not logged.
+            interval: Time in seconds between writes to the database.
+            max_pending: Number of queries the queue holds.
+        """
+        self.path = path
+        self.max_queries = max_queries
+        self.max_length = max_length
+        self.interval = interval
+        self.logged = 0
+        self.dropped = 0
+        self.flushes = 0
+        self._queue = queue.Queue(max_pending)
+        self._closed = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._writer = self._connect()
+        with self._writer:
+            self._writer.execute('BEGIN IMMEDIATE')
+            self._writer.execute('CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, '
+                                 'count INTEGER NOT NULL, last_seen REAL)')
+            self._writer.execute('CREATE INDEX IF NOT EXISTS queries_count ON queries (count, last_seen)')
+            self._writer.execute('CREATE TABLE IF NOT EXISTS queries_size '
+                                 '(id INTEGER PRIMARY KEY CHECK (id = 0), rows INTEGER NOT NULL)')
+            self._writer.execute('CREATE TRIGGER IF NOT EXISTS queries_insert AFTER INSERT ON queries BEGIN '
+                                 'UPDATE queries_size SET rows = rows + 1; END')
+            self._writer.execute('CREATE TRIGGER IF NOT EXISTS queries_delete AFTER DELETE ON queries BEGIN '
+                                 'UPDATE queries_size SET rows = rows - 1; END')
+            self._writer.execute('INSERT OR IGNORE INTO queries_size SELECT 0, COUNT(*) FROM queries')
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        """Opens a connection to the database."""
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def log(self, text):
+        """
+        Queues a query for counting without waiting.
+
+        Args:
+            text: The search query as typed.
+        """
+        if not text.strip() or len(text) > self.max_length:
+            return
+        try:
+            self._queue.put_nowait(text)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Adds the counts of the queued queries to the database and trims it to `max_queries` rows."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        counts = Counter()
+        while True:
+            try:
+                counts[normalize_query(self._queue.get_nowait())] += 1
+            except queue.Empty:
+                break
+        counts.pop('', None)
+        if not counts:
+            return
+        now = time()
+        with self._writer:
+            self._writer.execute('BEGIN IMMEDIATE')
+            self._writer.executemany('INSERT INTO queries VALUES (?, ?, ?) ON CONFLICT (query) DO UPDATE SET '
+                                     'count = count + excluded.count, last_seen = excluded.last_seen',
+                                     [(query, count, now) for query, count in counts.items()])
+            extra = self._writer.execute('SELECT rows FROM queries_size').fetchone()[0] - self.max_queries
+            if extra > 0:
+                self._writer.execute('DELETE FROM queries WHERE query IN (SELECT query FROM queries '
+                                     'ORDER BY count, last_seen LIMIT ?)', (extra,))
+        self.logged += sum(counts.values())
+        self.flushes += 1
+
+    def _run(self):
+        while True:
+            closed = self._closed.wait(self.interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # the counts of this batch are lost; autocompletion only needs frequent queries
+            if closed:
+                break
+        self._writer.close()
+
+    def counts(self, min_count=1):
+        """
+        Reads the aggregated counts.
+
+        Args:
+            min_count: Queries seen fewer times are left out.
+
+        Returns:
+            Dictionary of normalized query -> number of occurrences.
+        """
+        with closing(self._connect()) as connection:
+            return dict(connection.execute('SELECT query, count FROM queries WHERE count >= ?', (min_count,)))
+
+    def stats(self):
+        """Returns the number of queries logged, dropped and waiting, and of writes."""
+        return {'logged': self.logged, 'dropped': self.dropped, 'pending': self._queue.qsize(),
+                'flushes': self.flushes}
+
+    def close(self):
+        """Writes the queued queries and stops the writer thread."""
+        self._closed.set()
+        self._thread.join()
@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def top_k(scores, k):
+    """Selects the k highest scores without sorting the whole array.
+
+    `np.argpartition` moves the k best entries to the front in linear time,
+    and only those k entries are then sorted.
+
+    Args:
+        scores: 1-D array of scores (any array-like of shape (N,) or (N, 1)).
+        k: Number of entries to select; clamped to the number of scores,
+            so callers can pass any page depth.
+
+    Returns:
+        Tuple of two arrays: indices of the selected entries and their scores,
+        both ordered by descending score.
+    """
+    scores = np.asarray(scores).ravel()
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), scores[:0]
+    if k < scores.shape[0]:
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(scores.shape[0])
+    indices = indices[np.argsort(-scores[indices], kind='stable')]
+    return indices, scores[indices]
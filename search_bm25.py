@@ -0,0 +1,606 @@
+import heapq
+import threading
+import numpy as np
+from bisect import bisect_left
+from scipy import sparse
+from preprocessing import (get_tokens, lemmatize, doc_info,
+            remove_punctuation, text_lowercase, query_lemmas)
+from metrics import stage
+from index_store import save_index, load_index, IndexFormatError
+from ranking import top_k
+from time import time
+
+
+BLOCK_SIZE = 128
+
+
+def encode_varbyte(values):
+    """Encodes non-negative integers with variable-byte compression.
+
+    Every value is written as little-endian groups of 7 bits; the high bit
+    of a byte is set when more bytes of the same value follow.
+
+    Args:
+        values: 1-D array of non-negative integers below 2**35.
+
+    Returns:
+        Tuple of the encoded uint8 buffer and the number of bytes used by
+        each value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(values.shape[0], dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        num_bytes += values >= (1 << shift)
+    ends = np.cumsum(num_bytes)
+    starts = ends - num_bytes
+    buffer = np.zeros(int(ends[-1]) if ends.size else 0, dtype=np.uint8)
+    for j in range(5):
+        has_byte = num_bytes > j
+        chunk = (values[has_byte] >> np.uint64(7 * j)) & np.uint64(0x7F)
+        more = (num_bytes[has_byte] - 1 > j).astype(np.uint64) << np.uint64(7)
+        buffer[starts[has_byte] + j] = (chunk | more).astype(np.uint8)
+    return buffer, num_bytes
+
+
+def decode_varbyte(buffer):
+    """Decodes a buffer produced by `encode_varbyte`.
+
+    Args:
+        buffer: 1-D uint8 array holding whole encoded values.
+
+    Returns:
+        1-D int64 array of decoded values.
+    """
+    buffer = np.asarray(buffer, dtype=np.uint8)
+    ends = np.flatnonzero(buffer < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    position = np.arange(buffer.shape[0]) - np.repeat(starts, ends - starts + 1)
+    parts = (buffer & 0x7F).astype(np.int64) << (7 * position)
+    return np.add.reduceat(parts, starts)
+
+
+class PostingCursor():
+    """
+    Forward iterator over the compressed posting list of one query lemma.
+
+    Blocks are decoded lazily, and `next_geq` jumps over whole blocks using
+    the last document id stored for every block, so skipped blocks are never
+    decompressed.
+
+    Attributes:
+        doc: Current document id or None when the list is exhausted.
+        tf: Term frequency of the lemma in the current document.
+        upper_bound: Maximum score this lemma can contribute to a document.
+    """
+
+    def __init__(self, searcher, term_id, weight):
+        """
+        Initializes the cursor at the first posting.
+
+        Args:
+            searcher: BM25Searcher that owns the index arrays.
+            term_id: Column of the lemma in the vectorizer vocabulary.
+            weight: Query weight of the lemma (query term frequency * idf).
+        """
+        self.searcher = searcher
+        self.weight = weight
+        self.first_block = int(searcher.term_block_ptr[term_id])
+        self.end_block = int(searcher.term_block_ptr[term_id + 1])
+        self.upper_bound = weight * float(searcher.term_max[term_id])
+        self.block = self.first_block - 1
+        self.doc = None
+        self.tf = 0
+        self._load_block(self.first_block)
+
+    def _load_block(self, block):
+        """Decodes a block and moves the cursor to its first posting."""
+        if block >= self.end_block:
+            self.doc = None
+            return
+        searcher = self.searcher
+        start, end = searcher.block_offsets[block], searcher.block_offsets[block + 1]
+        values = decode_varbyte(searcher.postings[start:end])
+        count = values.shape[0] // 2
+        prev_last = int(searcher.block_last[block - 1]) if block > self.first_block else -1
+        self.block = block
+        self.docs = (prev_last + np.cumsum(values[:count])).tolist()
+        self.tfs = values[count:].tolist()
+        self.pos = 0
+        self.doc = self.docs[0]
+        self.tf = self.tfs[0]
+
+    def next(self):
+        """Moves the cursor to the next posting."""
+        self.pos += 1
+        if self.pos < len(self.docs):
+            self.doc = self.docs[self.pos]
+            self.tf = self.tfs[self.pos]
+        else:
+            self._load_block(self.block + 1)
+
+    def next_geq(self, target):
+        """
+        Moves the cursor to the first posting with document id >= target.
+
+        Args:
+            target: Document id to advance to.
+        """
+        if self.doc is None or self.doc >= target:
+            return
+        block_last = self.searcher.block_last
+        if block_last[self.block] < target:
+            block = self.block + 1
+            block += int(np.searchsorted(block_last[block:self.end_block], target))
+            self._load_block(block)
+            if self.doc is None:
+                return
+        self.pos = bisect_left(self.docs, target, self.pos)
+        self.doc = self.docs[self.pos]
+        self.tf = self.tfs[self.pos]
+
+    def score(self):
+        """Returns the BM25 contribution of the lemma to the current document."""
+        tf = self.tf
+        return self.weight * tf * (self.searcher.k1 + 1) / (tf + float(self.searcher.doc_norms[self.doc]))
+
+
+class BM25Searcher():
+    """
+    Class for searching through a BM25 inverted index.
+
+    Each lemma of the vectorizer vocabulary owns a posting list of
+    (document id, term frequency) pairs. Posting lists are split into
+    blocks of BLOCK_SIZE postings; document ids are delta-encoded and both
+    streams are variable-byte compressed. Queries are evaluated with WAND,
+    so only documents whose score can still enter the top-n are scored.
+    Filtered queries score the allowed documents term at a time instead.
+
+    Documents added after the build are kept in an in-memory delta: blocks
+    of their term counts in CSC layout, weighted with the idf and average
+    length of the index and scored exhaustively. Every sync appends a block;
+    a block is restacked with the previous one only while that one is not
+    larger, so the delta holds few blocks and an add never converts the
+    whole delta again. The documents are moved into the compressed postings
+    by the next build. Deleted documents are skipped while scoring.
+
+    Attributes:
+        docs_info: Object containing information about the documents.
+        k1: BM25 term frequency saturation parameter.
+        b: BM25 document length normalization parameter.
+        postings: Compressed postings of all lemmas (uint8).
+        term_block_ptr: Range of blocks owned by every lemma.
+        block_offsets: Byte offset of every block in `postings`.
+        block_last: Last document id of every block.
+        term_max: Maximum saturated term frequency of every lemma, i.e. the
+            largest BM25 contribution before multiplying by the query weight,
+            rounded up to float32.
+        idf: Inverse document frequency of every lemma.
+        doc_norms: Per-document length normalization k1 * (1 - b + b * dl / avgdl).
+        avgdl: Average document length of the index.
+        num_indexed: Number of documents of `docs_info` covered by the index
+            and the delta.
+        delta: Tuple of delta blocks, each a tuple of its first document id,
+            its CSC term counts (one row per document) and the length
+            normalization of its documents.
+        deleted: Set of the deleted document ids hidden in the index (see `Docs.hidden_ids`).
+        deleted_ids: Sorted array of `deleted`.
+        synced_version: Version of `docs_info` the delta was last synced with.
+    """
+
+    def __init__(self, index_file_name='', docs_info=doc_info, k1=1.2, b=0.75):
+        """
+        Initializes the BM25Searcher object.
+
+        Args:
+            index_file_name: Index directory to load the index from.
+            docs_info: Object containing information about the documents.
+            k1: BM25 term frequency saturation parameter.
+            b: BM25 document length normalization parameter.
+        """
+        self.docs_info = docs_info
+        self.k1 = k1
+        self.b = b
+        if index_file_name:
+            self.load(index_file_name)
+        else:
+            self.index_bm25()
+        self.num_indexed = self.doc_norms.shape[0]
+        self.delta = ()
+        self.deleted, self.deleted_ids = frozenset(), np.zeros(0, dtype=np.int64)
+        self.synced_version = None
+        self._sync_lock = threading.Lock()
+        self.sync()
+
+    def load(self, index_file_name):
+        """
+        Opens the inverted index from an index directory.
+
+        All arrays are memory-mapped; the index is rebuilt if it is missing or
+        was built with another vocabulary or other duplicate clusters.
+
+        Args:
+            index_file_name: Index directory to load the index from.
+        """
+        try:
+            arrays, manifest = load_index(index_file_name, 'bm25',
+                                          vocabulary=self.docs_info.vectorizer.vocabulary_)
+            if manifest['meta'].get('dedup') != self.docs_info.dedup_version:
+                raise IndexFormatError(f"{index_file_name} was built with other duplicate clusters")
+            if 'avgdl' not in manifest['meta']:
+                raise IndexFormatError(f"{index_file_name} has no average document length")
+            if manifest['meta'].get('term_max') != 'rounded up':
+                raise IndexFormatError(f"{index_file_name} has upper bounds rounded to nearest")
+        except (FileNotFoundError, IndexFormatError) as ex:
+            self.index_bm25(index_file_name)
+            return
+        self.k1 = manifest['meta']['k1']
+        self.b = manifest['meta']['b']
+        self.avgdl = manifest['meta']['avgdl']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def index_bm25(self, index_file_name='bm25_index'):
+        """
+        Builds and saves the inverted index.
+
+        The term-count matrix of `docs_info` is transposed to CSC, which
+        already stores the sorted document ids and term frequencies of every
+        lemma, and the posting lists are cut into blocks and compressed
+        without leaving NumPy. Rows of near-duplicate documents are emptied,
+        so they have no postings and do not count in idf and avgdl.
+
+        Args:
+            index_file_name: Index directory to save the index to.
+        """
+        indexed = np.zeros(self.docs_info.vectors.shape[0])
+        indexed[self.docs_info.canonical_ids] = 1
+        vectors = sparse.diags(indexed) @ self.docs_info.vectors
+        vectors.eliminate_zeros()
+        counts = vectors.tocsc()
+        counts.sort_indices()
+        num_docs = int(indexed.sum())
+        indptr = counts.indptr.astype(np.int64)
+        doc_ids = counts.indices.astype(np.int64)
+        tfs = counts.data.astype(np.int64)
+        df = np.diff(indptr)
+
+        doc_len = np.asarray(vectors.sum(axis=1)).ravel().astype(np.float64)
+        avgdl = doc_len.sum() / num_docs if num_docs else 0.0
+        doc_norms = self.k1 * (1 - self.b + self.b * doc_len / max(avgdl, 1e-9))
+        idf = np.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+        scores = tfs * (self.k1 + 1) / (tfs + doc_norms[doc_ids])
+
+        num_blocks = -(-df // BLOCK_SIZE)
+        term_block_ptr = np.concatenate(([0], np.cumsum(num_blocks)))
+        block_term = np.repeat(np.arange(df.shape[0]), num_blocks)
+        block_rank = np.arange(block_term.shape[0]) - term_block_ptr[block_term]
+        block_starts = indptr[block_term] + block_rank * BLOCK_SIZE
+        block_ends = np.minimum(block_starts + BLOCK_SIZE, indptr[block_term + 1])
+        block_counts = block_ends - block_starts
+
+        prev_doc = np.empty_like(doc_ids)
+        prev_doc[0:1] = -1
+        prev_doc[1:] = doc_ids[:-1]
+        prev_doc[indptr[:-1][df > 0]] = -1
+        gaps = doc_ids - prev_doc
+
+        posting_block = np.repeat(np.arange(block_term.shape[0]), block_counts)
+        position = np.arange(doc_ids.shape[0])
+        stream = np.empty(2 * doc_ids.shape[0], dtype=np.int64)
+        stream[block_starts[posting_block] + position] = gaps
+        stream[block_starts[posting_block] + block_counts[posting_block] + position] = tfs
+        postings, num_bytes = encode_varbyte(stream)
+        byte_ends = np.concatenate(([0], np.cumsum(num_bytes)))
+        block_offsets = np.concatenate((byte_ends[2 * block_starts], [byte_ends[-1]]))
+
+        term_max = np.zeros(df.shape[0])
+        if block_starts.size:
+            block_max = np.maximum.reduceat(scores, block_starts)
+            nonempty = df > 0
+            term_max[nonempty] = np.maximum.reduceat(block_max, term_block_ptr[:-1][nonempty])
+
+        self.postings = postings
+        self.term_block_ptr = term_block_ptr
+        self.block_offsets = block_offsets
+        self.block_last = doc_ids[block_ends - 1]
+        # Rounded up: a float32 bound below the true maximum would let WAND skip a document of the top n
+        self.term_max = np.nextafter(term_max.astype(np.float32), np.float32(np.inf))
+        self.idf = idf.astype(np.float32)
+        self.doc_norms = doc_norms
+        self.avgdl = float(avgdl)
+        save_index(index_file_name, 'bm25',
+                   {'postings': self.postings, 'term_block_ptr': self.term_block_ptr,
+                    'block_offsets': self.block_offsets, 'block_last': self.block_last,
+                    'term_max': self.term_max, 'idf': self.idf, 'doc_norms': self.doc_norms},
+                   meta={'k1': self.k1, 'b': self.b, 'block_size': BLOCK_SIZE, 'avgdl': self.avgdl,
+                         'dedup': self.docs_info.dedup_version, 'term_max': 'rounded up'},
+                   vocabulary=self.docs_info.vectorizer.vocabulary_)
+
+    def sync(self):
+        """
+        Brings the delta and the deleted documents up to date with `docs_info`.
+        """
+        with self._sync_lock:
+            self.synced_version = self.docs_info.version
+            num_rows = self.docs_info.num_rows
+            if num_rows > self.num_indexed:
+                added = self.docs_info.vectorizer.transform(self.docs_info.lemmatized_texts[self.num_indexed:num_rows])
+                doc_len = np.asarray(added.sum(axis=1)).ravel().astype(np.float64)
+                norms = self.k1 * (1 - self.b + self.b * doc_len / max(self.avgdl, 1e-9))
+                blocks = list(self.delta) + [(self.num_indexed, added.tocsc(), norms)]
+                while len(blocks) > 1 and blocks[-2][1].shape[0] <= blocks[-1][1].shape[0]:
+                    (first_id, counts, norms), (_, added, added_norms) = blocks[-2:]
+                    blocks[-2:] = [(first_id, sparse.vstack([counts, added]).tocsc(),
+                                    np.concatenate((norms, added_norms)))]
+                self.delta = tuple(blocks)
+                self.num_indexed = num_rows
+            deleted = self.docs_info.hidden_ids
+            # Compared as sets rather than by size, which can stay the same while the hidden documents change
+            if deleted != self.deleted:
+                self.deleted, self.deleted_ids = frozenset(deleted), np.array(sorted(deleted), dtype=np.int64)
+
+    def maybe_sync(self):
+        """Calls `sync` if documents were added or deleted, by this process or another one."""
+        if self.docs_info.refresh() != self.synced_version:
+            self.sync()
+
+    def add_documents(self, texts):
+        """
+        Adds new documents; they are searchable as soon as this returns.
+
+        Args:
+            texts: List of original texts.
+
+        Returns:
+            List of ids of the new documents.
+        """
+        doc_ids = self.docs_info.add_documents(texts)
+        self.sync()
+        return doc_ids
+
+    def delete_documents(self, doc_ids):
+        """
+        Deletes documents from the search results.
+
+        Args:
+            doc_ids: Ids of the documents to delete.
+        """
+        self.docs_info.delete_documents(doc_ids)
+        self.sync()
+
+    def query_weights(self, text):
+        """
+        Maps a query to lemma ids of the index and their query weights.
+
+        Args:
+            text: The search query.
+
+        Returns:
+            Dictionary of lemma id -> query term frequency * idf.
+        """
+        line = ' '.join(query_lemmas(text))
+        with stage('vectorize', 'bm25'):
+            vocabulary = self.docs_info.vectorizer.vocabulary_
+            analyzer = self.docs_info.vectorizer.build_analyzer()
+            weights = {}
+            for lemma in analyzer(line):
+                term_id = vocabulary.get(lemma)
+                if term_id is not None:
+                    weights[term_id] = weights.get(term_id, 0.0) + float(self.idf[term_id])
+        return weights
+
+    def wand(self, weights, n, deleted=frozenset()):
+        """
+        Retrieves the top-n documents with the WAND algorithm.
+
+        Cursors are kept sorted by their current document. The pivot is the
+        first cursor at which the sum of upper bounds exceeds the score of
+        the current n-th result; documents before the pivot are skipped
+        without being scored, and so are deleted pivots. Of documents tied
+        at the n-th score, the ones with smaller ids are returned.
+
+        Args:
+            weights: Dictionary of lemma id -> query weight.
+            n: Number of results to return.
+            deleted: Set of document ids that are never returned.
+
+        Returns:
+            List of tuples (score, document index) sorted by descending score
+            and ascending index.
+        """
+        if n <= 0:
+            return []
+        cursors = [PostingCursor(self, term_id, weight) for term_id, weight in weights.items()]
+        cursors = [cursor for cursor in cursors if cursor.doc is not None]
+        heap = []
+        threshold = 0.0
+        while cursors:
+            cursors.sort(key=lambda cursor: cursor.doc)
+            upper_bound = 0.0
+            pivot = None
+            for i, cursor in enumerate(cursors):
+                upper_bound += cursor.upper_bound
+                if upper_bound > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot].doc
+            if cursors[0].doc == pivot_doc:
+                live = pivot_doc not in deleted
+                score = 0.0
+                for cursor in cursors:
+                    if cursor.doc != pivot_doc:
+                        break
+                    if live:
+                        score += cursor.score()
+                    cursor.next()
+                # Keyed by (score, -id): of tied documents the one with the larger id is evicted first
+                if live and len(heap) < n:
+                    heapq.heappush(heap, (score, -pivot_doc))
+                elif live and score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, -pivot_doc))
+                if len(heap) == n:
+                    threshold = heap[0][0]
+            else:
+                for cursor in cursors[:pivot]:
+                    cursor.next_geq(pivot_doc)
+            cursors = [cursor for cursor in cursors if cursor.doc is not None]
+        return [(score, -neg_doc) for score, neg_doc in sorted(heap, reverse=True)]
+
+    def decode_blocks(self, blocks, prev_last):
+        """
+        Decodes several posting blocks at once.
+
+        Args:
+            blocks: Array of block numbers.
+            prev_last: Last document id before every block (-1 for the first
+                block of a lemma); document ids are delta-encoded from it.
+
+        Returns:
+            Tuple of the document ids and term frequencies of all postings
+            of the blocks, concatenated.
+        """
+        starts, ends = self.block_offsets[blocks], self.block_offsets[blocks + 1]
+        lengths = ends - starts
+        block_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        positions = np.arange(int(lengths.sum())) - np.repeat(block_starts - starts, lengths)
+        buffer = self.postings[positions]
+        values = decode_varbyte(buffer)
+        value_ends = np.cumsum(buffer < 0x80)
+        block_values = np.diff(np.concatenate(([0], value_ends[np.cumsum(lengths) - 1])))
+        counts = block_values // 2
+        value_block = np.repeat(np.arange(blocks.shape[0]), block_values)
+        rank = np.arange(values.shape[0]) - np.repeat(np.cumsum(block_values) - block_values, block_values)
+        is_gap = rank < counts[value_block]
+        gaps, tfs = values[is_gap], values[~is_gap]
+        running = np.cumsum(gaps)
+        firsts = np.cumsum(counts) - counts
+        block_base = np.repeat(running[firsts] - gaps[firsts], counts)
+        return np.repeat(prev_last, counts) + running - block_base, tfs
+
+    def filtered_top(self, weights, allowed, n):
+        """
+        Retrieves the top-n documents among the allowed ones, term at a time.
+
+        For every query lemma only the blocks whose document range contains
+        an allowed document are decompressed, all at once with NumPy, and the
+        scores are accumulated in an array over the allowed documents. The
+        work grows with the blocks touched only; WAND prunes poorly here,
+        because the n-th score among the filtered documents stays low.
+
+        Args:
+            weights: Dictionary of lemma id -> query weight.
+            allowed: Sorted array of the document ids that may be returned.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples (score, document index) sorted by descending score.
+        """
+        scores = np.zeros(allowed.shape[0])
+        if not allowed.shape[0]:
+            return []
+        for term_id, weight in weights.items():
+            first, end = int(self.term_block_ptr[term_id]), int(self.term_block_ptr[term_id + 1])
+            if first == end:
+                continue
+            last = self.block_last[first:end]
+            prev = np.concatenate(([-1], last[:-1]))
+            blocks = np.flatnonzero(np.searchsorted(allowed, last, 'right') > np.searchsorted(allowed, prev, 'right'))
+            if not blocks.shape[0]:
+                continue
+            docs, tfs = self.decode_blocks(blocks + first, prev[blocks])
+            positions = np.minimum(np.searchsorted(allowed, docs), allowed.shape[0] - 1)
+            found = allowed[positions] == docs
+            docs, tfs = docs[found], tfs[found]
+            scores += np.bincount(positions[found], weight * tfs * (self.k1 + 1) / (tfs + self.doc_norms[docs]),
+                                  minlength=allowed.shape[0])
+        indices, top_scores = top_k(scores, n)
+        return [(float(score), int(allowed[index])) for index, score in zip(indices, top_scores) if score > 0]
+
+    def delta_top(self, weights, n, allowed=None):
+        """
+        Retrieves the top-n documents of the delta, scoring all of them.
+
+        Args:
+            weights: Dictionary of lemma id -> query weight.
+            n: Number of results to return.
+            allowed: Optional sorted array of the document ids that may be returned.
+
+        Returns:
+            List of tuples (score, document index) sorted by descending score.
+        """
+        top = []
+        for first_id, counts, norms in self.delta:
+            scores = np.zeros(counts.shape[0])
+            for term_id, weight in weights.items():
+                start, end = counts.indptr[term_id], counts.indptr[term_id + 1]
+                rows, tfs = counts.indices[start:end], counts.data[start:end]
+                scores[rows] += weight * tfs * (self.k1 + 1) / (tfs + norms[rows])
+            doc_ids = np.arange(first_id, first_id + counts.shape[0])
+            excluded = np.isin(doc_ids, self.deleted_ids)
+            if allowed is not None:
+                excluded |= ~np.isin(doc_ids, allowed)
+            scores[excluded] = 0.0
+            indices, top_scores = top_k(scores, n)
+            top += [(float(score), int(doc_ids[index])) for index, score in zip(indices, top_scores) if score > 0]
+        return sorted(top, key=lambda item: (-item[0], item[1]))[:n]
+
+    def search_ids(self, text, n=10, filters=None):
+        """
+        Searches for relevant documents and returns their ids.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+            filters: Dictionary of date and rubric filters (see `Docs.select`).
+
+        Returns:
+            List of tuples containing the BM25 score and the document id.
+        """
+        if n <= 0:
+            return []
+        self.maybe_sync()
+        allowed = self.docs_info.select(filters)
+        deleted, deleted_ids = self.deleted, self.deleted_ids
+        if allowed is not None and deleted_ids.shape[0]:
+            allowed = np.setdiff1d(allowed, deleted_ids, assume_unique=True)
+        weights = self.query_weights(text)
+        with stage('score', 'bm25'):
+            if allowed is None:
+                top = self.wand(weights, n, deleted)
+            else:
+                top = self.filtered_top(weights, allowed, n)
+            top += self.delta_top(weights, n, allowed)
+        # Equal scores are ordered by document id, the order in which WAND keeps tied documents
+        return [(score, int(index)) for score, index in sorted(top, key=lambda item: (-item[0], item[1]))[:n]]
+
+    def search(self, text, n=10):
+        """
+        Searches for relevant documents based on the input text.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples containing the BM25 score and the text of the document.
+        """
+        results = self.search_ids(text, n)
+        return list(zip([score for score, _ in results], self.docs_info.texts([index for _, index in results])))
+
+
+
+def main():
+    start = time()
+    bm25 = BM25Searcher("bm25_index")
+    print(f"loading took {time()-start} sec")
+    start = time()
+    print(bm25.search("зеленский украина"))
+    print(f"searching took {time()-start} sec")
+
+if __name__ == "__main__":
+    main()
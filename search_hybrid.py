@@ -0,0 +1,149 @@
+import numpy as np
+from preprocessing import doc_info
+from ranking import top_k
+from metrics import stage
+from search_tfidf import TfidfSearcher
+from searcher_fasttext import FastTextSearcher
+from time import time
+
+
+FUSIONS = ('rrf', 'weighted')
+
+
+class HybridSearcher():
+    """
+    Two-stage search: TF-IDF candidates reranked with FastText.
+
+    The TF-IDF index selects the `candidates` best lexical matches, and
+    only their FastText vectors are compared with the query, so semantic
+    similarity costs a few hundred dot products instead of a pass over the
+    whole FastText matrix. The two scores are fused either with reciprocal
+    rank fusion or with a weighted sum of the cosine similarities.
+
+    Attributes:
+        tfidf: TfidfSearcher producing the candidates.
+        fasttext: FastTextSearcher used for reranking.
+        docs_info: Object containing information about the documents.
+        candidates: Number of TF-IDF candidates to rerank.
+        fusion: 'rrf' for reciprocal rank fusion or 'weighted' for a
+            weighted sum of the scores.
+        weight: Weight of the FastText score in the weighted sum.
+        rrf_k: Rank offset of reciprocal rank fusion.
+    """
+
+    def __init__(self, tfidf, fasttext, docs_info=doc_info, candidates=300, fusion='rrf', weight=0.5, rrf_k=60):
+        """
+        Initializes the HybridSearcher object.
+
+        Args:
+            tfidf: TfidfSearcher producing the candidates.
+            fasttext: FastTextSearcher used for reranking.
+            docs_info: Object containing information about the documents.
+            candidates: Number of TF-IDF candidates to rerank.
+            fusion: 'rrf' or 'weighted'.
+            weight: Weight of the FastText score in the weighted sum.
+            rrf_k: Rank offset of reciprocal rank fusion.
+        """
+        if fusion not in FUSIONS:
+            raise ValueError(f"unknown fusion {fusion}, expected one of {FUSIONS}")
+        self.tfidf = tfidf
+        self.fasttext = fasttext
+        self.docs_info = docs_info
+        self.candidates = candidates
+        self.fusion = fusion
+        self.weight = weight
+        self.rrf_k = rrf_k
+
+    def fuse(self, lexical, semantic, has_vector):
+        """
+        Combines the scores of the candidates.
+
+        Args:
+            lexical: TF-IDF cosine of every candidate, in descending order.
+            semantic: FastText cosine of every candidate.
+            has_vector: Mask of the candidates that have a FastText vector.
+
+        Returns:
+            Array of fused scores.
+        """
+        if self.fusion == 'weighted':
+            return (1 - self.weight) * lexical + self.weight * np.where(has_vector, semantic, 0.0)
+        lexical_rank = np.arange(1, lexical.shape[0] + 1)
+        semantic_rank = np.empty(semantic.shape[0], dtype=np.int64)
+        semantic_rank[np.argsort(-np.where(has_vector, semantic, -np.inf), kind='stable')] = lexical_rank
+        return 1 / (self.rrf_k + lexical_rank) + np.where(has_vector, 1 / (self.rrf_k + semantic_rank), 0.0)
+
+    def search_ids_many(self, texts, n=10, filters=None):
+        """
+        Searches for relevant documents for a batch of queries.
+
+        Args:
+            texts: List of search queries.
+            n: Number of results to return for every query.
+            filters: Dictionary of date and rubric filters (see `Docs.select`);
+                they restrict the TF-IDF candidates.
+
+        Returns:
+            List with one list of tuples (fused score, document id) per query.
+        """
+        candidate_lists = self.tfidf.search_ids_many(texts, max(n, self.candidates), filters=filters)
+        self.fasttext.maybe_sync()
+        queries, valid = self.fasttext.query_matrix(texts)
+        results = []
+        with stage('fuse', 'hybrid'):
+            for candidates, query, is_valid in zip(candidate_lists, queries, valid):
+                candidates = [(score, index) for score, index in candidates if score > 0]
+                if not candidates:
+                    results.append([])
+                    continue
+                lexical = np.array([score for score, _ in candidates])
+                ids = np.array([index for _, index in candidates], dtype=np.int64)
+                semantic = np.zeros(ids.shape[0])
+                has_vector = np.zeros(ids.shape[0], dtype=bool)
+                if is_valid:
+                    rows, positions = self.fasttext.segments.take(ids)
+                    semantic[positions] = rows @ query
+                    has_vector[positions] = True
+                indices, scores = top_k(self.fuse(lexical, semantic, has_vector), n)
+                results.append([(float(score), int(index)) for index, score in zip(ids[indices], scores)])
+        return results
+
+    def search_ids(self, text, n=10, filters=None):
+        """
+        Searches for relevant documents and returns their ids.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+            filters: Dictionary of date and rubric filters (see `Docs.select`).
+
+        Returns:
+            List of tuples containing the fused score and the document id.
+        """
+        return self.search_ids_many([text], n, filters=filters)[0]
+
+    def search(self, text, n=10):
+        """
+        Searches for relevant documents based on the input text.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples containing the fused score and the text of the document.
+        """
+        results = self.search_ids(text, n)
+        return list(zip([score for score, _ in results], self.docs_info.texts([index for _, index in results])))
+
+
+def main():
+    start = time()
+    hybrid = HybridSearcher(TfidfSearcher("tfidf_index"), FastTextSearcher(fasttext_index_matrix="fasttext_index"))
+    print(f"loading took {time()-start} sec")
+    start = time()
+    print(hybrid.search("зеленский украина"))
+    print(f"searching took {time()-start} sec")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
-import pickle 
+import threading
 import numpy as np
+from scipy import sparse
 from sklearn.preprocessing import normalize
 from sklearn.feature_extraction.text import TfidfTransformer
 from preprocessing import (get_tokens, lemmatize, compute_cos_similarity,
-            range_texts, doc_info, remove_punctuation, text_lowercase)
+            doc_info, remove_punctuation, text_lowercase, query_lemmas)
+from ranking import top_k
+from metrics import stage
+from index_store import save_index, load_index, IndexFormatError
+from segments import SegmentedIndex
 from time import time 
 
 
@@ -11,58 +16,241 @@ class TfidfSearcher():
     """
     Class for searching through a TF-IDF index.
 
+    The index is a SegmentedIndex: the persisted matrix is the base segment,
+    and documents added later are weighted with the idf of the base and put
+    into an in-memory delta segment until a background merge.
+
     Attributes:
         docs_info: Object containing information about the documents.
-        tfidf_matrix: The TF-IDF matrix.
+        matrix_file_name: Index directory the index is loaded from and saved to.
+        idf: Inverse document frequencies the index was built with.
+        segments: SegmentedIndex with L2-normalized TF-IDF rows in CSR format.
+        num_indexed: Number of documents of `docs_info` already indexed.
+        synced_version: Version of `docs_info` the index was last synced with.
     """
 
-    def __init__(self, matrix_file_name='', docs_info=doc_info):
+    def __init__(self, matrix_file_name='', docs_info=doc_info, merge_threshold=1000):
         """
         Initializes the TfidfSearcher object.
 
         Args:
-            matrix_file_name: Name of the file to load the TF-IDF matrix from.
+            matrix_file_name: Index directory to load the TF-IDF matrix from.
             docs_info: Object containing information about the documents.
+            merge_threshold: Number of added documents that triggers a merge
+                of the delta segment into the base segment.
         """
         self.docs_info = docs_info
+        self.matrix_file_name = matrix_file_name or 'tfidf_index'
         if matrix_file_name:
-            self.tfidf_matrix = self.load_matrix(matrix_file_name)
+            tfidf_matrix, doc_ids, self.idf = self.load_matrix(matrix_file_name)
         else:
-            self.tfidf_matrix = self.index_tfidf()
+            tfidf_matrix, doc_ids, self.idf = self.index_tfidf()
+        # The base segment covers all CSV documents, even if the last ones are collapsed duplicates
+        self.num_indexed = max(int(doc_ids[-1]) + 1 if doc_ids.shape[0] else 0, self.docs_info.meta['num_rows'])
+        self.segments = SegmentedIndex(tfidf_matrix, doc_ids, lambda blocks: sparse.vstack(blocks, format='csr'),
+                                       merge_threshold, on_merge=self.save)
+        self.synced_version = None
+        self._sync_lock = threading.Lock()
+        self.sync()
+
+    @property
+    def tfidf_matrix(self):
+        """The base segment of the index."""
+        return self.segments.base
+
+    @property
+    def version(self):
+        """Counter that changes whenever documents are added, deleted or merged."""
+        return self.segments.version
 
     def load_matrix(self, matrix_file_name):
         """
-        Loads the TF-IDF matrix from a file.
+        Opens the TF-IDF matrix from an index directory.
+
+        The CSR component arrays are memory-mapped, so the matrix is shared
+        through the page cache by all processes that open it. The index is
+        rebuilt if it is missing or was built with another vocabulary or
+        other duplicate clusters.
 
         Args:
-            matrix_file_name: Name of the file to load the matrix from.
+            matrix_file_name: Index directory to load the matrix from.
 
         Returns:
-            The loaded TF-IDF matrix.
+            Tuple of the TF-IDF matrix in CSR format, the document ids of its
+            rows and the idf vector.
         """
         try:
-            with open(matrix_file_name, 'rb') as f:
-                matrix = pickle.load(f)
-            return matrix
-        except FileNotFoundError as ex:
-            return self.index()
+            arrays, manifest = load_index(matrix_file_name, 'tfidf',
+                                          vocabulary=self.docs_info.vectorizer.vocabulary_)
+            if manifest['meta'].get('dedup') != self.docs_info.dedup_version:
+                raise IndexFormatError(f"{matrix_file_name} was built with other duplicate clusters")
+            matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                       shape=tuple(manifest['meta']['shape']), copy=False)
+            return matrix, arrays['doc_ids'], arrays['idf']
+        except (FileNotFoundError, KeyError, IndexFormatError) as ex:
+            return self.index_tfidf(matrix_file_name)
 
-    def index_tfidf(self, matrix_file_name='tfidf_index_matrix.pickle'):
+    def index_tfidf(self, matrix_file_name='tfidf_index'):
         """
         Creates and saves the TF-IDF index.
 
+        The matrix never leaves the sparse representation: it is built,
+        normalized and saved as CSR component arrays. Near-duplicate
+        documents are left out; only canonical ones get a row.
+
         Args:
-            matrix_file_name: Name of the file to save the index.
+            matrix_file_name: Index directory to save the index to.
 
         Returns:
-            The TF-IDF matrix.
+            Tuple of the TF-IDF matrix in CSR format, the document ids of its
+            rows and the idf vector.
         """
         tfidf_trans = TfidfTransformer()
-        tfidf_matrix = normalize(tfidf_trans.fit_transform(self.docs_info.vectors).toarray())
-        with open(matrix_file_name, 'wb') as f:
-            pickle.dump(tfidf_matrix, f)
-        return tfidf_matrix
-    
+        doc_ids = self.docs_info.canonical_ids
+        tfidf_matrix = normalize(tfidf_trans.fit_transform(self.docs_info.vectors[doc_ids])).tocsr()
+        self.idf = tfidf_trans.idf_
+        self.save(tfidf_matrix, doc_ids, matrix_file_name)
+        return tfidf_matrix, doc_ids, self.idf
+
+    def save(self, tfidf_matrix, doc_ids, matrix_file_name=None):
+        """
+        Saves a TF-IDF matrix as the base segment of the index.
+
+        Args:
+            tfidf_matrix: L2-normalized TF-IDF matrix in CSR format.
+            doc_ids: Document id of every row.
+            matrix_file_name: Index directory; defaults to `self.matrix_file_name`.
+        """
+        save_index(matrix_file_name or self.matrix_file_name, 'tfidf',
+                   {'data': tfidf_matrix.data, 'indices': tfidf_matrix.indices, 'indptr': tfidf_matrix.indptr,
+                    'doc_ids': doc_ids, 'idf': self.idf},
+                   meta={'shape': list(tfidf_matrix.shape), 'dedup': self.docs_info.dedup_version},
+                   vocabulary=self.docs_info.vectorizer.vocabulary_)
+
+    def transform(self, lemmatized_texts):
+        """
+        Turns lemmatized texts into normalized TF-IDF rows with the idf of the index.
+
+        Lemmas missing from the vocabulary are ignored until the index is rebuilt.
+
+        Args:
+            lemmatized_texts: List of lemmatized texts.
+
+        Returns:
+            CSR matrix with one row per text.
+        """
+        counts = self.docs_info.vectorizer.transform(lemmatized_texts)
+        return normalize(sparse.csr_matrix(counts.multiply(self.idf))).tocsr()
+
+    def sync(self):
+        """
+        Brings the index up to date with `docs_info`.
+
+        Documents added to `docs_info` since the index was built go to the
+        delta segment, and deleted documents are hidden.
+        """
+        with self._sync_lock:
+            self.synced_version = self.docs_info.version
+            num_rows = self.docs_info.num_rows
+            if num_rows > self.num_indexed:
+                lemmatized_texts = self.docs_info.lemmatized_texts[self.num_indexed:num_rows]
+                self.segments.add(self.transform(lemmatized_texts), np.arange(self.num_indexed, num_rows))
+                self.num_indexed = num_rows
+            hidden = self.docs_info.hidden_ids
+            if hidden:
+                self.segments.delete(hidden)
+
+    def maybe_sync(self):
+        """Calls `sync` if documents were added or deleted, by this process or another one."""
+        if self.docs_info.refresh() != self.synced_version:
+            self.sync()
+
+    def add_documents(self, texts):
+        """
+        Adds new documents; they are searchable as soon as this returns.
+
+        Args:
+            texts: List of original texts.
+
+        Returns:
+            List of ids of the new documents.
+        """
+        doc_ids = self.docs_info.add_documents(texts)
+        self.sync()
+        return doc_ids
+
+    def delete_documents(self, doc_ids):
+        """
+        Deletes documents from the search results.
+
+        Args:
+            doc_ids: Ids of the documents to delete.
+        """
+        self.docs_info.delete_documents(doc_ids)
+        self.sync()
+
+
+    def query_matrix(self, texts):
+        """
+        Vectorizes and L2-normalizes a batch of queries.
+
+        Args:
+            texts: List of search queries.
+
+        Returns:
+            CSR matrix with one TF-IDF row per query.
+        """
+        lines = [' '.join(query_lemmas(text)) for text in texts]
+        with stage('vectorize', 'tf-idf'):
+            return normalize(self.docs_info.vectorizer.transform(lines))
+
+    def search_ids_many(self, texts, n=10, batch_size=64, filters=None):
+        """
+        Searches for similar documents for a batch of queries at once.
+
+        Every batch of queries is scored against the index with a single
+        sparse matrix product. With filters, only the rows of the matching
+        documents are gathered and multiplied.
+
+        Args:
+            texts: List of search queries.
+            n: Number of results to return for every query.
+            batch_size: Number of queries scored together; bounds the size
+                of the dense score matrix.
+            filters: Dictionary of date and rubric filters (see `Docs.select`)
+                applied to all queries.
+
+        Returns:
+            List with one list of tuples (cosine similarity, document id) per query.
+        """
+        self.maybe_sync()
+        selected = self.docs_info.select(filters)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            queries = self.query_matrix(texts[start:start + batch_size]).T.tocsr()
+            with stage('score', 'tf-idf'):
+                cos_sim_matrix, doc_ids = self.segments.score(lambda matrix: (matrix @ queries).T.toarray(),
+                                                              ids=selected)
+            with stage('rank', 'tf-idf'):
+                for cos_sim_array in cos_sim_matrix:
+                    indices, scores = top_k(cos_sim_array, n)
+                    results.append([(metric, int(index)) for index, metric in zip(doc_ids[indices], scores)
+                                    if np.isfinite(metric)])
+        return results
+
+    def search_ids(self, text, n=10, filters=None):
+        """
+        Searches for similar documents and returns their ids.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+            filters: Dictionary of date and rubric filters (see `Docs.select`).
+
+        Returns:
+            List of tuples containing the cosine similarity and the document id.
+        """
+        return self.search_ids_many([text], n, filters=filters)[0]
 
     def search(self, text, n=10):
         """
@@ -75,21 +263,14 @@ class TfidfSearcher():
         Returns:
             List of tuples containing the index of the document and the text of the document.
         """
-        if n >= self.docs_info.num_rows:
-            n = self.docs_info.num_rows - 1
-
-
-        line = ' '.join(lemmatize(get_tokens(remove_punctuation(text_lowercase(text)))))
-        vec = self.docs_info.vectorizer.transform([line]).toarray()
-        norm_vec = normalize(vec).reshape(-1, 1)
-        cos_sim_array = np.dot(self.tfidf_matrix, norm_vec)
-        return  [(metric[0], self.docs_info.docs[index]) for index, metric in range_texts(cos_sim_array)[:n]]
+        results = self.search_ids(text, n)
+        return list(zip([metric for metric, _ in results], self.docs_info.texts([index for _, index in results])))
 
 
 
 def main():
     start = time()
-    tfidf = TfidfSearcher("tfidf_index_matrix.pickle")
+    tfidf = TfidfSearcher("tfidf_index")
     print(f"loading took {time()-start} sec")
     start = time()
     print(tfidf.search("зеленский украина"))
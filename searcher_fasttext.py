@@ -1,8 +1,14 @@
+import threading
 import numpy as np 
-import pickle
 from preprocessing import (get_tokens, lemmatize, compute_cos_similarity,
-            range_texts, doc_info, remove_punctuation, text_lowercase)
-from gensim.models import FastText
+            doc_info, remove_punctuation, text_lowercase, query_lemmas)
+from ranking import top_k
+from metrics import stage
+from ann import IVFIndex
+from quantization import Int8Matrix
+from index_store import save_index, load_index, IndexFormatError
+from segments import SegmentedIndex
+from fasttext_compact import load_model
 from time import time
 from collections.abc import Mapping
 
@@ -13,42 +19,167 @@ class FastTextSearcher():
     Attributes:
         model: The FastText model.
         doc_info: Object containing information about the documents.
-        matrix: The FastText index matrix.
+        matrix: L2-normalized float32 document vectors, C-contiguous, one row
+            per document that has a vector.
+        doc_ids: Document index of every row of `matrix`.
+        segments: SegmentedIndex holding `matrix` as its base segment and
+            the vectors of documents added later in its delta segment.
+        num_indexed: Number of documents of `doc_info` already indexed.
+        ann: Optional IVFIndex used instead of exact search.
+        ann_ids: Document ids of the rows the IVF index was built on.
+        compact: Optional SegmentedIndex of int8-quantized rows (Int8Matrix)
+            used instead of `segments` for exact search.
+        rerank: Number of int8 candidates rescored with the float32 rows;
+            0 returns the int8 scores, capped at 1.0 because quantization
+            errors can push a dequantized cosine slightly above it.
+        synced_version: Version of `doc_info` the index was last synced with.
     """
 
-    def __init__(self, model_file_name="cc.ru.300.bin", fasttext_index_matrix='', doc_info=doc_info):
+    def __init__(self, model_file_name="cc.ru.300.bin", fasttext_index_matrix='', doc_info=doc_info,
+                 ann_index_file='', nprobe=8, merge_threshold=1000, quantized_index_file='', rerank=100):
         """
         Initializes the FastTextSearcher object.
 
         Args:
-            model_file_name: Path to the FastText model file.
-            fasttext_index_matrix: Path to the FastText index matrix file.
+            model_file_name: Path to the FastText model file or to a compact
+                export directory written by `fasttext_compact.py`.
+            fasttext_index_matrix: Index directory of the FastText matrix.
             doc_info: Object containing information about the documents.
+            ann_index_file: Index directory of the IVF index; enables approximate
+                search. The index is built and saved if it does not exist.
+            nprobe: Number of IVF clusters scanned per query.
+            merge_threshold: Number of added documents that triggers a merge
+                of the delta segment into the base segment.
+            quantized_index_file: Index directory of the int8 codes; enables
+                scoring on the quantized matrix, so only the codes stay in
+                memory and the float32 matrix is read for reranking only.
+                The codes are built and saved if they do not exist.
+            rerank: Number of int8 candidates rescored with the float32 rows.
         """
-        self.model = FastText.load_fasttext_format(model_file_name)
+        self.model = load_model(model_file_name)
         self.doc_info = doc_info
+        self.fasttext_index_matrix = fasttext_index_matrix or "fasttext_index"
         if fasttext_index_matrix:
-            self.matrix = self.load(fasttext_index_matrix)
+            matrix, doc_ids, self.num_indexed = self.load(fasttext_index_matrix)
         else:
-            self.matrix = self.index()
+            matrix, doc_ids, self.num_indexed = self.index()
+        self.segments = SegmentedIndex(matrix, doc_ids, np.vstack, merge_threshold, on_merge=self.on_merge)
+        self.ann_index_file = ann_index_file
+        self.ann = None
+        if ann_index_file:
+            self.ann = self.load_ann(ann_index_file, nprobe)
+            self.ann_ids = self.doc_ids
+        self.quantized_index_file = quantized_index_file
+        self.rerank = rerank
+        self.compact = None
+        if quantized_index_file:
+            self.compact = SegmentedIndex(self.load_quantized(quantized_index_file), self.doc_ids,
+                                          Int8Matrix.vstack, merge_threshold, on_merge=self.on_quantized_merge)
+        self.synced_version = None
+        self._sync_lock = threading.Lock()
+        self.sync()
 
+    @property
+    def matrix(self):
+        """The base segment of the index."""
+        return self.segments.base
+
+    @property
+    def doc_ids(self):
+        """Document ids of the rows of the base segment."""
+        return self.segments.base_ids
+
+    @property
+    def version(self):
+        """Counter that changes whenever documents are added, deleted or merged."""
+        return self.segments.version
+
+
+    def load_ann(self, ann_index_file, nprobe=8):
+        """
+        Loads the IVF index over the document matrix, building it if needed.
+
+        Args:
+            ann_index_file: Index directory of the IVF index.
+            nprobe: Number of IVF clusters scanned per query.
+
+        Returns:
+            The IVFIndex.
+        """
+        try:
+            ann = IVFIndex.load(ann_index_file, self.matrix, self.doc_ids)
+            ann.nprobe = nprobe
+        except (FileNotFoundError, IndexFormatError) as ex:
+            ann = IVFIndex.build(self.matrix, nprobe=nprobe)
+            ann.save(ann_index_file, self.doc_ids)
+        return ann
+
+
+    def load_quantized(self, quantized_index_file):
+        """
+        Loads the int8 codes of the document matrix, building them if needed.
+
+        Args:
+            quantized_index_file: Index directory of the int8 codes.
+
+        Returns:
+            The Int8Matrix.
+        """
+        try:
+            compact = Int8Matrix.load(quantized_index_file, self.doc_ids)
+        except (FileNotFoundError, IndexFormatError) as ex:
+            compact = Int8Matrix.quantize(self.matrix)
+            compact.save(quantized_index_file, self.doc_ids)
+        return compact
 
     def load(self, fasttext_index_matrix):
         """
-        Loads the FastText index matrix from a file.
+        Opens the FastText index matrix from an index directory.
+
+        The matrix is memory-mapped read-only and shared through the page
+        cache by all processes that open it. The index is rebuilt if it is
+        missing or has an incompatible format.
 
         Args:
-            fasttext_index_matrix: Path to the FastText index matrix file.
+            fasttext_index_matrix: Index directory of the FastText matrix.
 
         Returns:
-            The loaded FastText index matrix.
+            Tuple of the normalized document matrix, the document indices of
+            its rows and the number of documents the index covers.
         """
         try:
-            with open(fasttext_index_matrix, 'rb') as f:
-                matrix = pickle.load(f)
-            return matrix
-        except FileNotFoundError as ex:
-            return self.index()
+            arrays, manifest = load_index(fasttext_index_matrix, 'fasttext')
+            if manifest['meta'].get('source_sha256') != self.doc_info.meta['source_sha256']:
+                raise IndexFormatError(f"{fasttext_index_matrix} was built from another corpus")
+            if manifest['meta'].get('dedup') != self.doc_info.dedup_version:
+                raise IndexFormatError(f"{fasttext_index_matrix} was built with other duplicate clusters")
+        except (FileNotFoundError, IndexFormatError) as ex:
+            return self.index(fasttext_index_matrix)
+        return arrays['matrix'], arrays['doc_ids'], manifest['meta']['num_docs']
+
+    @staticmethod
+    def prepare_matrix(vectors):
+        """
+        Turns raw document vectors into a matrix ready for scoring.
+
+        Documents without a vector (no lemmas or a zero vector) are dropped
+        once here instead of being checked on every query, and the remaining
+        rows are L2-normalized so that cosine similarity is a plain dot product.
+
+        Args:
+            vectors: Sequence of document vectors; None marks a document without one.
+
+        Returns:
+            Tuple of the normalized float32 matrix and the document indices of its rows.
+        """
+        doc_ids = np.array([idx for idx, vector in enumerate(vectors) if vector is not None], dtype=np.int64)
+        if doc_ids.shape[0] == 0:
+            return np.zeros((0, 0), dtype=np.float32), doc_ids
+        matrix = np.array([vectors[idx] for idx in doc_ids], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        valid = norms > 0
+        matrix = np.ascontiguousarray(matrix[valid] / norms[valid, None], dtype=np.float32)
+        return matrix, doc_ids[valid]
 
     def fasttext_transform(self, lemmas):
         """
@@ -72,23 +203,144 @@ class FastTextSearcher():
             doc_vector = np.mean(zeros_matrix, axis=0)
             return doc_vector
 
-    def index(self, path="fasttext_index_matrix.pickle"):
+    def index(self, path="fasttext_index"):
         """
-        Creates and saves the FastText index matrix.
+        Creates and saves the FastText index matrix; near-duplicate documents
+        are left out.
 
         Args:
-            path: Path to the file to save the index matrix.
+            path: Index directory to save the index matrix to.
 
         Returns:
-            The FastText index matrix.
+            Tuple of the normalized document matrix, the document indices of
+            its rows and the number of documents the index covers.
         """
+        indexed = np.zeros(self.doc_info.num_rows, dtype=bool)
+        indexed[self.doc_info.canonical_ids] = True
         fasttext_matrix = []
-        for text in self.doc_info.lemmatized_texts:
-            fasttext_matrix.append(self.fasttext_transform(text.split()))
-        final_matrix = np.array(fasttext_matrix)
-        with open(path, 'wb') as f:
-            pickle.dump(final_matrix, f)
-        return final_matrix
+        for text, is_indexed in zip(self.doc_info.lemmatized_texts, indexed):
+            fasttext_matrix.append(self.fasttext_transform(text.split()) if is_indexed else None)
+        matrix, doc_ids = self.prepare_matrix(fasttext_matrix)
+        self.save(matrix, doc_ids, len(fasttext_matrix), path)
+        return matrix, doc_ids, len(fasttext_matrix)
+
+    def save(self, matrix, doc_ids, num_docs, path=None):
+        """
+        Saves a normalized document matrix as the base segment of the index.
+
+        Args:
+            matrix: L2-normalized float32 document matrix.
+            doc_ids: Document id of every row.
+            num_docs: Number of documents of `doc_info` the matrix covers.
+            path: Index directory; defaults to `self.fasttext_index_matrix`.
+        """
+        save_index(path or self.fasttext_index_matrix, 'fasttext', {'matrix': matrix, 'doc_ids': doc_ids},
+                   meta={'vector_size': self.model.vector_size, 'num_docs': num_docs,
+                         'source_sha256': self.doc_info.meta['source_sha256'],
+                         'dedup': self.doc_info.dedup_version})
+
+    def on_merge(self, matrix, doc_ids):
+        """
+        Persists the merged base segment and rebuilds the IVF index over it.
+
+        Args:
+            matrix: The new base segment.
+            doc_ids: Document ids of its rows.
+        """
+        delta_ids = self.segments.delta_ids
+        num_docs = int(delta_ids[0]) if delta_ids.shape[0] else self.num_indexed
+        self.save(matrix, doc_ids, num_docs)
+        if self.ann is not None:
+            ann = IVFIndex.build(matrix, nprobe=self.ann.nprobe)
+            ann.save(self.ann_index_file, doc_ids)
+            self.ann, self.ann_ids = ann, doc_ids
+
+    def on_quantized_merge(self, compact, doc_ids):
+        """
+        Persists the merged base segment of the int8 codes.
+
+        Args:
+            compact: The new base segment.
+            doc_ids: Document ids of its rows.
+        """
+        compact.save(self.quantized_index_file, doc_ids)
+
+    def sync(self):
+        """
+        Brings the index up to date with `doc_info`.
+
+        Documents added to `doc_info` since the index was built go to the
+        delta segment, and deleted documents are hidden.
+        """
+        with self._sync_lock:
+            self.synced_version = self.doc_info.version
+            num_rows = self.doc_info.num_rows
+            if num_rows > self.num_indexed:
+                lemmatized_texts = self.doc_info.lemmatized_texts[self.num_indexed:num_rows]
+                matrix, rows = self.prepare_matrix([self.fasttext_transform(text.split())
+                                                    for text in lemmatized_texts])
+                if rows.shape[0]:
+                    self.segments.add(matrix, rows + self.num_indexed)
+                    if self.compact is not None:
+                        self.compact.add(Int8Matrix.quantize(matrix), rows + self.num_indexed)
+                self.num_indexed = num_rows
+            hidden = self.doc_info.hidden_ids
+            if hidden:
+                self.segments.delete(hidden)
+                if self.compact is not None:
+                    self.compact.delete(hidden)
+
+    def maybe_sync(self):
+        """Calls `sync` if documents were added or deleted, by this process or another one."""
+        if self.doc_info.refresh() != self.synced_version:
+            self.sync()
+
+    def add_documents(self, texts):
+        """
+        Adds new documents; they are searchable as soon as this returns.
+
+        Args:
+            texts: List of original texts.
+
+        Returns:
+            List of ids of the new documents.
+        """
+        doc_ids = self.doc_info.add_documents(texts)
+        self.sync()
+        return doc_ids
+
+    def delete_documents(self, doc_ids):
+        """
+        Deletes documents from the search results.
+
+        Args:
+            doc_ids: Ids of the documents to delete.
+        """
+        self.doc_info.delete_documents(doc_ids)
+        self.sync()
+
+    def query_matrix(self, texts):
+        """
+        Embeds and L2-normalizes a batch of queries.
+
+        Args:
+            texts: List of search queries.
+
+        Returns:
+            Tuple of a float32 matrix with one row per query and a boolean
+            mask of the queries that got a non-zero vector.
+        """
+        queries = np.zeros((len(texts), self.model.vector_size), dtype=np.float32)
+        for idx, text in enumerate(texts):
+            lemmas = query_lemmas(text)
+            with stage('embed', 'fasttext'):
+                vector = self.fasttext_transform(lemmas)
+            if vector is not None:
+                queries[idx] = vector
+        norms = np.linalg.norm(queries, axis=1)
+        valid = norms > 0
+        queries[valid] /= norms[valid, None]
+        return queries, valid
 
     def search(self, text, n=10):
         """
@@ -101,13 +353,130 @@ class FastTextSearcher():
         Returns:
             List of tuples containing the cosine similarity and the text of the document.
         """
-        if n >= self.doc_info.num_rows:
-            n = self.doc_info.num_rows - 1
+        return self.search_many([text], n)[0]
+
+    def search_many(self, texts, n=10):
+        """
+        Searches for similar documents for a batch of queries at once.
+
+        Args:
+            texts: List of search queries.
+            n: Number of results to return for every query.
+
+        Returns:
+            List with one result list per query, in the format of `search`.
+        """
+        return [list(zip([metric for metric, _ in results], self.doc_info.texts([index for _, index in results])))
+                for results in self.search_ids_many(texts, n)]
+
+    def search_ids_many(self, texts, n=10, batch_size=64, filters=None):
+        """
+        Searches for similar documents for a batch of queries and returns their ids.
+
+        Every batch of queries is scored against the index with a single
+        matrix-matrix product, on the int8 codes when quantization is enabled,
+        or through the IVF index when it is enabled. With filters, only the
+        rows of the matching documents are gathered and scored, and the IVF
+        index is not used.
+
+        Args:
+            texts: List of search queries.
+            n: Number of results to return for every query.
+            batch_size: Number of queries scored together; bounds the size
+                of the dense score matrix.
+            filters: Dictionary of date and rubric filters (see `Docs.select`)
+                applied to all queries.
+
+        Returns:
+            List with one list of tuples (cosine similarity, document id) per query.
+        """
+        self.maybe_sync()
+        selected = self.doc_info.select(filters)
+        queries, valid = self.query_matrix(texts)
+        if self.ann is not None and selected is None:
+            with stage('ann', 'fasttext'):
+                return [self.search_ann(query, n) if is_valid else [] for query, is_valid in zip(queries, valid)]
+        results = []
+        for start in range(0, len(texts), batch_size):
+            batch = queries[start:start + batch_size]
+            with stage('score', 'fasttext'):
+                if self.compact is not None:
+                    cos_sim_matrix, doc_ids = self.compact.score(lambda matrix: matrix.dot(batch), ids=selected)
+                    if not self.rerank:
+                        np.minimum(cos_sim_matrix, 1.0, out=cos_sim_matrix)
+                else:
+                    cos_sim_matrix, doc_ids = self.segments.score(lambda matrix: batch @ matrix.T, ids=selected)
+            with stage('rank', 'fasttext'):
+                for row, cos_sim_array in enumerate(cos_sim_matrix, start):
+                    if not valid[row]:
+                        results.append([])
+                        continue
+                    if self.compact is not None and self.rerank:
+                        results.append(self.rerank_exact(queries[row], cos_sim_array, doc_ids, n))
+                        continue
+                    indices, scores = top_k(cos_sim_array, n)
+                    results.append([(metric, int(index)) for index, metric in zip(doc_ids[indices], scores)
+                                    if np.isfinite(metric)])
+        return results
+
+    def rerank_exact(self, query, cos_sim_array, doc_ids, n):
+        """
+        Rescores the best int8 candidates of one query with the float32 rows.
+
+        Args:
+            query: L2-normalized query vector.
+            cos_sim_array: Approximate scores of all documents.
+            doc_ids: Document id of every score.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples containing the cosine similarity and the document id.
+        """
+        indices, scores = top_k(cos_sim_array, max(n, self.rerank))
+        candidate_ids = doc_ids[indices[np.isfinite(scores)]]
+        rows, positions = self.segments.take(candidate_ids)
+        indices, scores = top_k(np.asarray(rows @ query, dtype=np.float64), n)
+        return [(metric, int(index)) for index, metric in zip(candidate_ids[positions][indices], scores)]
 
-        line = lemmatize(get_tokens(remove_punctuation(text_lowercase(text))))
-        vector = self.fasttext_transform(line)
-        cos_sim_array = [compute_cos_similarity(vector, document) for document in self.matrix]
-        return [(metric, self.doc_info.docs[index]) for index, metric in range_texts(cos_sim_array)[:n]]
+    def search_ids(self, text, n=10, filters=None):
+        """
+        Searches for similar documents and returns their ids.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+            filters: Dictionary of date and rubric filters (see `Docs.select`).
+
+        Returns:
+            List of tuples containing the cosine similarity and the document id.
+        """
+        return self.search_ids_many([text], n, filters=filters)[0]
+
+    def search_ann(self, query, n):
+        """
+        Searches one normalized query vector through the IVF index.
+
+        Documents added after the IVF index was built are scored exactly,
+        and deleted documents are dropped from the IVF candidates.
+
+        Args:
+            query: L2-normalized query vector.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples containing the cosine similarity and the document id.
+        """
+        ann, ann_ids = self.ann, self.ann_ids
+        rows, ann_scores = ann.search(query, 2 * n)
+        candidate_ids = ann_ids[rows]
+        live = self.segments.is_live(candidate_ids)
+        min_id = int(ann_ids[-1]) + 1 if ann_ids.shape[0] else 0
+        tail_scores, tail_ids = self.segments.score(lambda matrix: matrix @ query, min_id=min_id)
+        cos_sim_array = np.concatenate((ann_scores[live], tail_scores))
+        doc_ids = np.concatenate((candidate_ids[live], tail_ids))
+        indices, scores = top_k(cos_sim_array, n)
+        return [(metric, int(index)) for index, metric in zip(doc_ids[indices], scores)
+                if np.isfinite(metric)]
 
 
 def main():
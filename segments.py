@@ -0,0 +1,238 @@
+import threading
+import numpy as np
+
+
+class SegmentedIndex():
+    """
+    Document matrix split into a large base segment and a small delta segment.
+
+    New documents are appended to the in-memory delta segment and are
+    searchable immediately; deleted documents are hidden by tombstones.
+    When the delta grows past `merge_threshold` rows, a background thread
+    merges it into the base segment and drops the deleted rows. Readers
+    always work on a consistent snapshot, so searching continues during
+    a merge.
+
+    Attributes:
+        base: Matrix of the base segment (CSR or dense, one row per document).
+        base_ids: Document id of every base row, ascending.
+        delta: Matrix of the delta segment or None when it is empty.
+        delta_ids: Document id of every delta row, ascending.
+        version: Counter incremented on every change; identifies the index state.
+        merge_threshold: Number of delta rows that triggers a background merge.
+    """
+
+    def __init__(self, base, base_ids, stack, merge_threshold=1000, on_merge=None):
+        """
+        Initializes the SegmentedIndex object.
+
+        Args:
+            base: Matrix of the base segment.
+            base_ids: Document id of every base row.
+            stack: Function stacking a list of matrices vertically
+                (`np.vstack` or `scipy.sparse.vstack`).
+            merge_threshold: Number of delta rows that triggers a background merge.
+            on_merge: Optional callback(base, base_ids) called after a merge,
+                e.g. to persist the new base segment.
+        """
+        self.base = base
+        self.base_ids = np.asarray(base_ids, dtype=np.int64)
+        self.base_live = None
+        self.delta = None
+        self.delta_ids = np.zeros(0, dtype=np.int64)
+        self.delta_live = None
+        self.stack = stack
+        self.merge_threshold = merge_threshold
+        self.on_merge = on_merge
+        self.version = 0
+        self._lock = threading.Lock()
+        self._merge_thread = None
+
+    def __len__(self):
+        return self.base_ids.shape[0] + self.delta_ids.shape[0]
+
+    def add(self, rows, ids):
+        """
+        Appends documents to the delta segment.
+
+        Args:
+            rows: Matrix with one row per new document.
+            ids: Ascending document ids, larger than all indexed ids.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.shape[0] == 0:
+            return
+        with self._lock:
+            self.delta = rows if self.delta is None else self.stack([self.delta, rows])
+            self.delta_ids = np.concatenate((self.delta_ids, ids))
+            if self.delta_live is not None:
+                self.delta_live = np.concatenate((self.delta_live, np.ones(ids.shape[0], dtype=bool)))
+            self.version += 1
+        self.maybe_merge()
+
+    def delete(self, ids):
+        """
+        Hides documents from search results.
+
+        Args:
+            ids: Document ids to delete; unknown ids are ignored.
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        with self._lock:
+            base_live = self._mark_deleted(self.base_ids, self.base_live, ids)
+            delta_live = self._mark_deleted(self.delta_ids, self.delta_live, ids)
+            if base_live is not self.base_live or delta_live is not self.delta_live:
+                self.base_live, self.delta_live = base_live, delta_live
+                self.version += 1
+
+    @staticmethod
+    def _mark_deleted(segment_ids, live, ids):
+        """Returns a copy of the live mask with `ids` cleared, or `live` if nothing changed."""
+        rows = np.searchsorted(segment_ids, ids)
+        found = rows < segment_ids.shape[0]
+        rows = rows[found][segment_ids[rows[found]] == ids[found]]
+        if rows.shape[0] == 0 or (live is not None and not live[rows].any()):
+            return live
+        live = np.ones(segment_ids.shape[0], dtype=bool) if live is None else live.copy()
+        live[rows] = False
+        return live
+
+    def snapshot(self):
+        """Returns the current segments as a tuple that stays consistent while in use."""
+        with self._lock:
+            return (self.base, self.base_ids, self.base_live,
+                    self.delta, self.delta_ids, self.delta_live)
+
+    def is_live(self, ids):
+        """
+        Checks which documents are indexed and not deleted.
+
+        Args:
+            ids: Array of document ids.
+
+        Returns:
+            Boolean array, True for live documents.
+        """
+        base, base_ids, base_live, delta, delta_ids, delta_live = self.snapshot()
+        ids = np.asarray(ids, dtype=np.int64)
+        result = np.zeros(ids.shape[0], dtype=bool)
+        for segment_ids, live in ((base_ids, base_live), (delta_ids, delta_live)):
+            if segment_ids.shape[0] == 0:
+                continue
+            rows = np.minimum(np.searchsorted(segment_ids, ids), segment_ids.shape[0] - 1)
+            found = segment_ids[rows] == ids
+            if live is not None:
+                found &= live[rows]
+            result |= found
+        return result
+
+    def take(self, ids):
+        """
+        Fetches the rows of live documents.
+
+        Args:
+            ids: Array of document ids.
+
+        Returns:
+            Tuple of the matrix of rows found and, for every row, its
+            position in `ids`. Unknown and deleted documents are skipped.
+        """
+        base, base_ids, base_live, delta, delta_ids, delta_live = self.snapshot()
+        ids = np.asarray(ids, dtype=np.int64)
+        parts, positions = [], []
+        for matrix, segment_ids, live in ((base, base_ids, base_live), (delta, delta_ids, delta_live)):
+            if segment_ids.shape[0] == 0:
+                continue
+            rows = np.minimum(np.searchsorted(segment_ids, ids), segment_ids.shape[0] - 1)
+            found = segment_ids[rows] == ids
+            if live is not None:
+                found &= live[rows]
+            parts.append(matrix[rows[found]])
+            positions.append(np.flatnonzero(found))
+        if not parts:
+            return base[:0], np.zeros(0, dtype=np.int64)
+        return (self.stack(parts) if len(parts) > 1 else parts[0]), np.concatenate(positions)
+
+    def score(self, score_fn, min_id=None, ids=None):
+        """
+        Scores all live documents of both segments.
+
+        Args:
+            score_fn: Function mapping a segment matrix to scores; the last
+                axis of its result must correspond to the matrix rows.
+            min_id: If given, only documents with id >= min_id are scored.
+            ids: If given, only these documents are scored: their live rows
+                are gathered with `take` first, so the cost grows with the
+                number of ids rather than the size of the index.
+
+        Returns:
+            Tuple of the scores (deleted documents get -inf) and the document
+            id of every score column.
+        """
+        if ids is not None:
+            ids = np.asarray(ids, dtype=np.int64)
+            rows, positions = self.take(ids)
+            return np.asarray(score_fn(rows), dtype=np.float64), ids[positions]
+        base, base_ids, base_live, delta, delta_ids, delta_live = self.snapshot()
+        if min_id is not None:
+            start = int(np.searchsorted(base_ids, min_id))
+            if start:
+                base, base_ids = base[start:], base_ids[start:]
+                base_live = None if base_live is None else base_live[start:]
+        scores = [np.asarray(score_fn(base), dtype=np.float64)]
+        if delta is not None:
+            scores.append(np.asarray(score_fn(delta), dtype=np.float64))
+        scores = np.concatenate(scores, axis=-1)
+        live = None
+        if base_live is not None or delta_live is not None:
+            live = np.concatenate((np.ones(base_ids.shape[0], dtype=bool) if base_live is None else base_live,
+                                   np.ones(delta_ids.shape[0], dtype=bool) if delta_live is None else delta_live))
+            scores[..., ~live] = -np.inf
+        return scores, np.concatenate((base_ids, delta_ids))
+
+    def maybe_merge(self):
+        """Starts a background merge if the delta segment is large enough."""
+        with self._lock:
+            if self.delta_ids.shape[0] < self.merge_threshold:
+                return
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self.merge, daemon=True)
+            self._merge_thread.start()
+
+    def merge(self):
+        """
+        Merges the delta segment into the base segment and drops deleted rows.
+
+        Documents added or deleted while the merge runs are carried over to
+        the new segments.
+        """
+        base, base_ids, base_live, delta, delta_ids, delta_live = self.snapshot()
+        num_merged = delta_ids.shape[0]
+        parts = [base] if delta is None else [base, delta]
+        merged = self.stack(parts) if len(parts) > 1 else base
+        merged_ids = np.concatenate((base_ids, delta_ids))
+        if base_live is not None or delta_live is not None:
+            keep = np.concatenate((np.ones(base_ids.shape[0], dtype=bool) if base_live is None else base_live,
+                                   np.ones(num_merged, dtype=bool) if delta_live is None else delta_live))
+            merged = merged[np.flatnonzero(keep)]
+            merged_ids = merged_ids[keep]
+
+        with self._lock:
+            new_base_live = None
+            if self.base_live is not base_live or self.delta_live is not delta_live:
+                deleted = np.concatenate((
+                    self.base_ids[~self.base_live] if self.base_live is not None else [],
+                    self.delta_ids[:num_merged][~self.delta_live[:num_merged]] if self.delta_live is not None else [],
+                )).astype(np.int64)
+                new_base_live = self._mark_deleted(merged_ids, None, deleted)
+            self.base, self.base_ids, self.base_live = merged, merged_ids, new_base_live
+            if self.delta_ids.shape[0] > num_merged:
+                self.delta = self.delta[num_merged:]
+                self.delta_ids = self.delta_ids[num_merged:]
+                self.delta_live = None if self.delta_live is None else self.delta_live[num_merged:]
+            else:
+                self.delta, self.delta_ids, self.delta_live = None, np.zeros(0, dtype=np.int64), None
+            self.version += 1
+        if self.on_merge is not None:
+            self.on_merge(merged, merged_ids)
@@ -0,0 +1,450 @@
+import heapq
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+import multiprocessing as mp
+import numpy as np
+from multiprocessing import shared_memory
+from scipy import sparse
+from ranking import top_k
+
+
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+@contextmanager
+def blas_threads(num_threads):
+    """Sets the BLAS thread count of the processes started inside the block."""
+    previous = {name: os.environ.get(name) for name in BLAS_THREAD_VARIABLES}
+    os.environ.update({name: str(num_threads) for name in BLAS_THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def share_array(array):
+    """
+    Copies an array into a new shared memory block.
+
+    Args:
+        array: NumPy array.
+
+    Returns:
+        Tuple of the SharedMemory object and a picklable spec (name, shape, dtype)
+        to attach to it from another process.
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    """
+    Attaches to an array shared with `share_array` without copying it.
+
+    Args:
+        spec: Tuple (name, shape, dtype) returned by `share_array`.
+
+    Returns:
+        Tuple of the SharedMemory object (keep it alive while the array is
+        used) and the array.
+    """
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def score_rows(queries, rows):
+    """
+    Scores index rows against a query matrix.
+
+    Args:
+        queries: Query matrix (one row per query) of the same kind as the rows.
+        rows: Dense matrix or CSR matrix with one row per document.
+
+    Returns:
+        Dense array of scores with one row per query and one column per document.
+    """
+    if sparse.issparse(rows):
+        return (rows @ queries.T).T.toarray()
+    return queries @ rows.T
+
+
+def find_rows(doc_ids, ids):
+    """Returns the positions of `ids` found in the sorted `doc_ids`; missing ids are skipped."""
+    if doc_ids.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(doc_ids, ids), doc_ids.shape[0] - 1)
+    return positions[doc_ids[positions] == ids]
+
+
+def serve_shard(connection, specs, start, end):
+    """
+    Worker process: scores query batches against rows [start, end) of the shared index.
+
+    Requests are (queries, n, ids, deleted) tuples and replies are lists
+    with one (scores, document ids) pair of arrays per query, best first.
+    `ids` is None or the sorted document ids allowed by a filter; only
+    their rows are scored. `deleted` is None or the sorted ids of deleted
+    documents, which get -inf. None stops the worker.
+
+    Args:
+        connection: Pipe end connected to the coordinator.
+        specs: Dictionary of array name -> spec of the shared arrays:
+            'doc_ids' and either 'matrix' (dense) or 'data', 'indices',
+            'indptr' and 'shape' (CSR).
+        start: First row of the shard.
+        end: Row after the last row of the shard.
+    """
+    blocks, arrays = [], {}
+    for name, spec in specs.items():
+        block, arrays[name] = attach_array(spec)
+        blocks.append(block)
+    doc_ids = arrays['doc_ids'][start:end]
+    if 'matrix' in arrays:
+        matrix = arrays['matrix'][start:end]
+    else:
+        indptr = arrays['indptr'][start:end + 1]
+        matrix = sparse.csr_matrix((arrays['data'][indptr[0]:indptr[-1]], arrays['indices'][indptr[0]:indptr[-1]],
+                                    indptr - indptr[0]), shape=(end - start, int(arrays['shape'][1])))
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        queries, n, ids, deleted = request
+        rows, row_ids = matrix, doc_ids
+        if ids is not None:
+            positions = find_rows(doc_ids, ids)
+            rows, row_ids = matrix[positions], doc_ids[positions]
+        scores_matrix = np.atleast_2d(score_rows(queries, rows))
+        if deleted is not None and deleted.shape[0]:
+            scores_matrix[:, find_rows(row_ids, deleted)] = -np.inf
+        results = []
+        for scores in scores_matrix:
+            indices, values = top_k(scores, n)
+            results.append((values, row_ids[indices]))
+        connection.send(results)
+    connection.close()
+    del matrix, doc_ids, arrays
+    for block in blocks:
+        block.close()
+
+
+class ShardedIndex():
+    """
+    Index split by document range into shards scored in parallel processes.
+
+    The index arrays are copied once into shared memory; every worker
+    process attaches to them and scores only its range of rows, so the
+    memory is not duplicated and a query uses one core per shard. The
+    coordinator sends the query batch to all shards and merges their
+    sorted top-k lists with a heap. Batches are searched one at a time;
+    concurrent queries are best combined with a MicroBatcher.
+
+    A worker that died (its pipe is closed) is restarted and asked again;
+    if it fails once more, the results of the other shards are returned.
+
+    Attributes:
+        num_shards: Number of shards (worker processes).
+        num_rows: Number of indexed rows.
+        bounds: List of (start, end) row ranges of the shards.
+        restarts: Number of workers restarted.
+        partial: Number of batches answered without some shards.
+    """
+
+    def __init__(self, matrix, doc_ids, num_shards=None, threads_per_shard=1):
+        """
+        Copies the index into shared memory and starts the shard processes.
+
+        Args:
+            matrix: Dense matrix or CSR matrix with one row per document.
+            doc_ids: Document id of every row.
+            num_shards: Number of shards; the number of CPU cores by default.
+            threads_per_shard: Number of BLAS threads of every worker.
+        """
+        self.num_rows = matrix.shape[0]
+        self.num_shards = max(1, min(num_shards or os.cpu_count() or 1, max(self.num_rows, 1)))
+        if sparse.issparse(matrix):
+            matrix = sparse.csr_matrix(matrix)
+            arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+                      'shape': np.array(matrix.shape, dtype=np.int64)}
+        else:
+            arrays = {'matrix': np.asarray(matrix)}
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        arrays['doc_ids'] = doc_ids
+        self._blocks, self._specs = [], {}
+        for name, array in arrays.items():
+            block, self._specs[name] = share_array(array)
+            self._blocks.append(block)
+
+        edges = np.linspace(0, self.num_rows, self.num_shards + 1).astype(int)
+        self.bounds = list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+        # Document ids are sorted, so every shard owns a contiguous id range and gets only its part of a filter
+        self._id_bounds = doc_ids[edges[1:-1]]
+        self._threads_per_shard = threads_per_shard
+        self._context = mp.get_context('spawn')
+        self._connections, self._processes = [None] * self.num_shards, [None] * self.num_shards
+        self._lock = threading.Lock()
+        self.restarts = 0
+        self.partial = 0
+        self._start(range(self.num_shards))
+
+    def _start(self, shards):
+        """Starts the worker processes of the given shards, replacing dead ones."""
+        with blas_threads(self._threads_per_shard):
+            for shard in shards:
+                if self._processes[shard] is not None:
+                    self._connections[shard].close()
+                    self._processes[shard].kill()
+                    self._processes[shard].join(timeout=5)
+                start, end = self.bounds[shard]
+                parent, child = self._context.Pipe()
+                process = self._context.Process(target=serve_shard, args=(child, self._specs, start, end),
+                                                daemon=True)
+                process.start()
+                child.close()
+                self._connections[shard], self._processes[shard] = parent, process
+
+    def _split(self, ids):
+        """Splits sorted document ids into the parts owned by every shard."""
+        if ids is None:
+            return [None] * self.num_shards
+        ids = np.asarray(ids, dtype=np.int64)
+        edges = [0] + np.searchsorted(ids, self._id_bounds).tolist() + [ids.shape[0]]
+        return [ids[start:end] for start, end in zip(edges[:-1], edges[1:])]
+
+    def _ask(self, shards, requests):
+        """Sends the requests to the shards and returns the replies by shard; None for dead workers."""
+        sent = []
+        for shard in shards:
+            try:
+                self._connections[shard].send(requests[shard])
+                sent.append(shard)
+            except OSError:
+                pass
+        replies = {shard: None for shard in shards}
+        for shard in sent:
+            try:
+                replies[shard] = self._connections[shard].recv()
+            except (EOFError, OSError):
+                pass
+        return replies
+
+    def search(self, queries, n=10, ids=None, deleted=None):
+        """
+        Scores a batch of queries on all shards and merges the results.
+
+        Args:
+            queries: Query matrix (one row per query) of the same kind as the index.
+            n: Number of results to return for every query.
+            ids: Sorted document ids to score instead of the whole index, or None.
+            deleted: Sorted ids of deleted documents to leave out, or None.
+
+        Returns:
+            List with one list of tuples (score, document id) per query.
+        """
+        requests = [(queries, n, part, deleted_part)
+                    for part, deleted_part in zip(self._split(ids), self._split(deleted))]
+        with self._lock:
+            replies = self._ask(range(self.num_shards), requests)
+            dead = [shard for shard, reply in replies.items() if reply is None]
+            if dead:
+                self._start(dead)
+                self.restarts += len(dead)
+                replies.update(self._ask(dead, requests))
+                if any(reply is None for reply in replies.values()):
+                    self.partial += 1
+        shard_results = [reply for reply in replies.values() if reply is not None]
+        if not shard_results:
+            return [[] for _ in range(queries.shape[0])]
+        results = []
+        for per_shard in zip(*shard_results):
+            merged = heapq.merge(*(zip(scores.tolist(), ids.tolist()) for scores, ids in per_shard),
+                                 key=lambda item: item[0], reverse=True)
+            results.append([(score, doc_id) for score, doc_id in itertools.islice(merged, n)
+                            if np.isfinite(score)])
+        return results
+
+    def close(self):
+        """Stops the shard processes and frees the shared memory."""
+        with self._lock:
+            for connection, process in zip(self._connections, self._processes):
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+                process.join(timeout=5)
+                connection.close()
+            for block in self._blocks:
+                block.close()
+                block.unlink()
+            self._connections, self._processes, self._blocks = [], [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShardedSearcher():
+    """
+    Scatter-gather search over a TfidfSearcher or FastTextSearcher.
+
+    The queries are vectorized by the wrapped searcher in the calling
+    process. The base segment of its index is scored by a ShardedIndex,
+    with the deleted base documents sent along as tombstones; the small
+    delta segment of added documents is scored in the calling process and
+    merged in. The shards are rebuilt only when a merge replaces the base
+    segment.
+
+    Attributes:
+        searcher: The wrapped TfidfSearcher or FastTextSearcher.
+        docs_info: Object containing information about the documents.
+        num_shards: Number of shards.
+        index: The ShardedIndex.
+        base_ids: Document ids of the base segment the shards were built from.
+    """
+
+    def __init__(self, searcher, num_shards=None, threads_per_shard=1):
+        """
+        Initializes the ShardedSearcher object and starts the shards.
+
+        Args:
+            searcher: TfidfSearcher or FastTextSearcher.
+            num_shards: Number of shards; the number of CPU cores by default.
+            threads_per_shard: Number of BLAS threads of every worker.
+        """
+        self.searcher = searcher
+        self.docs_info = searcher.docs_info if hasattr(searcher, 'docs_info') else searcher.doc_info
+        self.num_shards = num_shards
+        self.threads_per_shard = threads_per_shard
+        self.index = None
+        self.base_ids = None
+        self._tombstones = (None, None)
+        self._closed_stats = {'restarts': 0, 'partial': 0}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Rebuilds the shards if the base segment of the searcher was replaced by a merge."""
+        with self._refresh_lock:
+            base, base_ids, _, _, _, _ = self.searcher.segments.snapshot()
+            if base_ids is self.base_ids:
+                return
+            index = ShardedIndex(base, base_ids, self.num_shards, self.threads_per_shard)
+            # Searches run under the lock, so the old shards are closed only once no search uses them
+            with self._lock:
+                old, self.index, self.base_ids = self.index, index, base_ids
+        if old is not None:
+            old.close()
+            self._closed_stats['restarts'] += old.restarts
+            self._closed_stats['partial'] += old.partial
+
+    def _deleted(self, base_ids, base_live):
+        """Returns the sorted ids of the deleted base documents, computed once per set of tombstones."""
+        if base_live is None:
+            return None
+        live, deleted = self._tombstones
+        if live is not base_live:
+            deleted = base_ids[~base_live]
+            self._tombstones = (base_live, deleted)
+        return deleted
+
+    @staticmethod
+    def _search_delta(queries, n, delta, delta_ids, delta_live, ids):
+        """Scores the live (and selected) rows of the delta segment; returns a result list per query."""
+        keep = np.ones(delta_ids.shape[0], dtype=bool) if delta_live is None else delta_live.copy()
+        if ids is not None:
+            keep &= np.isin(delta_ids, ids)
+        rows = np.flatnonzero(keep)
+        if rows.shape[0] == 0:
+            return None
+        results = []
+        for scores in np.atleast_2d(score_rows(queries, delta[rows])):
+            indices, values = top_k(scores, n)
+            results.append(list(zip(values.tolist(), delta_ids[rows][indices].tolist())))
+        return results
+
+    def stats(self):
+        """Returns the number of restarted shard workers and of batches answered without some shards."""
+        index = self.index
+        return {'restarts': self._closed_stats['restarts'] + index.restarts,
+                'partial': self._closed_stats['partial'] + index.partial}
+
+    def search_ids_many(self, texts, n=10, filters=None):
+        """
+        Searches for similar documents for a batch of queries.
+
+        Args:
+            texts: List of search queries.
+            n: Number of results to return for every query.
+            filters: Dictionary of date and rubric filters (see `Docs.select`)
+                applied to all queries; the shards score only the matching rows.
+
+        Returns:
+            List with one list of tuples (similarity, document id) per query.
+        """
+        self.searcher.maybe_sync()
+        selected = self.docs_info.select(filters)
+        queries = self.searcher.query_matrix(texts)
+        valid = None
+        if isinstance(queries, tuple):
+            queries, valid = queries
+        while True:
+            _, base_ids, base_live, delta, delta_ids, delta_live = self.searcher.segments.snapshot()
+            with self._lock:
+                if base_ids is self.base_ids:
+                    results = self.index.search(queries, n, ids=selected, deleted=self._deleted(base_ids, base_live))
+                    break
+            self.refresh()
+        if delta is not None:
+            delta_results = self._search_delta(queries, n, delta, delta_ids, delta_live, selected)
+            if delta_results is not None:
+                results = [list(itertools.islice(heapq.merge(result, delta_result, key=lambda item: item[0],
+                                                             reverse=True), n))
+                           for result, delta_result in zip(results, delta_results)]
+        if valid is not None:
+            return [result if is_valid else [] for result, is_valid in zip(results, valid)]
+        return results
+
+    def search_ids(self, text, n=10, filters=None):
+        """
+        Searches for similar documents and returns their ids.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+            filters: Dictionary of date and rubric filters (see `Docs.select`).
+
+        Returns:
+            List of tuples containing the similarity and the document id.
+        """
+        return self.search_ids_many([text], n, filters=filters)[0]
+
+    def search(self, text, n=10):
+        """
+        Searches for similar documents based on the input text.
+
+        Args:
+            text: The search query.
+            n: Number of results to return.
+
+        Returns:
+            List of tuples containing the similarity and the text of the document.
+        """
+        results = self.search_ids(text, n)
+        return list(zip([score for score, _ in results], self.docs_info.texts([index for _, index in results])))
+
+    def close(self):
+        """Stops the shard processes."""
+        if self.index is not None:
+            self.index.close()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from ann import IVFIndex, recall_at_k, recall_report
+from index_store import IndexFormatError
+from ranking import top_k
+
+
+def normalize(matrix):
+    return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+
+def make_clustered(num_rows=2000, dim=16, num_clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim))
+    return normalize(centers[rng.integers(0, num_clusters, num_rows)] + 0.3 * rng.normal(size=(num_rows, dim)))
+
+
+def test_recall_against_exact_search():
+    matrix = make_clustered()
+    queries = make_clustered(50, seed=1)
+    index = IVFIndex.build(matrix, nlist=20, nprobe=4)
+    report = recall_report(index, queries, k=10, nprobes=(1, 4, 20))
+    recalls = [row['recall'] for row in report[1:]]
+    assert recalls == sorted(recalls)
+    assert recalls[1] >= 0.9
+    assert recalls[2] == 1.0
+    for query in queries[:5]:
+        rows, scores = index.search(query, 10, nprobe=20)
+        assert rows.tolist() == top_k(matrix @ query, 10)[0].tolist()
+        assert scores == pytest.approx(matrix[rows] @ query)
+
+
+def test_recall_at_k():
+    assert recall_at_k([np.array([1, 2]), np.array([3, 4])], [np.array([2, 5]), np.array([3, 4])]) == 0.75
+
+
+def test_load_rejects_index_of_other_documents(tmp_path):
+    matrix, doc_ids = make_clustered(200), np.arange(200) * 2
+    IVFIndex.build(matrix, nlist=4).save(str(tmp_path), doc_ids)
+    loaded = IVFIndex.load(str(tmp_path), matrix, doc_ids)
+    assert loaded.order.tolist() == IVFIndex.build(matrix, nlist=4).order.tolist()
+    other_ids = doc_ids.copy()
+    other_ids[-1] += 1
+    with pytest.raises(IndexFormatError):
+        IVFIndex.load(str(tmp_path), matrix, other_ids)
+    with pytest.raises(IndexFormatError):
+        IVFIndex.load(str(tmp_path), matrix[:100], doc_ids[:100])
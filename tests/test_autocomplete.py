@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+from autocomplete import Autocomplete, PrefixIndex
+from preprocessing import Docs
+from query_log import QueryLog
+
+
+def brute_force(weighted, prefix, k):
+    matches = [(string, weight) for string, weight in weighted.items() if string.startswith(prefix)]
+    return sorted(matches, key=lambda item: -item[1])[:k]
+
+
+@pytest.fixture(scope='module')
+def weighted():
+    rng = np.random.default_rng(0)
+    alphabet = list('абвгд') + ['ё', 'e']
+    strings = {''.join(rng.choice(alphabet, rng.integers(1, 7))) for _ in range(3000)}
+    weights = rng.permutation(len(strings)).astype(np.float32) + 1
+    return dict(zip(sorted(strings), weights.tolist()))
+
+
+@pytest.mark.parametrize('threshold', [4, 64, 100000])
+def test_top_matches_brute_force(weighted, threshold):
+    index = PrefixIndex.build(weighted, max_completions=8, threshold=threshold)
+    assert len(index) == len(weighted)
+    if threshold < 100000:
+        assert len(index.heavy) > 0
+    for prefix in ['', 'а', 'аб', 'ё', 'eд', 'где', 'ввв', 'я']:
+        for k in (1, 3, 8):
+            assert index.top(prefix, k) == brute_force(weighted, prefix, k)
+
+
+def test_heavy_prefixes_return_at_most_max_completions(weighted):
+    index = PrefixIndex.build(weighted, max_completions=5, threshold=10)
+    assert len(index.top('а', 50)) == 5
+    assert index.top('а', 50) == brute_force(weighted, 'а', 5)
+    assert index.top('', 3) == brute_force(weighted, '', 3)
+
+
+def test_index_survives_save_and_load(tmp_path, weighted):
+    from index_store import save_index, load_index
+    index = PrefixIndex.build(weighted, max_completions=8, threshold=16)
+    save_index(str(tmp_path), 'test', index.arrays('words'))
+    arrays, _ = load_index(str(tmp_path), 'test')
+    loaded = PrefixIndex.from_arrays(arrays, 'words', 16)
+    for prefix in ['а', 'бв', 'e']:
+        assert loaded.top(prefix, 8) == index.top(prefix, 8)
+
+
+@pytest.fixture
+def docs(tmp_path):
+    texts = ['курс рубля вырос', 'курс доллара упал', 'курица и рис', 'погода в москве'] * 5
+    pd.DataFrame({'text': texts}).to_csv(tmp_path / 'corpus.csv', index=False)
+    return Docs(str(tmp_path / 'corpus.csv'), str(tmp_path / 'artifacts'), dedup_threshold=None)
+
+
+def test_completions_are_updated_from_the_query_log(tmp_path, docs):
+    log = QueryLog(str(tmp_path / 'queries.sqlite3'), interval=60)
+    try:
+        for text in ['Курс рубля', 'курс рубля', 'курс рубля', 'курс евро']:
+            log.log(text)
+        log.flush()
+        autocomplete = Autocomplete(str(tmp_path / 'index'), docs_info=docs, query_log=log, max_age=3600)
+        completions = [completion for completion, _ in autocomplete.complete('кур', 5)]
+        # The past query weighs 3 occurrences x 10 documents; one-off queries are not suggested
+        assert completions[0] == 'курс рубля' and 'курс евро' not in completions
+        assert {'курс', 'курица'} <= set(completions)
+        assert [completion for completion, _ in autocomplete.complete('курс ', 5)] == ['курс рубля']
+
+        for _ in range(2):
+            log.log('курс евро')
+        log.flush()
+        fresh = Autocomplete(str(tmp_path / 'index'), docs_info=docs, query_log=log, max_age=3600)
+        assert 'курс евро' not in dict(fresh.complete('курс ', 5))
+        rebuilt = Autocomplete(str(tmp_path / 'index'), docs_info=docs, query_log=log, max_age=0)
+        assert dict(rebuilt.complete('курс ', 5)) == {'курс рубля': 30.0, 'курс евро': 30.0}
+    finally:
+        log.close()
@@ -0,0 +1,75 @@
+import threading
+import numpy as np
+from batching import MicroBatcher
+from executor import BoundedExecutor
+from ranking import top_k
+
+
+class FakeSearcher():
+    def __init__(self, matrix, queries):
+        self.matrix = matrix
+        self.queries = queries
+        self.batches = []
+
+    def search_ids_many(self, texts, n=10, filters=None):
+        self.batches.append(list(texts))
+        scores = self.matrix @ np.array([self.queries[text] for text in texts]).T
+        return [[(score, int(index)) for index, score in zip(*top_k(column, n))] for column in scores.T]
+
+
+def make_searcher(num_queries=6):
+    rng = np.random.default_rng(0)
+    queries = {f'q{i}': rng.random(8) for i in range(num_queries)}
+    return FakeSearcher(rng.random((50, 8)), queries)
+
+
+def exact(searcher, text, n):
+    indices, scores = top_k(searcher.matrix @ searcher.queries[text], n)
+    return indices.tolist()
+
+
+def search_concurrently(search, texts):
+    results = {}
+    start = threading.Barrier(len(texts))
+
+    def worker(text, k):
+        start.wait()
+        results[text] = search(text, k)
+
+    threads = [threading.Thread(target=worker, args=(text, k + 1)) for k, text in enumerate(texts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_callers_share_one_product():
+    searcher = make_searcher()
+    batcher = MicroBatcher(searcher, window_ms=500, max_batch=6)
+    results = search_concurrently(batcher.search_ids, list(searcher.queries))
+    assert len(searcher.batches) == 1 and sorted(searcher.batches[0]) == sorted(searcher.queries)
+    for k, text in enumerate(searcher.queries):
+        assert [doc_id for _, doc_id in results[text]] == exact(searcher, text, k + 1)
+    assert batcher.stats()['mean_batch_size'] == 6
+
+
+def test_batches_are_not_limited_by_scoring_threads():
+    searcher = make_searcher()
+    batcher = MicroBatcher(searcher, window_ms=500, max_batch=6)
+    scoring = BoundedExecutor(max_workers=1, max_queue=8)
+    results = search_concurrently(lambda text, k: scoring.call_scheduled(batcher.submit, text, k),
+                                  list(searcher.queries))
+    assert len(searcher.batches) == 1
+    for k, text in enumerate(searcher.queries):
+        assert [doc_id for _, doc_id in results[text]] == exact(searcher, text, k + 1)
+    assert scoring.stats()['pending'] == 0
+    scoring.shutdown()
+
+
+def test_filtered_query_bypasses_batch():
+    searcher = make_searcher()
+    batcher = MicroBatcher(searcher, window_ms=500)
+    results = batcher.search_ids('q0', 3, filters={'rubrics': ['x']})
+    assert [doc_id for _, doc_id in results] == exact(searcher, 'q0', 3)
+    assert batcher.stats()['batches'] == 0
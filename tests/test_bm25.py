@@ -0,0 +1,100 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from preprocessing import Docs
+from search_bm25 import BM25Searcher, encode_varbyte, decode_varbyte
+
+
+WORDS = ['рынок', 'нефть', 'выборы', 'футбол', 'погода', 'банк', 'ставка', 'матч', 'снег', 'курс',
+         'рубль', 'доллар', 'президент', 'сборная', 'мороз', 'биржа', 'акция', 'закон', 'депутат', 'тренер']
+
+
+def test_varbyte_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 14 - 1, 2 ** 14, 2 ** 21, 2 ** 28 + 5, 2 ** 35 - 1])
+    buffer, num_bytes = encode_varbyte(values)
+    assert num_bytes.tolist() == [1, 1, 1, 2, 2, 2, 3, 4, 5, 5]
+    assert buffer.shape[0] == num_bytes.sum()
+    assert decode_varbyte(buffer).tolist() == values.tolist()
+    random = np.random.default_rng(0).integers(0, 2 ** 35, 1000)
+    assert decode_varbyte(encode_varbyte(random)[0]).tolist() == random.tolist()
+
+
+def exact_top(searcher, text, n):
+    """Scores every document; tied documents are taken by ascending id."""
+    vectors = searcher.docs_info.vectors.tocsc()
+    scores = np.zeros(vectors.shape[0])
+    doc_norms = np.concatenate([searcher.doc_norms] + [norms for _, _, norms in searcher.delta])
+    for term_id, weight in searcher.query_weights(text).items():
+        start, end = vectors.indptr[term_id], vectors.indptr[term_id + 1]
+        rows, tfs = vectors.indices[start:end], vectors.data[start:end].astype(np.float64)
+        scores[rows] += weight * tfs * (searcher.k1 + 1) / (tfs + doc_norms[rows])
+    scores[sorted(searcher.deleted)] = 0
+    order = np.lexsort((np.arange(scores.shape[0]), -scores))[:n]
+    return [(float(scores[idx]), int(idx)) for idx in order if scores[idx] > 0]
+
+
+@pytest.fixture
+def searcher(tmp_path):
+    rng = np.random.default_rng(0)
+    # Short documents from a small vocabulary: many postings per lemma and many tied scores
+    texts = [' '.join(rng.choice(WORDS, rng.integers(3, 12))) for _ in range(600)]
+    path = tmp_path / 'corpus.csv'
+    pd.DataFrame({'text': texts}).to_csv(path, index=False)
+    docs = Docs(str(path), str(tmp_path / 'artifacts'), dedup_threshold=None)
+    return BM25Searcher(str(tmp_path / 'bm25'), docs_info=docs)
+
+
+def test_wand_matches_exact_top_k(searcher):
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        text = ' '.join(rng.choice(WORDS, rng.integers(1, 4)))
+        for n in (1, 10, 50):
+            found, expected = searcher.search_ids(text, n), exact_top(searcher, text, n)
+            assert [score for score, _ in found] == pytest.approx([score for score, _ in expected], rel=1e-12)
+            # Scores summed in another order may differ in the last bits, which can swap documents tied at the cutoff
+            cutoff = expected[-1][0] + 1e-9
+            assert {idx for score, idx in expected if score > cutoff} <= {idx for _, idx in found}
+
+
+def test_zero_results_requested(searcher):
+    assert searcher.search_ids('нефть', 0) == []
+    assert searcher.wand(searcher.query_weights('нефть'), 0) == []
+    assert searcher.search_ids('нефть', -1, filters=None) == []
+
+
+def test_wand_keeps_the_smallest_ids_of_tied_documents(searcher):
+    for text in ('нефть', 'футбол', 'мороз'):
+        assert searcher.search_ids(text, 20) == exact_top(searcher, text, 20)
+
+
+def test_wand_skips_deleted_documents(searcher):
+    best = [idx for _, idx in searcher.search_ids('нефть', 5)]
+    searcher.delete_documents(best[:2])
+    assert searcher.search_ids('нефть', 5) == exact_top(searcher, 'нефть', 5)
+    assert not set(best[:2]) & {idx for _, idx in searcher.search_ids('нефть', 50)}
+
+
+def test_delta_grows_in_few_blocks(searcher):
+    rng = np.random.default_rng(2)
+    for size in (1, 1, 3, 1, 7, 2, 1, 5):
+        searcher.add_documents([' '.join(rng.choice(WORDS, 5)) for _ in range(size)])
+    assert sum(counts.shape[0] for _, counts, _ in searcher.delta) == 21
+    assert len(searcher.delta) <= 4
+    assert [first_id for first_id, _, _ in searcher.delta] == sorted(first_id for first_id, _, _ in searcher.delta)
+    for text in ('нефть', 'футбол банк', 'мороз снег'):
+        assert searcher.search_ids(text, 30) == pytest.approx(exact_top(searcher, text, 30))
+
+
+def test_deletions_of_the_same_size_are_picked_up(searcher):
+    first, second = [idx for _, idx in searcher.search_ids('нефть', 2)]
+    searcher.delete_documents([first])
+    assert first not in {idx for _, idx in searcher.search_ids('нефть', 50)}
+    # Another process replaces the deleted document with another one
+    path = searcher.docs_info._artifact('deleted.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump([second], f)
+    os.replace(path + '.tmp', path)
+    found = {idx for _, idx in searcher.search_ids('нефть', 50)}
+    assert first in found and second not in found
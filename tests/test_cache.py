@@ -0,0 +1,104 @@
+import pickle
+import cache
+from cache import ResultCache, SQLiteCacheBackend
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    result_cache = ResultCache(ttl=10)
+    result_cache.put('a', [1])
+    clock.now += 9
+    assert result_cache.get('a') == [1]
+    clock.now += 2
+    assert result_cache.get('a') is None
+    assert result_cache.stats()['expirations'] == 1
+    assert result_cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    result_cache = ResultCache(max_entries=2)
+    result_cache.put('a', 1)
+    result_cache.put('b', 2)
+    result_cache.get('a')
+    result_cache.put('c', 3)
+    assert result_cache.get('b') is None
+    assert result_cache.get('a') == 1 and result_cache.get('c') == 3
+    assert result_cache.stats()['evictions'] == 1
+
+
+def test_byte_cap_evicts_oldest_entries_and_skips_oversized_values():
+    size = len(pickle.dumps('x' * 100, protocol=pickle.HIGHEST_PROTOCOL))
+    result_cache = ResultCache(max_bytes=2 * size)
+    for key in 'abc':
+        result_cache.put(key, 'x' * 100)
+    assert result_cache.get('a') is None
+    assert result_cache.stats()['bytes'] == 2 * size
+    result_cache.put('big', 'x' * 1000)
+    assert result_cache.get('big') is None
+    assert result_cache.get('b') is not None
+
+
+def test_get_or_compute_computes_once():
+    result_cache = ResultCache()
+    calls = []
+    compute = lambda: calls.append(1) or [(0.5, 3)]
+    assert result_cache.get_or_compute('k', compute) == ([(0.5, 3)], False)
+    assert result_cache.get_or_compute('k', compute) == ([(0.5, 3)], True)
+    assert len(calls) == 1
+
+
+def test_get_or_compute_skips_values_that_are_not_cacheable():
+    result_cache = ResultCache()
+    assert result_cache.get_or_compute('k', lambda: [(0.5, 3)], cacheable=lambda value: False) == ([(0.5, 3)], False)
+    assert result_cache.get('k') is None
+
+
+def test_make_key_ignores_word_order_and_filter_order():
+    first = ResultCache.make_key('новости спорта', 'bm25', 10, 'v1', {'rubrics': ['b', 'a'], 'date_from': '2023-01-01'})
+    second = ResultCache.make_key('спорта новости', 'bm25', 10, 'v1', {'date_from': '2023-01-01', 'rubrics': ['a', 'b']})
+    assert first == second
+    assert first != ResultCache.make_key('спорта новости', 'bm25', 10, 'v2', {'date_from': '2023-01-01',
+                                                                              'rubrics': ['a', 'b']})
+
+
+def test_backend_keeps_running_byte_total(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'), max_bytes=10 ** 6)
+    backend.put('a', b'x' * 10, 60)
+    backend.put('b', b'x' * 20, 60)
+    backend.put('a', b'x' * 5, 60)
+    assert backend.size() == 25
+    assert backend.get('a') == b'x' * 5
+    backend.clear()
+    assert backend.size() == 0
+    reopened = SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'))
+    reopened.put('c', b'x' * 7, 60)
+    assert backend.size() == 7
+
+
+def test_backend_evicts_least_recently_used_over_cap(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'), max_bytes=100)
+    for idx in range(4):
+        clock.now += 1
+        backend.put(f'k{idx}', b'x' * 30, 60)
+    assert backend.get('k0') is None
+    assert backend.get('k3') == b'x' * 30
+    assert backend.size() <= 100
+
+
+def test_backend_shares_results_between_caches(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    first, second = ResultCache(backend=SQLiteCacheBackend(path)), ResultCache(backend=SQLiteCacheBackend(path))
+    first.put('k', [(1.0, 2)])
+    assert second.get('k') == [(1.0, 2)]
+    assert second.stats()['backend_hits'] == 1
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+from preprocessing import Docs
+from search_bm25 import BM25Searcher
+from search_tfidf import TfidfSearcher
+
+
+TEXTS = ['Россия и Украина ведут переговоры', 'Новости спорта: футбол', 'Погода в Москве хорошая',
+         'Выборы президента прошли', 'Курс рубля вырос']
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / 'corpus.csv'
+    pd.DataFrame({'text': TEXTS}).to_csv(path, index=False)
+    return str(path), str(tmp_path / 'artifacts')
+
+
+def test_refresh_picks_up_changes_of_another_process(corpus):
+    writer, reader = Docs(*corpus, dedup_threshold=None), Docs(*corpus, dedup_threshold=None)
+    assert reader.num_rows == len(TEXTS)
+    assert writer.add_documents(['Футбольный матч завершился']) == [5]
+    assert reader.num_rows == 5
+    assert reader.refresh() == writer.version
+    assert reader.num_rows == 6
+    assert reader.lemmatized_texts[5] == writer.lemmatized_texts[5]
+    assert reader.texts([5]) == ['Футбольный матч завершился']
+    writer.delete_documents([2])
+    reader.refresh()
+    assert reader.deleted == {2}
+
+
+def test_concurrent_writers_get_distinct_ids(corpus):
+    first, second = Docs(*corpus, dedup_threshold=None), Docs(*corpus, dedup_threshold=None)
+    first.num_rows, second.num_rows
+    assert first.add_documents(['Первый']) == [5]
+    assert second.add_documents(['Второй']) == [6]
+    first.delete_documents([0])
+    second.delete_documents([1])
+    assert Docs(*corpus, dedup_threshold=None).deleted == {0, 1}
+    assert Docs(*corpus, dedup_threshold=None).texts([5, 6]) == ['Первый', 'Второй']
+
+
+def test_searchers_follow_changes_made_elsewhere(corpus, tmp_path):
+    writer, docs = Docs(*corpus, dedup_threshold=None), Docs(*corpus, dedup_threshold=None)
+    bm25 = BM25Searcher(str(tmp_path / 'bm25'), docs_info=docs)
+    tfidf = TfidfSearcher(str(tmp_path / 'tfidf'), docs_info=docs)
+    assert [doc_id for _, doc_id in bm25.search_ids('футбол')] == [1]
+    writer.add_documents(['Футбол: сборная выиграла матч'])
+    assert sorted(doc_id for _, doc_id in bm25.search_ids('футбол')) == [1, 5]
+    assert {doc_id for score, doc_id in tfidf.search_ids('футбол') if score > 0} == {1, 5}
+    writer.delete_documents([1, 5])
+    assert bm25.search_ids('футбол') == []
+    assert {doc_id for score, doc_id in tfidf.search_ids('футбол') if score > 0} == set()
+
+
+def test_lemmatized_reads_single_lines(corpus):
+    docs = Docs(*corpus, dedup_threshold=None)
+    docs.add_documents(['Футбольный матч завершился'])
+    reader = Docs(*corpus, dedup_threshold=None)
+    expected = Docs(*corpus, dedup_threshold=None).lemmatized_texts
+    assert reader.lemmatized([4, 0, 5]) == [expected[4], expected[0], expected[5]]
+    assert 'lemmatized_texts' not in reader.__dict__
+
+
+STORY = 'Центральный банк сохранил ключевую ставку на прежнем уровне после заседания совета директоров'
+
+
+def test_duplicate_cluster_survives_filters_and_deletions(tmp_path):
+    path = tmp_path / 'corpus.csv'
+    pd.DataFrame({'text': [STORY, STORY, 'Новости спорта: футбол', 'Погода в Москве хорошая'],
+                  'date': ['2023-10-01', '2023-10-05', '2023-10-05', '2023-10-01']}).to_csv(path, index=False)
+    docs = Docs(str(path), str(tmp_path / 'artifacts'))
+    assert docs.canonical.tolist() == [0, 0, 2, 3]
+    tfidf = TfidfSearcher(str(tmp_path / 'tfidf'), docs_info=docs)
+    later = {'date_from': '2023-10-05'}
+    found = [doc_id for score, doc_id in tfidf.search_ids('ключевая ставка', filters=later) if score > 0]
+    assert found == [0]
+    assert docs.representatives(found, later) == [1]
+    assert docs.duplicate_ids(docs.representatives(found)) == [[1]]
+    tfidf.delete_documents([0])
+    found = [doc_id for score, doc_id in tfidf.search_ids('ключевая ставка') if score > 0]
+    assert docs.representatives(found) == [1]
+    assert docs.duplicate_ids([1]) == [[]]
+    tfidf.delete_documents([1])
+    assert [doc_id for score, doc_id in tfidf.search_ids('ключевая ставка') if score > 0] == []
@@ -0,0 +1,159 @@
+import json
+import pytest
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from engagement import EngagementBuffer
+from models import db, User, Like, NewsStats
+
+
+class FakeDocs():
+    num_rows = 100
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'news.db'}")
+    event.listen(engine, 'connect', lambda connection, _: connection.execute('PRAGMA foreign_keys=ON'))
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [{'id': idx, 'username': f'user{idx}', 'email': f'{idx}@example.com',
+                                                     'password': 'x'} for idx in (1, 2)])
+    return engine
+
+
+def make_buffer(engine, tmp_path, **kwargs):
+    return EngagementBuffer(engine, journal_path=str(tmp_path / 'engagement.journal'), interval=3600,
+                            docs_info=FakeDocs(), **kwargs)
+
+
+def crash(buffer):
+    """Stops a buffer without flushing, as if its process was killed."""
+    buffer._closed = True
+    buffer._wakeup.set()
+    buffer._thread.join()
+    buffer._journal.close()
+    buffer._journal_lock.close()
+
+
+def stored_likes(engine):
+    with engine.connect() as connection:
+        return connection.execute(select(Like.user_id, Like.news_id).order_by(Like.id)).all()
+
+
+def test_invalid_events_are_rejected_before_counting_or_journaling(engine, tmp_path):
+    buffer = make_buffer(engine, tmp_path)
+    for args in (('like', 1, 100), ('like', 1, 10 ** 12), ('like', 3, 5), ('like', 1, -1), ('share', 1, 5),
+                 ('comment', 1, 5)):
+        with pytest.raises(ValueError):
+            buffer.record(*args)
+    assert buffer.counts == {}
+    assert buffer.stats()['buffered'] == 0
+    with open(buffer.journal, encoding='utf-8') as f:
+        assert f.read() == ''
+    buffer.close()
+
+
+def test_counts_are_visible_before_flush_and_written_once(engine, tmp_path):
+    buffer = make_buffer(engine, tmp_path)
+    buffer.record('like', 1, 7)
+    buffer.record('like', 2, 7)
+    buffer.record('comment', 1, 7, text='Интересно')
+    assert buffer.counts_of([7, 8]) == [{'likes': 2, 'bookmarks': 0, 'comments': 1},
+                                        {'likes': 0, 'bookmarks': 0, 'comments': 0}]
+    assert buffer.flush() == 3
+    assert buffer.flush() == 0
+    assert stored_likes(engine) == [(1, 7), (2, 7)]
+    buffer.close()
+
+
+def test_journal_is_replayed_after_a_crash(engine, tmp_path):
+    buffer = make_buffer(engine, tmp_path)
+    buffer.record('like', 1, 3)
+    buffer.flush()
+    buffer.record('like', 2, 3)
+    buffer.record('bookmark', 2, 4)
+    crash(buffer)
+
+    restarted = make_buffer(engine, tmp_path)
+    assert restarted.counts_of([3, 4]) == [{'likes': 2, 'bookmarks': 0, 'comments': 0},
+                                           {'likes': 0, 'bookmarks': 1, 'comments': 0}]
+    restarted.flush()
+    assert stored_likes(engine) == [(1, 3), (2, 3)]
+    with engine.connect() as connection:
+        assert connection.execute(select(NewsStats.likes).where(NewsStats.news_id == 3)).scalar() == 2
+    restarted.close()
+
+
+def test_poisoned_journal_lines_are_skipped_on_replay(engine, tmp_path):
+    buffer = make_buffer(engine, tmp_path)
+    buffer.record('like', 1, 3)
+    journal = buffer.journal
+    crash(buffer)
+    with open(journal, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'seq': 2, 'kind': 'like', 'user_id': 1, 'news_id': 10 ** 12,
+                            'created_at': '2024-01-01T00:00:00'}) + '\n')
+        f.write('{"seq": 3, "kind": "like"\n')
+
+    restarted = make_buffer(engine, tmp_path)
+    assert restarted.counts_of([3]) == [{'likes': 1, 'bookmarks': 0, 'comments': 0}]
+    assert restarted.stats()['rejected'] == 1
+    restarted.flush()
+    assert stored_likes(engine) == [(1, 3)]
+    restarted.close()
+
+
+def test_flush_drops_events_rejected_by_the_database(engine, tmp_path):
+    buffer = make_buffer(engine, tmp_path)
+    buffer.record('like', 1, 5)
+    buffer.record('like', 2, 5)
+    buffer.record('like', 2, 6)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.delete().where(User.id == 2))
+    assert buffer.flush() == 1
+    assert buffer.stats()['rejected'] == 2
+    assert buffer.counts_of([5, 6]) == [{'likes': 1, 'bookmarks': 0, 'comments': 0},
+                                        {'likes': 0, 'bookmarks': 0, 'comments': 0}]
+    assert stored_likes(engine) == [(1, 5)]
+    buffer.close()
+
+
+def test_failed_flush_requeues_only_uncommitted_events(engine, tmp_path, monkeypatch):
+    buffer = make_buffer(engine, tmp_path)
+    for news_id in (1, 2, 3):
+        buffer.record('like', 1, news_id)
+    write = buffer._write
+    calls = []
+
+    def flaky_write(events):
+        calls.append(len(events))
+        if len(calls) == 1:
+            raise IntegrityError('insert', {}, Exception('batch'))
+        if len(calls) == 3:
+            raise OperationalError('insert', {}, Exception('connection lost'))
+        write(events)
+
+    monkeypatch.setattr(buffer, '_write', flaky_write)
+    assert buffer.flush() == 1
+    assert buffer.stats()['buffered'] == 2
+    assert buffer.stats()['errors'] == 1
+    monkeypatch.setattr(buffer, '_write', write)
+    assert buffer.flush() == 2
+    assert stored_likes(engine) == [(1, 1), (1, 2), (1, 3)]
+    with engine.connect() as connection:
+        assert connection.execute(select(func.sum(NewsStats.likes))).scalar() == 3
+    buffer.close()
+
+
+def test_counters_converge_across_workers(engine, tmp_path):
+    first, second = make_buffer(engine, tmp_path), make_buffer(engine, tmp_path)
+    first.record('like', 1, 9)
+    second.record('like', 2, 9)
+    first.flush()
+    assert second.counts_of([9])[0]['likes'] == 1
+    second.refresh_counts()
+    assert second.counts_of([9])[0]['likes'] == 2
+    second.flush()
+    first.refresh_counts()
+    assert first.counts_of([9])[0]['likes'] == 2
+    first.close()
+    second.close()
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import pytest
+from executor import BoundedExecutor, Overloaded
+
+
+def test_call_returns_result():
+    executor = BoundedExecutor(max_workers=1, max_queue=0)
+    assert executor.call(sum, [1, 2, 3]) == 6
+    assert executor.stats()['pending'] == 0
+    executor.shutdown()
+
+
+def test_full_queue_rejects_immediately():
+    executor = BoundedExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    executor.submit(release.wait)
+    executor.submit(release.wait)
+    with pytest.raises(Overloaded):
+        executor.call(sum, [1])
+    release.set()
+    executor.shutdown()
+    assert executor.stats()['rejected'] == 1
+
+
+def test_call_times_out_and_frees_slot_when_task_finishes():
+    executor = BoundedExecutor(max_workers=1, max_queue=0, timeout=0.05)
+    release = threading.Event()
+    with pytest.raises(FutureTimeoutError):
+        executor.call(release.wait)
+    assert executor.stats()['timed_out'] == 1
+    release.set()
+    executor.shutdown()
+    assert executor.stats()['pending'] == 0
+
+
+def test_run_awaits_result():
+    executor = BoundedExecutor(max_workers=1, max_queue=0)
+    assert asyncio.run(executor.run(sum, [4, 5])) == 9
+    executor.shutdown()
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from gensim.models import FastText
+from fasttext_compact import export_compact
+from preprocessing import Docs
+from searcher_fasttext import FastTextSearcher
+
+
+WORDS = ['рынок', 'нефть', 'выборы', 'футбол', 'погода', 'банк', 'ставка', 'матч', 'снег', 'курс',
+         'рубль', 'доллар', 'президент', 'сборная', 'мороз', 'биржа', 'акция', 'закон', 'депутат', 'тренер']
+
+
+@pytest.fixture(scope='module')
+def model():
+    rng = np.random.default_rng(0)
+    sentences = [list(rng.choice(WORDS, 6)) for _ in range(300)]
+    model = FastText(vector_size=16, min_count=1, bucket=1000, min_n=2, max_n=4, seed=0, workers=1)
+    model.build_vocab(sentences)
+    model.train(sentences, total_examples=len(sentences), epochs=5)
+    return model
+
+
+@pytest.fixture
+def make_searcher(tmp_path, model):
+    export_compact(model, str(tmp_path / 'model'), WORDS)
+    rng = np.random.default_rng(1)
+    pd.DataFrame({'text': [' '.join(rng.choice(WORDS, rng.integers(2, 8))) for _ in range(300)]}).to_csv(
+        tmp_path / 'corpus.csv', index=False)
+
+    def make_searcher(**kwargs):
+        docs = Docs(str(tmp_path / 'corpus.csv'), str(tmp_path / 'artifacts'), dedup_threshold=None)
+        return FastTextSearcher(str(tmp_path / 'model'), str(tmp_path / 'index'), doc_info=docs, **kwargs)
+
+    return make_searcher
+
+
+def exact(searcher, text, n):
+    queries, _ = searcher.query_matrix([text])
+    scores, doc_ids = searcher.segments.score(lambda matrix: queries[0] @ matrix.T)
+    order = np.argsort(-scores, kind='stable')[:n]
+    return doc_ids[order].tolist()
+
+
+def test_ann_finds_documents_added_after_build(tmp_path, make_searcher):
+    searcher = make_searcher(ann_index_file=str(tmp_path / 'ivf'), nprobe=1000)
+    added = searcher.add_documents(['газпром газпром', 'газпром', 'газпром'])
+    assert searcher.ann_ids.shape[0] == 300 and searcher.segments.delta_ids.tolist() == added
+    found = [doc_id for _, doc_id in searcher.search_ids('газпром', 10)]
+    assert set(found[:3]) == set(added)
+    assert found[3:] == exact(searcher, 'газпром', 10)[3:]
+    searcher.delete_documents(added[:1])
+    assert added[0] not in [doc_id for _, doc_id in searcher.search_ids('газпром', 10)]
+
+
+def test_ann_index_is_rebuilt_for_other_documents(tmp_path, make_searcher):
+    make_searcher(ann_index_file=str(tmp_path / 'ivf'))
+    searcher = make_searcher(ann_index_file=str(tmp_path / 'ivf'))
+    assert searcher.ann.order.shape[0] == searcher.doc_ids.shape[0]
+
+
+@pytest.mark.parametrize('rerank', [0, 20])
+def test_quantized_search_finds_documents_added_after_build(tmp_path, make_searcher, rerank):
+    searcher = make_searcher(quantized_index_file=str(tmp_path / 'int8'), rerank=rerank)
+    added = searcher.add_documents(['газпром газпром', 'газпром', 'газпром'])
+    assert searcher.compact.delta_ids.tolist() == added
+    results = searcher.search_ids('газпром', 10)
+    assert {doc_id for _, doc_id in results[:3]} == set(added)
+    assert all(type(score) is np.float64 and score <= 1.0 for score, _ in results)
+    searcher.delete_documents(added[:1])
+    assert added[0] not in [doc_id for _, doc_id in searcher.search_ids('газпром', 10)]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from gensim.models import FastText
+from fasttext_compact import CompactFastText, export_compact, ft_hash_bytes, load_model, max_difference
+
+
+WORDS = ['рынок', 'нефть', 'выборы', 'футбол', 'погода', 'банк', 'ставка', 'матч', 'снег', 'курс']
+
+
+@pytest.fixture(scope='module')
+def model():
+    rng = np.random.default_rng(0)
+    sentences = [list(rng.choice(WORDS, 6)) for _ in range(200)]
+    model = FastText(vector_size=16, min_count=1, bucket=2000, min_n=2, max_n=4, seed=0, workers=1)
+    model.build_vocab(sentences)
+    model.train(sentences, total_examples=len(sentences), epochs=5)
+    return model
+
+
+def test_vectors_match_gensim(tmp_path, model):
+    export_compact(model, str(tmp_path), words=['нефть'], top_words=5)
+    compact = load_model(str(tmp_path))
+    assert isinstance(compact, CompactFastText) and compact.vector_size == 16
+    assert len(compact.vocabulary) == 6
+    in_vocabulary = list(compact.vocabulary)
+    out_of_vocabulary = ['нефтяной', 'банкир', 'футболист', 'ёлка', 'x', 'word']
+    for word in in_vocabulary + out_of_vocabulary:
+        assert word in compact.wv
+        np.testing.assert_allclose(compact.wv[word], model.wv[word], atol=1e-6)
+    assert max_difference(compact, model, in_vocabulary + out_of_vocabulary) < 1e-6
+    # Model words that were not exported are built from their n-grams, like unknown words
+    skipped = [word for word in WORDS if word not in compact.vocabulary]
+    assert skipped and all(compact.wv[word].shape == (16,) for word in skipped)
+
+
+def test_export_without_ngrams_rejects_unknown_words(tmp_path, model):
+    export_compact(model, str(tmp_path), words=WORDS, top_words=0)
+    compact = CompactFastText(str(tmp_path))
+    compact.bucket = 0
+    assert 'нефть' in compact.wv and 'нефтяной' not in compact.wv
+    with pytest.raises(KeyError):
+        compact.wv['нефтяной']
+
+
+def test_hash_sign_extends_bytes_like_fasttext():
+    assert ft_hash_bytes(b'a') == 0xE40C292C
+    assert ft_hash_bytes('я'.encode('utf-8')) != ft_hash_bytes(bytes(b & 0x7F for b in 'я'.encode('utf-8')))
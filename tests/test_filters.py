@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from filters import MetadataIndex
+
+
+DATES = ['2023-10-03', '2023-10-01', None, '2023-10-05', 'not a date', '2023-10-01', '2023-10-04']
+RUBRICS = ['Спорт', 'Политика', 'Спорт', None, 'Экономика', 'Спорт', 'Политика']
+
+
+def brute_force(date_from=None, date_to=None, rubrics=None):
+    ids = []
+    for idx, (date, rubric) in enumerate(zip(DATES, RUBRICS)):
+        if date_from or date_to:
+            if date is None or date == 'not a date':
+                continue
+            if (date_from and date < date_from) or (date_to and date > date_to):
+                continue
+        if rubrics is not None and rubric not in rubrics:
+            continue
+        ids.append(idx)
+    return ids
+
+
+@pytest.mark.parametrize('date_from, date_to, rubrics', [
+    ('2023-10-01', '2023-10-03', None),
+    ('2023-10-02', None, None),
+    (None, '2023-10-01', None),
+    ('2023-10-06', None, None),
+    (None, None, ['Спорт']),
+    (None, None, ['Спорт', 'Политика', 'Неизвестная']),
+    ('2023-10-01', '2023-10-04', ['Политика']),
+    (None, None, []),
+])
+def test_select_matches_brute_force(date_from, date_to, rubrics):
+    index = MetadataIndex.from_columns(DATES, RUBRICS)
+    ids = index.select(date_from, date_to, rubrics)
+    assert ids.tolist() == brute_force(date_from, date_to, rubrics)
+    assert index.select(date_from, date_to, rubrics) is ids
+
+
+def test_select_without_filters_and_bad_dates():
+    index = MetadataIndex.from_columns(DATES, RUBRICS)
+    assert index.select() is None
+    with pytest.raises(ValueError):
+        index.select('01.10.2023')
+
+
+def test_save_and_load(tmp_path):
+    index = MetadataIndex.from_columns(DATES, RUBRICS)
+    index.save(str(tmp_path / 'metadata.npz'))
+    loaded = MetadataIndex.load(str(tmp_path / 'metadata.npz'))
+    assert len(loaded) == len(DATES)
+    assert np.array_equal(loaded.select('2023-10-01', '2023-10-04', ['Спорт']), [0, 5])
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from search_hybrid import HybridSearcher
+from segments import SegmentedIndex
+
+
+class FakeTfidf():
+    def __init__(self, candidates):
+        self.candidates = candidates
+        self.calls = []
+
+    def search_ids_many(self, texts, n=10, filters=None):
+        self.calls.append((n, filters))
+        allowed = None if not filters else set(filters['ids'])
+        return [[(score, doc_id) for score, doc_id in self.candidates[text] if allowed is None or doc_id in allowed][:n]
+                for text in texts]
+
+
+class FakeFastText():
+    def __init__(self, vectors, doc_ids):
+        self.segments = SegmentedIndex(np.array(vectors, dtype=np.float64), doc_ids, np.vstack)
+
+    def maybe_sync(self):
+        pass
+
+    def query_matrix(self, texts):
+        queries = np.array([[1.0, 0.0] if text else [0.0, 0.0] for text in texts])
+        return queries, np.array([bool(text) for text in texts])
+
+
+def make_hybrid(fusion='rrf', **kwargs):
+    candidates = {'q': [(0.9, 1), (0.8, 2), (0.7, 3), (0.0, 4)], '': [(0.5, 1)]}
+    # Document 3 has no FastText vector; document 1 is the least similar semantically
+    fasttext = FakeFastText([[0.0, 1.0], [1.0, 0.0], [0.6, 0.8]], [1, 2, 4])
+    return HybridSearcher(FakeTfidf(candidates), fasttext, docs_info=None, candidates=3, fusion=fusion, **kwargs)
+
+
+def test_rrf_adds_reciprocal_ranks():
+    hybrid = make_hybrid(rrf_k=10)
+    lexical, semantic = np.array([0.9, 0.8, 0.7]), np.array([0.1, 0.5, 0.3])
+    fused = hybrid.fuse(lexical, semantic, np.ones(3, dtype=bool))
+    # Lexical ranks 1, 2, 3; semantic ranks 3, 1, 2
+    assert fused == pytest.approx([1 / 11 + 1 / 13, 1 / 12 + 1 / 11, 1 / 13 + 1 / 12])
+
+
+def test_rrf_ties_keep_lexical_order_and_skip_missing_vectors():
+    hybrid = make_hybrid(rrf_k=10)
+    fused = hybrid.fuse(np.array([0.9, 0.8, 0.7]), np.array([0.5, 0.9, 0.5]), np.array([True, False, True]))
+    # Document without a vector gets no semantic term; the tied semantic scores are ranked in lexical order
+    assert fused == pytest.approx([1 / 11 + 1 / 11, 1 / 12, 1 / 13 + 1 / 12])
+
+
+def test_weighted_fusion():
+    hybrid = make_hybrid('weighted', weight=0.25)
+    fused = hybrid.fuse(np.array([0.8, 0.4]), np.array([0.2, 0.9]), np.array([True, False]))
+    assert fused == pytest.approx([0.75 * 0.8 + 0.25 * 0.2, 0.75 * 0.4])
+
+
+def test_unknown_fusion_is_rejected():
+    with pytest.raises(ValueError):
+        make_hybrid('max')
+
+
+def test_search_reranks_candidates():
+    hybrid = make_hybrid('weighted', weight=0.5)
+    results = hybrid.search_ids('q', 3)
+    # Zero-score candidate 4 is dropped; candidate 3 has no vector and keeps only its lexical half
+    assert [doc_id for _, doc_id in results] == [2, 1, 3]
+    assert [score for score, _ in results] == pytest.approx([0.9, 0.45, 0.35])
+    assert hybrid.tfidf.calls == [(3, None)]
+
+
+def test_search_without_query_vector_keeps_lexical_order():
+    hybrid = make_hybrid()
+    assert [doc_id for _, doc_id in hybrid.search_ids('', 3)] == [1]
+
+
+def test_search_passes_filters_to_candidates():
+    hybrid = make_hybrid()
+    results = hybrid.search_ids_many(['q', 'q'], 5, filters={'ids': [1, 3]})
+    assert [[doc_id for _, doc_id in result] for result in results] == [[1, 3], [1, 3]]
+    assert hybrid.tfidf.calls == [(5, {'ids': [1, 3]})]
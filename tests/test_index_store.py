@@ -0,0 +1,98 @@
+import json
+import os
+import numpy as np
+import pytest
+import index_store
+from index_store import save_index, load_index, load_vocabulary, version_dir, IndexFormatError, MANIFEST_NAME
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vocabulary = {'мир': 1, 'новость': 0}
+    save_index(str(tmp_path), 'test', {'a': np.arange(5, dtype=np.int32), 'b': np.ones((2, 3))},
+               meta={'k': 1}, vocabulary=vocabulary)
+    arrays, manifest = load_index(str(tmp_path), 'test', vocabulary=vocabulary, verify=True)
+    assert arrays['a'].tolist() == [0, 1, 2, 3, 4]
+    assert arrays['b'].shape == (2, 3)
+    assert manifest['meta'] == {'k': 1}
+    assert load_vocabulary(str(tmp_path)) == vocabulary
+
+
+def test_load_rejects_other_kind_and_vocabulary(tmp_path):
+    save_index(str(tmp_path), 'test', {'a': np.zeros(1)}, vocabulary={'a': 0})
+    with pytest.raises(IndexFormatError):
+        load_index(str(tmp_path), 'other')
+    with pytest.raises(IndexFormatError):
+        load_index(str(tmp_path), 'test', vocabulary={'b': 0})
+
+
+def test_missing_index_raises_file_not_found(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_index(str(tmp_path), 'test')
+
+
+def test_interrupted_save_keeps_previous_version(tmp_path, monkeypatch):
+    save_index(str(tmp_path), 'test', {'a': np.arange(3), 'b': np.arange(4)})
+    real_save = np.save
+    calls = []
+
+    def failing_save(f, array):
+        calls.append(array)
+        if len(calls) == 2:
+            raise OSError('disk full')
+        real_save(f, array)
+
+    monkeypatch.setattr(index_store.np, 'save', failing_save)
+    with pytest.raises(OSError):
+        save_index(str(tmp_path), 'test', {'a': np.arange(30), 'b': np.arange(40)})
+    monkeypatch.undo()
+    arrays, _ = load_index(str(tmp_path), 'test', verify=True)
+    assert arrays['a'].tolist() == [0, 1, 2]
+    assert arrays['b'].tolist() == [0, 1, 2, 3]
+
+
+def test_new_save_switches_version_and_removes_old_ones(tmp_path):
+    for size in (1, 2, 3):
+        save_index(str(tmp_path), 'test', {'a': np.arange(size)})
+    arrays, _ = load_index(str(tmp_path), 'test')
+    assert arrays['a'].shape == (3,)
+    versions = [name for name in os.listdir(tmp_path) if name.startswith(index_store.VERSION_PREFIX)]
+    assert len(versions) == 2
+    assert os.path.basename(version_dir(str(tmp_path))) in versions
+
+
+def test_array_not_matching_manifest_is_rejected(tmp_path):
+    save_index(str(tmp_path), 'test', {'a': np.arange(3, dtype=np.int64)})
+    np.save(os.path.join(version_dir(str(tmp_path)), 'a.npy'), np.arange(5, dtype=np.int32))
+    with pytest.raises(IndexFormatError):
+        load_index(str(tmp_path), 'test')
+
+
+def test_legacy_flat_layout_still_loads(tmp_path):
+    np.save(os.path.join(tmp_path, 'a.npy'), np.arange(2))
+    manifest = {'format_version': index_store.FORMAT_VERSION, 'kind': 'test', 'meta': {},
+                'arrays': {'a': {'file': 'a.npy', 'dtype': np.arange(2).dtype.str, 'shape': [2], 'sha256': ''}}}
+    with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    arrays, _ = load_index(str(tmp_path), 'test')
+    assert arrays['a'].tolist() == [0, 1]
+
+
+def test_load_reads_one_version_while_pointer_switches(tmp_path, monkeypatch):
+    save_index(str(tmp_path), 'test', {'a': np.arange(1)}, vocabulary={'старый': 0})
+    first = os.path.basename(version_dir(str(tmp_path)))
+    save_index(str(tmp_path), 'test', {'a': np.arange(2)}, vocabulary={'новый': 0})
+    real_version_dir = index_store.version_dir
+
+    def switching_version_dir(path):
+        directory = real_version_dir(path)
+        with open(os.path.join(tmp_path, index_store.POINTER_NAME), 'w') as f:
+            f.write(first)
+        return directory
+
+    monkeypatch.setattr(index_store, 'version_dir', switching_version_dir)
+    arrays, _ = load_index(str(tmp_path), 'test', vocabulary={'новый': 0})
+    assert arrays['a'].tolist() == [0, 1]
+    monkeypatch.undo()
+    directory = version_dir(str(tmp_path))
+    assert load_vocabulary(directory) == {'старый': 0}
+    assert load_index(directory, 'test')[0]['a'].tolist() == [0]
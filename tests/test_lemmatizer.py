@@ -0,0 +1,60 @@
+from pymorphy3 import MorphAnalyzer
+from lemmatizer import Lemmatizer
+
+
+WORDS = ['новости', 'рынка', 'нефти', 'выросли', 'рынок', 'новостей', 'нефть', 'рынка', 'выросли', 'рубля']
+
+
+class CountingMorph():
+    def __init__(self):
+        self.morph = MorphAnalyzer()
+        self.calls = []
+
+    def parse(self, word):
+        self.calls.append(word)
+        return self.morph.parse(word)
+
+
+def test_cached_output_matches_the_analyzer():
+    morph = CountingMorph()
+    lemmatizer = Lemmatizer(morph)
+    expected = [morph.morph.parse(word)[0].normal_form for word in WORDS]
+    assert lemmatizer.lemmatize(WORDS) == expected
+    assert lemmatizer.lemmatize(WORDS) == expected
+    assert Lemmatizer(morph, max_size=1).lemmatize(WORDS) == expected
+    assert expected[:3] == ['новость', 'рынок', 'нефть']
+
+
+def test_hits_and_misses_are_counted():
+    morph = CountingMorph()
+    lemmatizer = Lemmatizer(morph)
+    lemmatizer.lemmatize(WORDS)
+    assert len(morph.calls) == len(set(WORDS))
+    stats = lemmatizer.stats()
+    assert stats['misses'] == len(set(WORDS)) and stats['hits'] == len(WORDS) - len(set(WORDS))
+    assert stats['size'] == len(set(WORDS)) and stats['evictions'] == 0
+    assert stats['hit_rate'] == stats['hits'] / len(WORDS)
+
+
+def test_least_recently_used_entry_is_evicted_at_capacity():
+    morph = CountingMorph()
+    lemmatizer = Lemmatizer(morph, max_size=2)
+    lemmatizer.lemmatize(['рынка', 'нефти', 'рынка', 'рубля'])
+    # 'рынка' was used after 'нефти', so 'нефти' is the one evicted
+    assert list(lemmatizer.cache) == ['рынка', 'рубля']
+    assert lemmatizer.stats()['evictions'] == 1
+    lemmatizer.normal_form('нефти')
+    assert morph.calls == ['рынка', 'нефти', 'рубля', 'нефти']
+    assert len(lemmatizer.cache) == 2
+
+
+def test_save_and_load_warm_the_cache(tmp_path):
+    lemmatizer = Lemmatizer(CountingMorph())
+    lemmatizer.lemmatize(WORDS)
+    lemmatizer.save(str(tmp_path / 'lemmas.json'))
+    morph = CountingMorph()
+    warmed = Lemmatizer(morph, max_size=3)
+    assert warmed.load(str(tmp_path / 'lemmas.json'))
+    assert list(warmed.cache) == list(lemmatizer.cache)[-3:]
+    assert warmed.stats()['hits'] == 0 and morph.calls == []
+    assert not warmed.load(str(tmp_path / 'missing.json'))
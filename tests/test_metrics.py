@@ -0,0 +1,70 @@
+from time import sleep
+from metrics import Histogram, MetricsRegistry, SlowRequestProfiler, format_labels, registry, stage, trace
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.snapshot() == ([2, 3, 4], 2.65, 4)
+
+
+def test_labels_are_escaped():
+    assert format_labels(()) == ''
+    assert format_labels((('engine', 'tf-idf'), ('query', 'a "b"\\\n'))) == \
+        '{engine="tf-idf",query="a \\"b\\"\\\\\\n"}'
+
+
+def test_render_histograms_and_collectors():
+    metrics = MetricsRegistry()
+    metrics.histogram('request_seconds', 'Time to answer.', engine='bm25', cached='false')
+    metrics.observe('request_seconds', 0.5, engine='bm25', cached='false')
+    metrics.observe('request_seconds', 3.0, engine='bm25', cached='false')
+    metrics.observe('request_seconds', 0.0001, engine='tf-idf', cached='true')
+    metrics.register(lambda: [('hits_total', 3, {}), ('rows', 10, {'segment': 'base'}),
+                              ('rows', 2, {'segment': 'delta'})], {'rows': 'Index rows.'})
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ['# HELP request_seconds Time to answer.', '# TYPE request_seconds histogram']
+    assert 'request_seconds_bucket{cached="false",engine="bm25",le="0.25"} 0' in lines
+    assert 'request_seconds_bucket{cached="false",engine="bm25",le="0.5"} 1' in lines
+    assert 'request_seconds_bucket{cached="false",engine="bm25",le="+Inf"} 2' in lines
+    assert 'request_seconds_sum{cached="false",engine="bm25"} 3.5' in lines
+    assert 'request_seconds_count{cached="false",engine="bm25"} 2' in lines
+    assert 'request_seconds_bucket{cached="true",engine="tf-idf",le="0.0001"} 1' in lines
+    assert lines.count('# TYPE request_seconds histogram') == 1
+    assert lines[-7:] == ['# HELP hits_total hits_total', '# TYPE hits_total counter', 'hits_total 3.0',
+                          '# HELP rows Index rows.', '# TYPE rows gauge', 'rows{segment="base"} 10.0',
+                          'rows{segment="delta"} 2.0']
+
+
+def test_stages_go_to_the_trace_of_the_current_thread():
+    with trace() as stages:
+        with stage('score', 'bm25'):
+            pass
+        with stage('lemmatize'):
+            pass
+        with stage('lemmatize'):
+            pass
+    assert set(stages) == {'bm25.score', 'lemmatize'}
+    assert registry.histogram('search_stage_seconds', stage='score', engine='bm25').count >= 1
+    with stage('score', 'bm25'):
+        pass
+    assert set(stages) == {'bm25.score', 'lemmatize'}
+
+
+def test_profiler_keeps_only_slow_requests():
+    profiler = SlowRequestProfiler(threshold_ms=20, interval_ms=1)
+    with profiler.profile(query='fast'):
+        pass
+    with profiler.profile(query='slow') as stages:
+        with stage('render'):
+            sleep(0.05)
+    assert [record['query'] for record in profiler.recent] == ['slow']
+    record = profiler.recent[0]
+    assert record['duration_ms'] >= 50 and set(record['stages_ms']) == {'render'} and stages
+    assert record['samples'] > 0 and 'test_metrics.py' in record['stacks'][0]['stack']
+    disabled = SlowRequestProfiler()
+    with disabled.profile(query='slow') as stages:
+        with stage('render'):
+            sleep(0.01)
+    assert list(disabled.recent) == [] and set(stages) == {'render'}
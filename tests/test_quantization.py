@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from index_store import IndexFormatError
+from quantization import Int8Matrix, quantization_report
+
+
+def make_matrix(num_rows=500, dim=32, seed=0):
+    matrix = np.random.default_rng(seed).normal(size=(num_rows, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_round_trip_error_is_within_half_a_step():
+    matrix = make_matrix()
+    compact = Int8Matrix.quantize(matrix, chunk_size=64)
+    assert compact.codes.dtype == np.int8 and compact.nbytes < matrix.nbytes / 3
+    assert np.all(np.abs(compact.dequantize() - matrix) <= compact.scales[:, None] / 2 + 1e-7)
+    assert np.array_equal(Int8Matrix.quantize(np.zeros((2, 4))).codes, np.zeros((2, 4)))
+
+
+def test_score_error_is_bounded():
+    matrix, queries = make_matrix(), make_matrix(20, seed=1)
+    compact = Int8Matrix.quantize(matrix, chunk_size=64)
+    error = np.abs(compact.dot(queries) - queries @ matrix.T)
+    # Every coordinate is off by at most half a step, so a dot product by at most |query|_1 * step / 2
+    bound = np.abs(queries).sum(axis=1)[:, None] * compact.scales[None, :] / 2
+    assert np.all(error <= bound + 1e-6)
+    assert compact.dot(queries[0]).shape == (matrix.shape[0],)
+
+
+def test_slicing_and_stacking_keep_rows():
+    matrix = make_matrix(10)
+    compact = Int8Matrix.quantize(matrix)
+    stacked = Int8Matrix.vstack([compact[:4], compact[4:]])
+    assert np.array_equal(stacked.codes, compact.codes) and np.array_equal(stacked.scales, compact.scales)
+    assert np.array_equal(compact[[1, 3]].dequantize(), compact.dequantize()[[1, 3]])
+
+
+def test_save_and_load(tmp_path):
+    matrix, doc_ids = make_matrix(50), np.arange(50) * 3
+    compact = Int8Matrix.quantize(matrix)
+    compact.save(str(tmp_path), doc_ids)
+    loaded = Int8Matrix.load(str(tmp_path), doc_ids)
+    assert np.array_equal(loaded.codes, compact.codes) and np.array_equal(loaded.scales, compact.scales)
+    with pytest.raises(IndexFormatError):
+        Int8Matrix.load(str(tmp_path), doc_ids[:-1])
+
+
+def test_rerank_restores_recall():
+    report = quantization_report(make_matrix(), make_matrix(20, seed=1), k=10, reranks=(0, 5))
+    assert report['int8_bytes'] < report['float32_bytes'] / 3
+    assert report['rows'][1]['recall'] >= 0.8
+    assert report['rows'][2]['recall'] == 1.0
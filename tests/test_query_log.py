@@ -0,0 +1,47 @@
+from query_log import QueryLog
+
+
+def test_queries_are_counted_normalized(tmp_path):
+    log = QueryLog(str(tmp_path / 'queries.sqlite3'), interval=60)
+    try:
+        for text in ['Курс рубля', 'курс  рубля!', 'погода', '   ', 'x' * 500]:
+            log.log(text)
+        log.flush()
+        assert log.counts() == {'курс рубля': 2, 'погода': 1}
+        assert log.counts(min_count=2) == {'курс рубля': 2}
+        assert log.stats()['logged'] == 3
+    finally:
+        log.close()
+
+
+def test_rarest_queries_are_dropped_over_the_cap(tmp_path):
+    log = QueryLog(str(tmp_path / 'queries.sqlite3'), max_queries=2, interval=60)
+    try:
+        for text in ['первый', 'первый', 'второй', 'второй', 'третий']:
+            log.log(text)
+        log.flush()
+        assert log.counts() == {'первый': 2, 'второй': 2}
+    finally:
+        log.close()
+
+
+def test_full_queue_drops_queries(tmp_path):
+    log = QueryLog(str(tmp_path / 'queries.sqlite3'), interval=60, max_pending=1)
+    try:
+        log.log('первый')
+        log.log('второй')
+        assert log.stats()['dropped'] == 1
+    finally:
+        log.close()
+
+
+def test_close_writes_pending_queries(tmp_path):
+    path = str(tmp_path / 'queries.sqlite3')
+    log = QueryLog(path, interval=60)
+    log.log('курс рубля')
+    log.close()
+    reopened = QueryLog(path, interval=60)
+    try:
+        assert reopened.counts() == {'курс рубля': 1}
+    finally:
+        reopened.close()
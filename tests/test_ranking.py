@@ -0,0 +1,44 @@
+import numpy as np
+from ranking import top_k
+
+
+def test_top_k_orders_by_descending_score():
+    indices, scores = top_k(np.array([0.1, 0.9, 0.5, 0.7]), 2)
+    assert indices.tolist() == [1, 3]
+    assert scores.tolist() == [0.9, 0.7]
+
+
+def test_top_k_clamps_k_to_number_of_scores():
+    indices, scores = top_k(np.array([0.2, 0.4, 0.3]), 10)
+    assert indices.tolist() == [1, 2, 0]
+    assert scores.shape == (3,)
+
+
+def test_top_k_k_equal_to_number_of_scores_keeps_all():
+    indices, _ = top_k(np.array([3.0, 1.0, 2.0]), 3)
+    assert indices.tolist() == [0, 2, 1]
+
+
+def test_top_k_zero_or_negative_k_and_empty_scores():
+    for k in (0, -1):
+        indices, scores = top_k(np.array([1.0, 2.0]), k)
+        assert indices.shape == (0,) and scores.shape == (0,)
+    indices, scores = top_k(np.zeros(0), 5)
+    assert indices.shape == (0,) and scores.shape == (0,)
+
+
+def test_top_k_accepts_column_vectors():
+    indices, scores = top_k(np.array([[0.5], [0.8], [0.1]]), 2)
+    assert indices.tolist() == [1, 0]
+    assert scores.tolist() == [0.8, 0.5]
+
+
+def test_top_k_ties_keep_index_order():
+    indices, _ = top_k(np.array([1.0, 2.0, 2.0, 2.0, 0.0]), 5)
+    assert indices.tolist() == [1, 2, 3, 0, 4]
+
+
+def test_top_k_puts_minus_infinity_last():
+    indices, scores = top_k(np.array([-np.inf, 0.3, -np.inf, 0.1]), 3)
+    assert indices.tolist()[:2] == [1, 3]
+    assert np.isneginf(scores[2])
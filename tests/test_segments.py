@@ -0,0 +1,93 @@
+import threading
+import numpy as np
+from segments import SegmentedIndex
+
+
+def make_index(num_docs=100, merge_threshold=1000):
+    matrix = np.arange(num_docs, dtype=np.float64)[:, None]
+    return SegmentedIndex(matrix, np.arange(num_docs), np.vstack, merge_threshold)
+
+
+def score_ids(index):
+    scores, doc_ids = index.score(lambda matrix: matrix[:, 0])
+    return doc_ids[np.isfinite(scores)], scores[np.isfinite(scores)]
+
+
+def test_added_documents_are_scored():
+    index = make_index(10)
+    index.add(np.array([[10.0], [11.0]]), [10, 11])
+    doc_ids, scores = score_ids(index)
+    assert doc_ids.tolist() == list(range(12))
+    assert scores.tolist() == list(range(12))
+
+
+def test_deleted_documents_are_hidden():
+    index = make_index(10)
+    index.add(np.array([[10.0]]), [10])
+    index.delete([3, 10, 99])
+    doc_ids, _ = score_ids(index)
+    assert doc_ids.tolist() == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert index.is_live([2, 3, 10, 99]).tolist() == [True, False, False, False]
+
+
+def test_merge_drops_deleted_rows_and_keeps_order():
+    index = make_index(10)
+    index.add(np.array([[10.0], [11.0]]), [10, 11])
+    index.delete([0, 11])
+    index.merge()
+    assert index.delta is None
+    assert index.base_ids.tolist() == list(range(1, 11))
+    assert index.base[:, 0].tolist() == list(range(1, 11))
+
+
+def test_take_returns_live_rows_with_positions():
+    index = make_index(10)
+    index.add(np.array([[10.0]]), [10])
+    index.delete([5])
+    rows, positions = index.take(np.array([10, 5, 2, 42]))
+    assert sorted(zip(positions.tolist(), rows[:, 0].tolist())) == [(0, 10.0), (2, 2.0)]
+
+
+def test_score_restricted_to_ids():
+    index = make_index(10)
+    index.delete([4])
+    scores, doc_ids = index.score(lambda matrix: matrix[:, 0], ids=np.array([2, 4, 6]))
+    assert doc_ids.tolist() == [2, 6]
+    assert scores.tolist() == [2.0, 6.0]
+
+
+def test_concurrent_reads_during_add_delete_and_merge():
+    index = make_index(200, merge_threshold=16)
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        try:
+            while not done.is_set():
+                doc_ids, scores = score_ids(index)
+                # Every row holds its own document id, so a torn snapshot shows as a mismatch
+                assert np.array_equal(doc_ids.astype(np.float64), scores)
+                assert np.all(np.diff(doc_ids) > 0)
+        except Exception as ex:
+            errors.append(ex)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    deleted = set()
+    for first_id in range(200, 400, 8):
+        ids = np.arange(first_id, first_id + 8)
+        index.add(ids.astype(np.float64)[:, None], ids)
+        victims = [int(idx) for idx in range(0, first_id + 8, 7)]
+        index.delete(victims)
+        deleted.update(victims)
+    if index._merge_thread is not None:
+        index._merge_thread.join()
+    index.merge()
+    done.set()
+    for thread in readers:
+        thread.join()
+    assert not errors
+    doc_ids, _ = score_ids(index)
+    assert doc_ids.tolist() == [idx for idx in range(400) if idx not in deleted]
+    assert index.delta is None
@@ -0,0 +1,89 @@
+import numpy as np
+from ranking import top_k
+from segments import SegmentedIndex
+from sharding import ShardedIndex, ShardedSearcher
+
+
+def make_matrix(num_docs=60, dim=8, seed=0):
+    return np.random.default_rng(seed).random((num_docs, dim))
+
+
+def exact(matrix, doc_ids, query, n, ids=None):
+    rows = np.arange(matrix.shape[0]) if ids is None else np.flatnonzero(np.isin(doc_ids, ids))
+    indices, scores = top_k(matrix[rows] @ query, n)
+    return doc_ids[rows][indices].tolist()
+
+
+def test_filtered_search_scores_only_selected_ids():
+    matrix, doc_ids = make_matrix(), np.arange(0, 120, 2)
+    selected = np.array([4, 10, 30, 31, 62, 100, 118, 500])
+    queries = make_matrix(3, seed=1)
+    with ShardedIndex(matrix, doc_ids, num_shards=3) as index:
+        for query, result in zip(queries, index.search(queries, 4, ids=selected)):
+            assert [doc_id for _, doc_id in result] == exact(matrix, doc_ids, query, 4, selected)
+        assert index.search(queries[:1], 4, ids=np.zeros(0, dtype=np.int64)) == [[]]
+
+
+def test_dead_worker_is_restarted():
+    matrix, doc_ids = make_matrix(), np.arange(60)
+    queries = make_matrix(2, seed=2)
+    with ShardedIndex(matrix, doc_ids, num_shards=2) as index:
+        index._processes[1].kill()
+        index._processes[1].join()
+        results = index.search(queries, 5)
+        assert index.restarts == 1 and index.partial == 0
+        for query, result in zip(queries, results):
+            assert [doc_id for _, doc_id in result] == exact(matrix, doc_ids, query, 5)
+
+
+class FakeDocs():
+    def select(self, filters):
+        return None if not filters else np.array(filters['ids'])
+
+
+class FakeSearcher():
+    def __init__(self, matrix):
+        self.docs_info = FakeDocs()
+        self.segments = SegmentedIndex(matrix, np.arange(matrix.shape[0]), np.vstack, merge_threshold=100)
+
+    def maybe_sync(self):
+        pass
+
+    def query_matrix(self, texts):
+        return np.array([[float(text)] * 8 for text in texts])
+
+
+def test_searcher_filters_and_picks_up_deletions():
+    matrix = make_matrix(20)
+    searcher = FakeSearcher(matrix)
+    sharded = ShardedSearcher(searcher, num_shards=2)
+    try:
+        best = exact(matrix, np.arange(20), np.ones(8), 3)
+        assert [doc_id for _, doc_id in sharded.search_ids('1', 3)] == best
+        assert [doc_id for _, doc_id in sharded.search_ids('1', 3, filters={'ids': [2, 15]})] == \
+            exact(matrix, np.arange(20), np.ones(8), 3, [2, 15])
+        searcher.segments.delete([best[0]])
+        assert [doc_id for _, doc_id in sharded.search_ids('1', 2)] == best[1:]
+    finally:
+        sharded.close()
+
+
+def test_searcher_scores_delta_without_rebuilding_shards():
+    matrix, added = make_matrix(20), make_matrix(5, seed=3) + 0.5
+    searcher = FakeSearcher(matrix)
+    sharded = ShardedSearcher(searcher, num_shards=2)
+    try:
+        index = sharded.index
+        searcher.segments.add(added, np.arange(20, 25))
+        searcher.segments.delete([0, 21])
+        every = np.vstack((matrix, added))
+        live = np.array([doc_id for doc_id in range(25) if doc_id not in (0, 21)])
+        assert [doc_id for _, doc_id in sharded.search_ids('1', 6)] == exact(every, np.arange(25), np.ones(8), 6, live)
+        assert [doc_id for _, doc_id in sharded.search_ids('1', 3, filters={'ids': [0, 5, 21, 22]})] == \
+            exact(every, np.arange(25), np.ones(8), 3, [5, 22])
+        assert sharded.index is index
+        searcher.segments.merge()
+        assert [doc_id for _, doc_id in sharded.search_ids('1', 6)] == exact(every, np.arange(25), np.ones(8), 6, live)
+        assert sharded.index is not index and sharded.index.num_rows == 23
+    finally:
+        sharded.close()
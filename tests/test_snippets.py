@@ -0,0 +1,27 @@
+from preprocessing import make_snippet, lemmatize, get_tokens, remove_punctuation, text_lowercase
+
+
+def lemmatized(text):
+    return ' '.join(lemmatize(get_tokens(remove_punctuation(text_lowercase(text)))))
+
+
+TEXT = ('В понедельник — как и ожидалось — прошли переговоры. ' * 5 +
+        '«Сборная России» выиграла матчи, сообщили в федерации футбола. ' + 'Продолжение следует. ' * 10)
+
+
+def test_snippet_from_lemmatized_text_matches_word_by_word_lemmatization():
+    for query in ('футбол', 'матч', 'сборные', 'переговор', 'погода'):
+        assert make_snippet(TEXT, query, 60, lemmatized=lemmatized(TEXT)) == make_snippet(TEXT, query, 60)
+
+
+def test_snippet_starts_near_first_query_word():
+    snippet = make_snippet(TEXT, 'матч', 60, lemmatized=lemmatized(TEXT))
+    assert snippet.startswith('...') and 'матчи' in snippet
+
+
+def test_snippet_falls_back_when_lemmas_do_not_match_text():
+    assert 'матчи' in make_snippet(TEXT, 'матч', 60, lemmatized='слово ' * 500 + 'матч')
+
+
+def test_short_text_is_not_cut():
+    assert make_snippet('Курс рубля вырос', 'рубль', lemmatized='курс рубль вырасти') == 'Курс рубля вырос'